@@ -0,0 +1,70 @@
+"""
+Measures deflate payload size and encode time per column and prefilter on a
+synthetic training trace, to choose default_filters.
+
+    python benchmarks/bench_compression.py --steps 2000 --configs 50
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from rows2prose.encoding import ColumnEncoder, deflate
+
+
+def make_trace(n_steps, n_configs, seed=0):
+    rng = np.random.default_rng(seed)
+    n = n_steps * n_configs
+    steps = np.arange(n_steps)
+    decay = np.exp(-steps / (n_steps / 4))
+    return pd.DataFrame({
+        "i_timestep": np.repeat(steps, n_configs),
+        "i_config": np.tile(np.arange(n_configs), n_steps),
+        # smooth, slowly decreasing per config
+        "loss": (np.outer(decay, rng.uniform(1, 3, n_configs))
+                 + 0.01 * rng.standard_normal((n_steps, n_configs))).ravel(),
+        # piecewise constant
+        "lr": np.repeat(0.1 * 0.5 ** (steps // (n_steps // 4 + 1)),
+                        n_configs),
+        # noisy, heavy tailed
+        "grad_norm": rng.lognormal(0, 1, n),
+        # random walk per config
+        "param": np.cumsum(0.01 * rng.standard_normal((n_steps, n_configs)),
+                           axis=0).ravel(),
+    })
+
+
+FILTER_CHOICES = [(), ("shuffle",), ("delta",), ("delta", "shuffle")]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--steps", type=int, default=2000)
+    parser.add_argument("--configs", type=int, default=50)
+    parser.add_argument("--level", type=int, default=6)
+    args = parser.parse_args()
+
+    df = make_trace(args.steps, args.configs)
+    print(f"{len(df)} rows. Size is compressed / raw bytes; "
+          "time is deflate only.")
+    for precision in [None, "float32", "uint16"]:
+        encoder = ColumnEncoder(precision=precision)
+        print(f"\nprecision={precision}")
+        print(f"{'column':>12} {'type':>8} {'filters':>16} {'size':>8} "
+              f"{'ms':>8}")
+        for col in df.columns:
+            values = encoder.encode_values(df[col].to_numpy())["data"]
+            for filters in FILTER_CHOICES:
+                if "delta" in filters and values.dtype.kind not in "iu":
+                    continue
+                t0 = time.perf_counter()
+                compressed = deflate(values, filters, args.level)
+                ms = 1000 * (time.perf_counter() - t0)
+                print(f"{col:>12} {str(values.dtype):>8} "
+                      f"{'+'.join(filters) or 'none':>16} "
+                      f"{len(compressed) / values.nbytes:>8.3f} {ms:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Compares peak RSS and wall time of the column encoder against the previous
+df.copy() + per-column base64 path.
+
+    python benchmarks/bench_encode.py --rows 5000000 --columns 8
+
+Each path runs in its own subprocess so that peak RSS is measured
+independently.
+"""
+import argparse
+import base64
+import json
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+
+def legacy_df_to_custom_json(df):
+    df2 = df.copy()
+    for col in df2.columns:
+        if df2[col].dtype == np.int64:
+            df2[col] = df2[col].astype(np.int32)
+        elif df2[col].dtype == np.uint64:
+            df2[col] = df2[col].astype(np.uint32)
+
+    return json.dumps({
+        col: {
+            "type": str(df2[col].dtype),
+            "data": base64.b64encode(
+                np.ascontiguousarray(df2[col].values)).decode("utf-8")
+        }
+        for col in df2.columns
+    })
+
+
+def make_df(n_rows, n_columns):
+    rng = np.random.default_rng(0)
+    columns = {"i_timestep": np.repeat(np.arange(n_rows // 100 + 1),
+                                       100)[:n_rows]}
+    for i in range(n_columns - 1):
+        columns[f"metric{i}"] = rng.standard_normal(n_rows)
+    return pd.DataFrame(columns)
+
+
+def max_rss_mb():
+    # ru_maxrss is in kilobytes on Linux, bytes on macOS.
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1 << 20 if sys.platform == "darwin" else 1 << 10)
+
+
+def run_one(path, n_rows, n_columns):
+    from rows2prose.web import df_to_custom_json
+
+    encode = {"legacy": legacy_df_to_custom_json,
+              "encoder": df_to_custom_json}[path]
+    df = make_df(n_rows, n_columns)
+    baseline = max_rss_mb()
+    t0 = time.perf_counter()
+    s = encode(df)
+    elapsed = time.perf_counter() - t0
+    print(json.dumps({"path": path,
+                      "seconds": elapsed,
+                      "peak_rss_mb": max_rss_mb() - baseline,
+                      "payload_mb": len(s) / (1 << 20)}))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--columns", type=int, default=8)
+    parser.add_argument("--path", choices=["legacy", "encoder"])
+    args = parser.parse_args()
+
+    if args.path is not None:
+        run_one(args.path, args.rows, args.columns)
+        return
+
+    print(f"rows={args.rows} columns={args.columns}")
+    for path in ["legacy", "encoder"]:
+        out = subprocess.run(
+            [sys.executable, __file__, "--path", path,
+             "--rows", str(args.rows), "--columns", str(args.columns)],
+            check=True, capture_output=True, text=True).stdout
+        r = json.loads(out)
+        print(f"{path:>8}: {r['seconds']:.3f}s, "
+              f"peak RSS +{r['peak_rss_mb']:.0f} MB, "
+              f"payload {r['payload_mb']:.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Tracks the import time of rows2prose with `python -X importtime`.
+
+    python benchmarks/bench_import.py
+
+Exits non-zero if the best of several runs exceeds the budget, or if a
+module that is known to be slow to import gets imported eagerly.
+"""
+import argparse
+import subprocess
+import sys
+
+
+# Cumulative import time budget for `import rows2prose.notebook`, in
+# milliseconds. Most of it is numpy.
+BUDGET_MS = 250
+
+# Modules that must only be imported on first use.
+FORBIDDEN = ["pkg_resources", "IPython"]
+
+
+def import_times(module):
+    """
+    Returns {module_name: cumulative_microseconds} for one fresh interpreter.
+    """
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        check=True, capture_output=True, text=True).stderr
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--module", default="rows2prose.notebook")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=BUDGET_MS)
+    args = parser.parse_args()
+
+    runs = [import_times(args.module) for _ in range(args.runs)]
+    best_ms = min(times[args.module] for times in runs) / 1000
+    slowest = sorted(runs[0].items(), key=lambda kv: -kv[1])[1:6]
+
+    print(f"import {args.module}: {best_ms:.1f} ms "
+          f"(best of {args.runs}, budget {args.budget_ms:.0f} ms)")
+    for name, us in slowest:
+        print(f"  {name}: {us / 1000:.1f} ms")
+
+    failed = False
+    for name in FORBIDDEN:
+        if any(m == name or m.startswith(name + ".") for m in runs[0]):
+            print(f"FAIL: {name} is imported eagerly")
+            failed = True
+    if best_ms > args.budget_ms:
+        print("FAIL: over budget")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Measures how column encoding scales with the number of threads
+(ColumnEncoder's executor) and how block rendering scales with the number
+of processes (static_many).
+
+    python benchmarks/bench_parallel.py --rows 2000000 --columns 16
+
+Threads only speed up the parts of encoding that release the GIL, such as
+casting, quantizing and compressing; base64 encoding runs on the calling
+thread. Processes parallelize everything, at the cost of pickling each
+block's DataFrame to its worker.
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from rows2prose.encoding import ColumnEncoder
+from rows2prose.web import Snapshot, static, static_many
+
+
+def make_df(n_rows, n_columns):
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({f"metric{i}": rng.standard_normal(n_rows)
+                         for i in range(n_columns)})
+
+
+def worker_counts():
+    n, counts = os.cpu_count() or 1, []
+    k = 1
+    while k < n:
+        counts.append(k)
+        k *= 2
+    return counts + [n]
+
+
+def best_of(f, repeat):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        f()
+        times.append(time.perf_counter() - t0)
+    return min(times)
+
+
+def bench_threads(df, repeat):
+    print(f"\nThreads: ColumnEncoder(precision='uint16', "
+          f"compression='deflate').to_json on {df.shape}")
+    print(f"{'threads':>8} {'seconds':>8} {'speedup':>8}")
+    serial = None
+    for n in worker_counts():
+        with ThreadPoolExecutor(n) as executor:
+            encoder = ColumnEncoder(precision="uint16",
+                                    compression="deflate",
+                                    executor=executor)
+            seconds = best_of(lambda: encoder.to_json(df), repeat)
+        serial = serial or seconds
+        print(f"{n:>8} {seconds:>8.3f} {serial / seconds:>8.2f}")
+
+
+def bench_processes(df, n_blocks, repeat):
+    html = "".join(f'<span data-key="{col}"></span>' for col in df.columns)
+    blocks = [(df, html, Snapshot())] * n_blocks
+    print(f"\nProcesses: static_many over {n_blocks} blocks of {df.shape}")
+    print(f"{'workers':>8} {'seconds':>8} {'speedup':>8}")
+    serial = best_of(lambda: [static(*block) for block in blocks], repeat)
+    print(f"{'serial':>8} {serial:>8.3f} {1:>8.2f}")
+    for n in worker_counts():
+        seconds = best_of(lambda: static_many(blocks, max_workers=n), repeat)
+        print(f"{n:>8} {seconds:>8.3f} {serial / seconds:>8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--columns", type=int, default=16)
+    parser.add_argument("--blocks", type=int, default=16)
+    parser.add_argument("--block-rows", type=int, default=200_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} CPUs")
+    bench_threads(make_df(args.rows, args.columns), args.repeat)
+    bench_processes(make_df(args.block_rows, args.columns), args.blocks,
+                    args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,306 @@
+"""
+Benchmarks the paths a release must not regress, over a grid of frame
+shapes:
+
+    df_to_dict, df_to_custom_json   encoding columns
+    static, full_html               generating a page
+    set_data_script, set_data_comm  NotebookUpdater.set_data, without and
+                                    with a comm
+
+    python benchmarks/bench_suite.py --rows 10000 1000000 --columns 4 16 \\
+        --dtypes float64 float32 int64 --timesteps 1 100
+
+For each case and shape, it reports wall time (best of --repeat), peak RSS
+growth while the case runs, and payload bytes. Every measurement runs in a
+fresh subprocess so that peak memory is measured independently. --json
+writes the results, e.g. to compare releases.
+
+With --js, it also writes a fixture per shape for the Timeline and
+distribution views and runs benchmarks/js/bench_render.mjs on them under
+Node, which reports parse time, first render time and per-frame render
+times headlessly and offline. That requires node, and d3 from
+`npm install` in js/.
+"""
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+
+CASES = ("df_to_dict", "df_to_custom_json", "static", "full_html",
+         "set_data_script", "set_data_comm")
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# Benchmark this checkout, whether or not the package is installed. The
+# --run-one subprocesses run this file too, so they import the same one.
+sys.path.insert(0, os.path.dirname(HERE))
+
+
+def make_df(n_rows, n_columns, dtype, n_timesteps):
+    """
+    n_columns metric columns of dtype, plus i_timestep, with the rows split
+    evenly between n_timesteps timesteps.
+    """
+    rng = np.random.default_rng(0)
+    columns = {"i_timestep": np.repeat(np.arange(n_timesteps),
+                                       -(-n_rows // n_timesteps))[:n_rows]}
+    for i in range(n_columns):
+        values = rng.standard_normal(n_rows) * 1000
+        columns[f"metric{i}"] = values.astype(dtype)
+    return pd.DataFrame(columns)
+
+
+def make_script(df):
+    from rows2prose.web import DistributionTimeline
+    keys = [c for c in df.columns if c != "i_timestep"]
+    html = "".join(f'<span class="dist" data-key="{k}"></span>' for k in keys)
+    script = DistributionTimeline(DistributionTimeline.scalar_view("dist"))
+    return html, script
+
+
+def max_rss_mb():
+    # ru_maxrss is in kilobytes on Linux, bytes on macOS.
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1 << 20 if sys.platform == "darwin" else 1 << 10)
+
+
+class CountingComm:
+    """
+    Stands in for a kernel comm, counting the bytes sent over it, whose
+    frontend target is ready as soon as it is listened to.
+    """
+    def __init__(self):
+        self.nbytes = 0
+
+    def on_msg(self, callback):
+        callback({"content": {"data": {"method": "ready"}}})
+
+    def on_close(self, callback):
+        pass
+
+    def send(self, data, buffers=()):
+        self.nbytes = (len(json.dumps(data))
+                       + sum(memoryview(b).nbytes for b in buffers))
+
+
+def case_function(case, df):
+    """
+    Returns f, which runs the case on df once and returns its payload size
+    in bytes.
+    """
+    from rows2prose.notebook import NotebookUpdater
+    from rows2prose.web import df_to_custom_json, df_to_dict, full_html, static
+
+    html, script = make_script(df)
+    columns = script.referenced_columns(html)
+    if case == "df_to_dict":
+        return lambda: len(json.dumps(df_to_dict(df, ("i_timestep",))))
+    if case == "df_to_custom_json":
+        return lambda: len(df_to_custom_json(df, ("i_timestep",)))
+    if case == "static":
+        return lambda: len(static(df, html, script))
+    if case == "full_html":
+        return lambda: len(full_html(static(df, html, script)))
+    if case == "set_data_script":
+        # Outside a notebook, IPython prints each displayed object.
+        with contextlib.redirect_stdout(io.StringIO()):
+            updater = NotebookUpdater("bench", script.dynamic_set_data_js,
+                                      index_columns=script.index_columns,
+                                      encoder=script.encoder,
+                                      columns=columns)
+
+        def set_data():
+            with contextlib.redirect_stdout(io.StringIO()):
+                updater.set_data(df)
+            return len(script.dynamic_set_data_js(df, columns))
+        return set_data
+    if case == "set_data_comm":
+        comm = CountingComm()
+        with contextlib.redirect_stdout(io.StringIO()):
+            updater = NotebookUpdater("bench", script.dynamic_set_data_js,
+                                      comm=comm,
+                                      index_columns=script.index_columns,
+                                      encoder=script.encoder,
+                                      columns=columns)
+
+        def set_data():
+            updater.set_data(df)
+            return comm.nbytes
+        return set_data
+    raise ValueError(f"Unknown case {case!r}")
+
+
+def run_one(case, n_rows, n_columns, dtype, n_timesteps, repeat):
+    df = make_df(n_rows, n_columns, dtype, n_timesteps)
+    try:
+        f = case_function(case, df)
+    except ImportError as e:
+        return {"skipped": str(e)}
+    rss_before = max_rss_mb()
+    seconds, nbytes = [], None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        nbytes = f()
+        seconds.append(time.perf_counter() - t0)
+    return {"seconds": min(seconds),
+            "peak_mb": max_rss_mb() - rss_before,
+            "payload_bytes": nbytes}
+
+
+def measure(case, shape, repeat):
+    n_rows, n_columns, dtype, n_timesteps = shape
+    out = subprocess.run(
+        [sys.executable, __file__, "--run-one", case, str(n_rows),
+         str(n_columns), dtype, str(n_timesteps), "--repeat", str(repeat)],
+        check=True, capture_output=True, text=True)
+    return json.loads(out.stdout)
+
+
+def write_fixtures(shape, directory):
+    """
+    Writes a bench_render.mjs fixture for a Timeline and a
+    DistributionTimeline over a frame of the given shape, and returns their
+    paths.
+    """
+    from rows2prose.web import DistributionTimeline, Timeline
+
+    n_rows, n_columns, dtype, n_timesteps = shape
+    df = make_df(n_rows, n_columns, dtype, n_timesteps)
+    keys = [c for c in df.columns if c != "i_timestep"]
+    views = {
+        "timeline": (Timeline(Timeline.positive_scalar_view("value")),
+                     "value"),
+        "distribution": (
+            DistributionTimeline(DistributionTimeline.scalar_view("dist")),
+            "dist"),
+        "distribution_binned": (
+            DistributionTimeline(DistributionTimeline.density_view("dist"),
+                                 bins=64),
+            "dist"),
+    }
+    paths = []
+    for name, (script, class_name) in views.items():
+        elements = [{"tag": "span", "className": class_name, "key": k}
+                    for k in keys]
+        columns = set(keys) | set(script.required_columns)
+        fixture = {
+            "name": name,
+            "shape": {"rows": n_rows, "columns": n_columns, "dtype": dtype,
+                      "timesteps": n_timesteps},
+            "payload": script.encoder.to_json(df, script.index_columns,
+                                              columns),
+            "render": script.static_js(df, columns),
+            "elements": elements,
+        }
+        path = os.path.join(directory, f"{name}-{n_rows}-{n_columns}-"
+                            f"{dtype}-{n_timesteps}.json")
+        with open(path, "w") as f:
+            json.dump(fixture, f)
+        paths.append(path)
+    return paths
+
+
+def run_js(shapes, points):
+    with tempfile.TemporaryDirectory() as directory:
+        paths = [p for shape in shapes
+                 for p in write_fixtures(shape, directory)]
+        out = subprocess.run(
+            ["node", os.path.join(HERE, "js", "bench_render.mjs"),
+             "--points", ",".join(map(str, points))] + paths,
+            check=True, capture_output=True, text=True)
+    return [json.loads(line) for line in out.stdout.splitlines()]
+
+
+def print_js_results(results):
+    print(f"\n{'view':<20} {'rows':>9} {'cols':>5} {'steps':>6} "
+          f"{'parse ms':>9} {'first ms':>9} {'update p50':>11} "
+          f"{'frame p50':>10} {'frame p95':>10}")
+    for r in results:
+        if r["name"] == "draw":
+            continue
+        shape = r["shape"]
+        head = (f"{r['name']:<20} {shape['rows']:>9} {shape['columns']:>5} "
+                f"{shape['timesteps']:>6}")
+        if "skipped" in r or "error" in r:
+            print(f"{head}  {r.get('skipped') or r.get('error')}")
+            continue
+        frame = r["frame_ms"]
+        print(f"{head} {r['parse_ms']:>9.2f} {r['first_render_ms']:>9.2f} "
+              f"{r['update_ms']['median']:>11.3f} "
+              f"{frame.get('median', 0):>10.3f} {frame.get('p95', 0):>10.3f}")
+
+    draws = [r for r in results if r["name"] == "draw"]
+    if draws:
+        print(f"\n{'points':>9} {'positions ms':>13} {'dots ms':>9} "
+              f"{'density ms':>11} {'histograms ms':>14}")
+        for r in draws:
+            print(f"{r['points']:>9} {r['pixel_positions_ms']:>13.3f} "
+                  f"{r['dots_ms']:>9.3f} {r['density_ms']:>11.3f} "
+                  f"{r['histograms_ms']:>14.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, nargs="+",
+                        default=[10_000, 1_000_000])
+    parser.add_argument("--columns", type=int, nargs="+", default=[4, 16])
+    parser.add_argument("--dtypes", nargs="+", default=["float64"])
+    parser.add_argument("--timesteps", type=int, nargs="+",
+                        default=[1, 100])
+    parser.add_argument("--cases", nargs="+", choices=CASES, default=CASES)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", help="also write the results here")
+    parser.add_argument("--js", action="store_true",
+                        help="also run the headless JS benchmarks")
+    parser.add_argument("--points", type=int, nargs="+",
+                        default=[1_000, 100_000],
+                        help="point counts for the JS draw loops")
+    parser.add_argument("--run-one", nargs=5, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one:
+        case, n_rows, n_columns, dtype, n_timesteps = args.run_one
+        print(json.dumps(run_one(case, int(n_rows), int(n_columns), dtype,
+                                 int(n_timesteps), args.repeat)))
+        return
+
+    shapes = list(itertools.product(args.rows, args.columns, args.dtypes,
+                                    args.timesteps))
+    results = []
+    print(f"{'case':<18} {'rows':>9} {'cols':>5} {'dtype':>8} {'steps':>6} "
+          f"{'seconds':>8} {'peak MB':>8} {'payload MB':>11}")
+    for shape, case in itertools.product(shapes, args.cases):
+        n_rows, n_columns, dtype, n_timesteps = shape
+        r = measure(case, shape, args.repeat)
+        results.append(dict(r, case=case, rows=n_rows, columns=n_columns,
+                            dtype=dtype, timesteps=n_timesteps))
+        head = (f"{case:<18} {n_rows:>9} {n_columns:>5} {dtype:>8} "
+                f"{n_timesteps:>6}")
+        if "skipped" in r:
+            print(f"{head}  skipped: {r['skipped']}")
+        else:
+            print(f"{head} {r['seconds']:>8.3f} {r['peak_mb']:>8.1f} "
+                  f"{r['payload_bytes'] / 1e6:>11.2f}")
+
+    js_results = []
+    if args.js:
+        js_results = run_js(shapes, args.points)
+        print_js_results(js_results)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"python": results, "js": js_results}, f, indent=1)
+
+
+if __name__ == "__main__":
+    main()
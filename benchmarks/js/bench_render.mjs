@@ -0,0 +1,207 @@
+// Headless benchmark of rows2prose's browser side, run under Node with the
+// stub DOM and canvas of dom.mjs, entirely offline:
+//
+//     node benchmarks/js/bench_render.mjs [--points 1000,100000] FIXTURE...
+//
+// Each fixture is a JSON file written by benchmarks/bench_suite.py --js,
+// holding a block's encoded payload, its static_js render function and the
+// elements its html declares. For each, this reports the time to parse the
+// payload, to render the block the first time, and to render every
+// timestep through the hidden time state, frame by frame, including the
+// animation frames each step schedules. --points times the canvas draw
+// loops on their own.
+//
+// Everything but the draw loops requires d3, from `npm install` in js/.
+// Prints one JSON object per line.
+import { readFileSync } from "fs";
+import { createRequire, register } from "module";
+import { pathToFileURL } from "url";
+
+import { flushFrame, installDOM, pendingFrames } from "./dom.mjs";
+
+register("./loader.mjs", import.meta.url);
+
+const jsDir = new URL("../../js/", import.meta.url),
+      document = installDOM();
+
+function elapsedMs(start) {
+  return Number(process.hrtime.bigint() - start) / 1e6;
+}
+
+function summarize(times) {
+  const sorted = Float64Array.from(times).sort(),
+        at = q => sorted[Math.min(sorted.length - 1,
+                                  Math.floor(q * sorted.length))];
+  return sorted.length
+    ? {n: sorted.length, median: at(0.5), p95: at(0.95),
+       max: sorted[sorted.length - 1]}
+    : {n: 0};
+}
+
+function bestOf(repeat, f) {
+  let best = Infinity;
+  for (let i = 0; i < repeat; i++) {
+    const start = process.hrtime.bigint();
+    f();
+    best = Math.min(best, elapsedMs(start));
+  }
+  return best;
+}
+
+// Runs animation frames until none are requested, timing each, up to a
+// second of virtual time.
+function runFrames(frameTimes) {
+  for (let i = 0; i < 60 && pendingFrames(); i++) {
+    const start = process.hrtime.bigint();
+    flushFrame();
+    frameTimes.push(elapsedMs(start));
+  }
+}
+
+async function settle() {
+  // Lets loadColumns' promises, and any timers they wait on, resolve.
+  await new Promise(resolve => setTimeout(resolve, 0));
+}
+
+function drawCalls(container) {
+  let calls = {};
+  container.querySelectorAll("canvas").forEach(canvas => {
+    const ctx = canvas._context;
+    if (ctx) {
+      Object.entries(ctx.calls).forEach(([name, n]) => {
+        calls[name] = (calls[name] || 0) + n;
+      });
+    }
+  });
+  return calls;
+}
+
+async function loadD3() {
+  try {
+    const path = createRequire(new URL("package.json", jsDir)).resolve("d3");
+    return await import(pathToFileURL(path));
+  } catch (error) {
+    return null;
+  }
+}
+
+async function benchFixture(fixture, r2p) {
+  const result = {name: fixture.name, shape: fixture.shape};
+  if (r2p === null) {
+    result.skipped = "d3 is not installed; run npm install in js/";
+    return result;
+  }
+
+  const payload = fixture.payload;
+  result.parse_ms = bestOf(3, () => r2p.parseColumns(JSON.parse(payload)));
+
+  const container = document.createElement("div");
+  fixture.elements.forEach(({tag, className, key}) => {
+    const element = document.createElement(tag);
+    element.setAttribute("class", className);
+    if (key !== null) {
+      element.setAttribute("data-key", key);
+    }
+    container.appendChild(element);
+  });
+  document.body.appendChild(container);
+
+  const render = new Function(`return (${fixture.render});`)(),
+        start = process.hrtime.bigint();
+  render(container);
+  let timeState = null;
+  for (let i = 0; i < 1000 && timeState === null; i++) {
+    await settle();
+    timeState = container.querySelector(".timeState");
+  }
+  result.first_render_ms = elapsedMs(start);
+  if (timeState === null) {
+    result.error = "the block never rendered its time state";
+    return result;
+  }
+  runFrames([]);
+
+  // Steps through every timestep the way the time control does.
+  const nSteps = fixture.shape.timesteps,
+        updateTimes = [],
+        frameTimes = [];
+  for (let i = 0; i < nSteps; i++) {
+    const start = process.hrtime.bigint();
+    timeState._r2pState.selectTimestep(i);
+    updateTimes.push(elapsedMs(start));
+    runFrames(frameTimes);
+  }
+  result.update_ms = summarize(updateTimes);
+  result.frame_ms = summarize(frameTimes);
+  result.draw_calls = drawCalls(container);
+
+  container.parentNode.removeChild(container);
+  return result;
+}
+
+function benchDraw(points, n) {
+  const canvas = document.createElement("canvas");
+  canvas.setAttribute("width", 1200);
+  canvas.setAttribute("height", 120);
+  const ctx = canvas.getContext("2d"),
+        values = Float64Array.from({length: n}, () => Math.random()),
+        scale = Object.assign(x => x * 1200, {
+          domain: () => [0, 1],
+          range: () => [0, 1200],
+        }),
+        sprite = points.dotSprite(10, "blue", 0.4),
+        counts = Int32Array.from({length: 64 * 100}, () => n / 6400),
+        edges = Float64Array.from({length: 65}, (_, i) => i / 64);
+
+  return {
+    name: "draw",
+    points: n,
+    pixel_positions_ms: bestOf(5, () => points.pixelPositions(values, scale)),
+    dots_ms: bestOf(3, () => points.drawDots(
+      ctx, points.pixelPositions(values, scale), 60, sprite)),
+    density_ms: bestOf(5, () => points.drawDensity(
+      ctx, points.pixelPositions(values, scale), null, 1, _ => 60, 20,
+      canvas.width, "blue", 0.4)),
+    histograms_ms: bestOf(5, () => points.drawHistograms(
+      ctx, counts, 100, points.pixelPositions(edges, scale), row => row,
+      1, "blue")),
+  };
+}
+
+async function main() {
+  const args = process.argv.slice(2);
+  let pointCounts = [],
+      fixturePaths = [];
+  for (let i = 0; i < args.length; i++) {
+    if (args[i] == "--points") {
+      pointCounts = args[++i].split(",").map(Number);
+    } else {
+      fixturePaths.push(args[i]);
+    }
+  }
+
+  const points = await import(new URL("src/points.js", jsDir)),
+        d3 = await loadD3();
+  let r2p = null;
+  if (d3 !== null) {
+    globalThis.d3 = d3;
+    r2p = globalThis.r2p = await import(new URL("index.js", jsDir));
+  }
+
+  pointCounts.forEach(n => console.log(JSON.stringify(benchDraw(points, n))));
+  for (const path of fixturePaths) {
+    const fixture = JSON.parse(readFileSync(path, "utf8"));
+    let result;
+    try {
+      result = await benchFixture(fixture, r2p);
+    } catch (error) {
+      result = {name: fixture.name, shape: fixture.shape,
+                error: String(error)};
+    }
+    console.log(JSON.stringify(result));
+  }
+  // d3's timers would otherwise keep the process alive.
+  process.exit(0);
+}
+
+main();
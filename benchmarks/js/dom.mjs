@@ -0,0 +1,337 @@
+// A minimal DOM for benchmarking rows2prose's views under Node without a
+// browser: enough of Node, Element and Document for d3-selection's append,
+// join, attr, style, text and select, plus canvases whose 2D contexts count
+// draw calls instead of drawing. Selectors are limited to a single tag,
+// .class or #id.
+//
+// Animation frames are queued rather than scheduled, and performance.now
+// reads a virtual clock, so the harness steps animations frame by frame
+// with flushFrames() and times them with a real clock.
+
+const XHTML = "http://www.w3.org/1999/xhtml";
+
+class Style {
+  constructor() {
+    this._properties = new Map();
+  }
+
+  setProperty(name, value) {
+    this._properties.set(name, String(value));
+  }
+
+  getPropertyValue(name) {
+    return this._properties.get(name) || "";
+  }
+
+  removeProperty(name) {
+    this._properties.delete(name);
+  }
+}
+
+function matcher(selector) {
+  if (selector.startsWith(".")) {
+    const name = selector.slice(1);
+    return e => (e.getAttribute("class") || "").split(/\s+/).includes(name);
+  }
+  if (selector.startsWith("#")) {
+    const id = selector.slice(1);
+    return e => e.getAttribute("id") == id;
+  }
+  if (!/^[\w-]+$/.test(selector)) {
+    throw new Error(`Unsupported selector ${selector}`);
+  }
+  return e => e.localName == selector.toLowerCase();
+}
+
+class Node {
+  constructor(ownerDocument) {
+    this.ownerDocument = ownerDocument;
+    this.parentNode = null;
+    this.childNodes = [];
+  }
+
+  get children() {
+    return this.childNodes.filter(c => c instanceof Element);
+  }
+
+  get firstChild() {
+    return this.childNodes[0] || null;
+  }
+
+  get nextSibling() {
+    if (!this.parentNode) {
+      return null;
+    }
+    const siblings = this.parentNode.childNodes;
+    return siblings[siblings.indexOf(this) + 1] || null;
+  }
+
+  appendChild(child) {
+    return this.insertBefore(child, null);
+  }
+
+  insertBefore(child, reference) {
+    if (child.parentNode) {
+      child.parentNode.removeChild(child);
+    }
+    const i = reference ? this.childNodes.indexOf(reference) : -1;
+    if (i < 0) {
+      this.childNodes.push(child);
+    } else {
+      this.childNodes.splice(i, 0, child);
+    }
+    child.parentNode = this;
+    return child;
+  }
+
+  removeChild(child) {
+    const i = this.childNodes.indexOf(child);
+    if (i >= 0) {
+      this.childNodes.splice(i, 1);
+    }
+    child.parentNode = null;
+    return child;
+  }
+
+  // Only siblings are compared, which is all selection.order needs:
+  // DOCUMENT_POSITION_FOLLOWING (4) or PRECEDING (2).
+  compareDocumentPosition(other) {
+    const siblings = this.parentNode ? this.parentNode.childNodes : [];
+    return siblings.indexOf(other) > siblings.indexOf(this) ? 4 : 2;
+  }
+
+  get textContent() {
+    return this.childNodes.map(c => c.textContent).join("");
+  }
+
+  set textContent(value) {
+    this.childNodes.forEach(c => c.parentNode = null);
+    this.childNodes = [];
+    if (value != null && value !== "") {
+      this.appendChild(new Text(this.ownerDocument, String(value)));
+    }
+  }
+
+  querySelectorAll(selector) {
+    const matches = matcher(selector),
+          found = [];
+    (function walk(node) {
+      node.children.forEach(c => {
+        if (matches(c)) {
+          found.push(c);
+        }
+        walk(c);
+      });
+    })(this);
+    return found;
+  }
+
+  querySelector(selector) {
+    return this.querySelectorAll(selector)[0] || null;
+  }
+
+  addEventListener() {}
+
+  removeEventListener() {}
+}
+
+class Text extends Node {
+  constructor(ownerDocument, data) {
+    super(ownerDocument);
+    this.data = data;
+  }
+
+  get textContent() {
+    return this.data;
+  }
+}
+
+class Element extends Node {
+  constructor(ownerDocument, localName, namespaceURI = XHTML) {
+    super(ownerDocument);
+    this.localName = localName.toLowerCase();
+    this.tagName = localName.toUpperCase();
+    this.namespaceURI = namespaceURI;
+    this.attributes = new Map();
+    this.style = new Style();
+  }
+
+  setAttribute(name, value) {
+    this.attributes.set(name, String(value));
+  }
+
+  getAttribute(name) {
+    return this.attributes.has(name) ? this.attributes.get(name) : null;
+  }
+
+  hasAttribute(name) {
+    return this.attributes.has(name);
+  }
+
+  removeAttribute(name) {
+    this.attributes.delete(name);
+  }
+
+  setAttributeNS(_, name, value) {
+    this.setAttribute(name, value);
+  }
+
+  removeAttributeNS(_, name) {
+    this.removeAttribute(name);
+  }
+
+  matches(selector) {
+    return matcher(selector)(this);
+  }
+
+  get innerHTML() {
+    return "";
+  }
+
+  set innerHTML(value) {
+    if (value) {
+      throw new Error("The benchmark DOM can't parse HTML");
+    }
+    this.textContent = "";
+  }
+
+  get offsetWidth() {
+    return 0;
+  }
+
+  get offsetHeight() {
+    return 0;
+  }
+
+  getBoundingClientRect() {
+    return {x: 0, y: 0, top: 0, left: 0, right: 0, bottom: 0, width: 0,
+            height: 0};
+  }
+}
+
+// Counts each drawing method's calls, e.g. to check that a frame drew what
+// it should, without rasterizing anything.
+class Context2D {
+  constructor(canvas) {
+    this.canvas = canvas;
+    this.calls = {};
+    this.fillStyle = "#000";
+    this.strokeStyle = "#000";
+    this.globalAlpha = 1;
+    this.lineWidth = 1;
+  }
+}
+
+["arc", "beginPath", "clearRect", "closePath", "drawImage", "fill",
+ "fillRect", "fillText", "lineTo", "moveTo", "rect", "restore", "save",
+ "scale", "setTransform", "stroke", "strokeRect", "translate"]
+  .forEach(name => {
+    Context2D.prototype[name] = function() {
+      this.calls[name] = (this.calls[name] || 0) + 1;
+    };
+  });
+
+class Canvas extends Element {
+  constructor(ownerDocument) {
+    super(ownerDocument, "canvas");
+    this.width = 300;
+    this.height = 150;
+    this._context = null;
+  }
+
+  setAttribute(name, value) {
+    super.setAttribute(name, value);
+    if (name == "width" || name == "height") {
+      this[name] = parseInt(value);
+    }
+  }
+
+  getContext(type) {
+    if (type != "2d") {
+      return null;
+    }
+    if (this._context === null) {
+      this._context = new Context2D(this);
+    }
+    return this._context;
+  }
+}
+
+class Document extends Node {
+  constructor() {
+    super(null);
+    this.ownerDocument = null;
+    this.documentElement = new Element(this, "html");
+    this.body = new Element(this, "body");
+    this.appendChild(this.documentElement);
+    this.documentElement.appendChild(this.body);
+    this.defaultView = {
+      getComputedStyle: node => node.style,
+    };
+  }
+
+  createElement(name) {
+    return name.toLowerCase() == "canvas"
+      ? new Canvas(this)
+      : new Element(this, name);
+  }
+
+  createElementNS(namespaceURI, name) {
+    return namespaceURI == XHTML
+      ? this.createElement(name)
+      : new Element(this, name, namespaceURI);
+  }
+
+  createTextNode(data) {
+    return new Text(this, data);
+  }
+
+  getElementById(id) {
+    return this.querySelector(`#${id}`);
+  }
+}
+
+let frames = [],
+    virtualNow = 0;
+
+// Installs the DOM, a queued requestAnimationFrame and a virtual
+// performance.now as globals. Must run before d3 or rows2prose is imported,
+// since d3-timer picks its scheduler at import time.
+function installDOM() {
+  const document = new Document();
+  const window = {
+    document,
+    devicePixelRatio: 1,
+    getComputedStyle: node => node.style,
+    requestAnimationFrame: callback => frames.push(callback),
+    cancelAnimationFrame: () => {},
+  };
+  Object.assign(globalThis, {
+    window,
+    document,
+    requestAnimationFrame: window.requestAnimationFrame,
+    cancelAnimationFrame: window.cancelAnimationFrame,
+  });
+  Object.defineProperty(globalThis, "performance", {
+    value: {now: () => virtualNow},
+    configurable: true,
+    writable: true,
+  });
+  return document;
+}
+
+// Advances the virtual clock by msPerFrame and runs the animation frames
+// requested so far, once. Returns how many callbacks ran.
+function flushFrame(msPerFrame = 1000 / 60) {
+  virtualNow += msPerFrame;
+  const pending = frames;
+  frames = [];
+  pending.forEach(callback => callback(virtualNow));
+  return pending.length;
+}
+
+function pendingFrames() {
+  return frames.length;
+}
+
+export { Canvas, Document, Element, flushFrame, installDOM, pendingFrames };
@@ -0,0 +1,13 @@
+// Resolves the extensionless relative imports in js/src, which the bundler
+// accepts but Node's ESM loader doesn't, by trying them with ".js".
+export async function resolve(specifier, context, nextResolve) {
+  try {
+    return await nextResolve(specifier, context);
+  } catch (error) {
+    if (error.code != "ERR_MODULE_NOT_FOUND" || !specifier.startsWith(".")
+        || specifier.endsWith(".js")) {
+      throw error;
+    }
+    return nextResolve(`${specifier}.js`, context);
+  }
+}
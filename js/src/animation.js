@@ -0,0 +1,125 @@
+import * as d3 from "d3";
+
+// The clock that last animated each cell, so that releaseAnimations can
+// find the cells of a container.
+const cellClocks = new WeakMap();
+
+// Runs the animations of many cells on one requestAnimationFrame loop, so
+// each frame draws every animating cell once. Starting an animation for a
+// cell replaces the one it already has, and cells that are scrolled out of
+// view aren't drawn until they scroll back in.
+function createAnimationClock() {
+  let animations = new Map(),
+      // Final frames of animations that ended while their cell was
+      // offscreen, drawn when it becomes visible. Weak, so that cells that
+      // never come back, e.g. because their output was cleared, are freed.
+      deferred = new WeakMap(),
+      offscreen = new WeakSet(),
+      observed = new WeakSet(),
+      frame = null;
+
+  const observer = (typeof IntersectionObserver == "undefined")
+        ? null
+        : new IntersectionObserver(entries => entries.forEach(entry => {
+          const cell = entry.target;
+          if (entry.isIntersecting) {
+            offscreen.delete(cell);
+            const draw = deferred.get(cell);
+            if (draw) {
+              deferred.delete(cell);
+              draw();
+            }
+          } else {
+            offscreen.add(cell);
+          }
+        }));
+
+  function tick(now) {
+    frame = null;
+    animations.forEach((a, cell) => {
+      const t = Math.max(0, Math.min(1, (now - a.start) / a.duration));
+      if (t == 1) {
+        animations.delete(cell);
+      }
+      if (!offscreen.has(cell)) {
+        a.draw(a.interpolator(a.ease(t)));
+      } else if (t == 1) {
+        if (cell.isConnected) {
+          deferred.set(cell, () => a.draw(a.interpolator(1)));
+        } else {
+          release(cell);
+        }
+      }
+    });
+    if (animations.size) {
+      frame = requestAnimationFrame(tick);
+    }
+  }
+
+  function release(cell) {
+    animations.delete(cell);
+    deferred.delete(cell);
+    offscreen.delete(cell);
+    if (observer && observed.has(cell)) {
+      observer.unobserve(cell);
+      observed.delete(cell);
+    }
+  }
+
+  const clock = {
+    // Calls draw(interpolator(t)) each frame for t eased from 0 to 1 over
+    // duration milliseconds.
+    animate(cell, interpolator, draw, duration, ease = d3.easeCubic) {
+      if (observer && !observed.has(cell)) {
+        observer.observe(cell);
+        observed.add(cell);
+      }
+      cellClocks.set(cell, clock);
+      deferred.delete(cell);
+      animations.set(cell, {
+        interpolator, draw, duration, ease, start: performance.now()
+      });
+      if (frame === null) {
+        frame = requestAnimationFrame(tick);
+      }
+    },
+
+    // Stops the cell's animation, e.g. before drawing it directly.
+    cancel(cell) {
+      animations.delete(cell);
+      deferred.delete(cell);
+    },
+
+    // Stops the cell's animation and stops observing it, once the cell has
+    // been removed.
+    release
+  };
+  return clock;
+}
+
+const clocks = new WeakMap();
+
+// The animation clock shared by everything keyed by key, typically a
+// container element.
+function animationClock(key) {
+  let clock = clocks.get(key);
+  if (clock === undefined) {
+    clock = createAnimationClock();
+    clocks.set(key, clock);
+  }
+  return clock;
+}
+
+// Releases the cells inside container from the clocks that animated them,
+// e.g. before renderWhenVisible resets it.
+function releaseAnimations(container) {
+  container.querySelectorAll("*").forEach(element => {
+    const clock = cellClocks.get(element);
+    if (clock) {
+      cellClocks.delete(element);
+      clock.release(element);
+    }
+  });
+}
+
+export { animationClock, releaseAnimations };
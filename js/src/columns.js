@@ -0,0 +1,613 @@
+import * as d3 from "d3";
+import { measured } from "./stats";
+
+
+// The functions from here to workerMain also run in the decoding worker (see
+// workerFunctions), so they may only refer to each other and to globals.
+
+// Quantized columns carry integer codes with value = offset + code * scale,
+// and an optional code that stands for NaN.
+function dequantize(codes, c) {
+  const values = new Float32Array(codes.length),
+        nanCode = c.nan === undefined ? -1 : c.nan;
+  for (let i = 0; i < codes.length; i++) {
+    values[i] = codes[i] == nanCode ? NaN : c.offset + codes[i] * c.scale;
+  }
+  return values;
+}
+
+function arrayClassOf(c) {
+  const numberArrayClasses = {
+    "float32": Float32Array,
+    "float64": Float64Array,
+    "uint8": Uint8Array,
+    "uint16": Uint16Array,
+    "uint32": Uint32Array,
+    "int8": Int8Array,
+    "int16": Int16Array,
+    "int32": Int32Array,
+    "uint64": BigUint64Array,
+    "int64": BigInt64Array
+  };
+  if (!(c.type in numberArrayClasses)) {
+    throw new Error(`Unknown data type: ${c.type}`);
+  }
+  return numberArrayClasses[c.type];
+}
+
+// A column's bytes arrive either base64-encoded in c.data or, for binary
+// transports such as Jupyter comms, as c.buffer indexing into buffers.
+function columnBytes(c, buffers) {
+  if (c.buffer !== undefined) {
+    const view = buffers[c.buffer];
+    return new Uint8Array(view.buffer, view.byteOffset, view.byteLength);
+  }
+  return Uint8Array.from(atob(c.data), ch => ch.charCodeAt(0));
+}
+
+// Inverse of the encoder's "shuffle" filter, which stores byte b of every
+// value before byte b + 1 of any value.
+function unshuffle(bytes, size) {
+  const n = bytes.length / size;
+  let out = new Uint8Array(bytes.length);
+  for (let b = 0; b < size; b++) {
+    for (let i = 0; i < n; i++) {
+      out[i * size + b] = bytes[b * n + i];
+    }
+  }
+  return out;
+}
+
+// Turns a column's uncompressed bytes into its values, undoing the encoder's
+// filters and quantization.
+function bytesToColumn(c, bytes) {
+  const arrayClass = arrayClassOf(c),
+        size = arrayClass.BYTES_PER_ELEMENT,
+        filters = c.filters || [];
+
+  if (filters.includes("shuffle") && size > 1) {
+    bytes = unshuffle(bytes, size);
+  }
+
+  let values = (bytes.byteOffset % size == 0)
+      ? new arrayClass(bytes.buffer, bytes.byteOffset, bytes.byteLength / size)
+      : new arrayClass(bytes.slice().buffer);
+
+  if (filters.includes("delta")) {
+    for (let i = 1; i < values.length; i++) {
+      values[i] += values[i - 1];
+    }
+  }
+
+  return c.scale !== undefined ? dequantize(values, c) : values;
+}
+
+function decodeColumnAsync(c, buffers) {
+  const bytes = columnBytes(c, buffers);
+  if (!c.compression) {
+    return Promise.resolve(bytesToColumn(c, bytes));
+  }
+  const stream = new Blob([bytes]).stream()
+        .pipeThrough(new DecompressionStream(c.compression));
+  return new Response(stream).arrayBuffer()
+    .then(buffer => bytesToColumn(c, new Uint8Array(buffer)));
+}
+
+// Every column entry in d, including those of row indexes.
+function columnEntries(d) {
+  let entries = [];
+  Object.keys(d).forEach(k => {
+    entries.push(d[k]);
+    if (d[k].index) {
+      entries.push(d[k].index.offsets);
+      if (d[k].index.order) {
+        entries.push(d[k].index.order);
+      }
+    }
+  });
+  return entries;
+}
+
+// [min, max] of a column, ignoring NaNs, like d3.extent.
+function columnExtent(column) {
+  let min, max;
+  for (let i = 0; i < column.length; i++) {
+    const v = column[i];
+    if (v >= v) {
+      if (min === undefined) {
+        min = max = v;
+      } else if (v < min) {
+        min = v;
+      } else if (v > max) {
+        max = v;
+      }
+    }
+  }
+  return [min, max];
+}
+
+// Groups row numbers by value, CSR style, like the encoder's row_index:
+// rows holding the j-th smallest value are order[offsets[j]:offsets[j + 1]].
+function buildRowIndex(column) {
+  let order = new Int32Array(column.length);
+  for (let i = 0; i < order.length; i++) {
+    order[i] = i;
+  }
+  order.sort((a, b) => column[a] - column[b] || a - b);
+
+  let starts = [];
+  for (let i = 0; i < order.length; i++) {
+    if (!i || column[order[i]] != column[order[i - 1]]) {
+      starts.push(i);
+    }
+  }
+  starts.push(order.length);
+  return {order, offsets: Int32Array.from(starts)};
+}
+
+// The worker's entry point. Each request decodes one payload and returns,
+// per column, its values, extent and row index (built here for the
+// requested indexColumns if it wasn't shipped), in transferred buffers.
+function workerMain() {
+  self.onmessage = e => {
+    const {id, d, buffers, indexColumns} = e.data,
+          entries = columnEntries(d);
+    Promise.all(entries.map(c => decodeColumnAsync(c, buffers)))
+      .then(values => {
+        const decoded = new Map(entries.map((c, i) => [c, values[i]]));
+        let columns = {},
+            transfer = [];
+        // Views into a larger buffer, such as a message's, are copied so
+        // that each transferred buffer belongs to one array.
+        const own = arr => {
+          if (arr.byteOffset || arr.byteLength != arr.buffer.byteLength) {
+            arr = arr.slice();
+          }
+          transfer.push(arr.buffer);
+          return arr;
+        };
+
+        Object.keys(d).forEach(k => {
+          const c = d[k],
+                column = decoded.get(c);
+          let index = null;
+          if (c.index) {
+            index = {
+              order: c.index.order ? decoded.get(c.index.order) : null,
+              offsets: decoded.get(c.index.offsets)
+            };
+          } else if (indexColumns.includes(k)) {
+            index = buildRowIndex(column);
+          }
+          columns[k] = {
+            values: own(column),
+            extent: c.min !== undefined ? [c.min, c.max] : columnExtent(column),
+            index: index && {
+              order: index.order && own(index.order),
+              offsets: own(index.offsets)
+            }
+          };
+        });
+        self.postMessage({id, columns}, transfer);
+      })
+      .catch(error => self.postMessage({id, error: String(error)}));
+  };
+}
+
+const workerFunctions = [
+  arrayClassOf, dequantize, columnBytes, unshuffle, bytesToColumn,
+  decodeColumnAsync, columnEntries, columnExtent, buildRowIndex, workerMain
+];
+
+function decodeColumn(c, buffers) {
+  if (c.ref !== undefined) {
+    throw new Error("Shared columns must be decoded with r2p.loadColumns");
+  }
+  if (c.compression) {
+    throw new Error("Compressed columns must be decoded with r2p.loadColumns");
+  }
+  return bytesToColumn(c, columnBytes(c, buffers));
+}
+
+// Row indexes shipped alongside a column, keyed by the parsed column.
+const shippedRowIndexes = new WeakMap();
+
+// [min, max] of each column, as shipped by the encoder or computed once by
+// extent, keyed by the parsed column.
+const extents = new WeakMap();
+
+// Returns [min, max] of a column, ignoring NaNs, scanning it only if its
+// extent wasn't shipped or already computed.
+function extent(column) {
+  let e = extents.get(column);
+  if (e === undefined) {
+    e = columnExtent(column);
+    extents.set(column, e);
+  }
+  return e;
+}
+
+function assembleColumns(d, decoded) {
+  let parsed = {};
+  Object.keys(d).forEach(k => {
+    parsed[k] = decoded(d[k]);
+    if (d[k].min !== undefined) {
+      extents.set(parsed[k], [d[k].min, d[k].max]);
+    }
+    if (d[k].index) {
+      shippedRowIndexes.set(parsed[k], {
+        order: d[k].index.order ? decoded(d[k].index.order) : null,
+        offsets: decoded(d[k].index.offsets)
+      });
+    }
+  });
+  return parsed;
+}
+
+function parseColumns(d, buffers) {
+  return measured("parse", () => assembleColumns(d, c => decodeColumn(c, buffers)));
+}
+
+// The page's decoding worker, started on first use from the source of
+// workerFunctions, so that it ships inside the one bundle. If workers can't
+// start here, e.g. because a Content-Security-Policy forbids blob: URLs,
+// decoding falls back to the main thread.
+let worker = null,
+    workerFailed = false,
+    nextRequestId = 0;
+const workerRequests = new Map();
+
+function decodingWorker() {
+  if (worker === null && !workerFailed) {
+    try {
+      const source = workerFunctions.map(f => f.toString()).join("\n")
+            + `\n${workerMain.name}();`,
+            url = URL.createObjectURL(
+              new Blob([source], {type: "text/javascript"}));
+      worker = new Worker(url);
+      worker.onmessage = e => {
+        const {id, columns, error} = e.data,
+              request = workerRequests.get(id);
+        workerRequests.delete(id);
+        if (error !== undefined) {
+          request.reject(new Error(error));
+        } else {
+          request.resolve(columns);
+        }
+      };
+      worker.onerror = () => {
+        workerFailed = true;
+        worker.terminate();
+        worker = null;
+        workerRequests.forEach(request => request.fallback());
+        workerRequests.clear();
+      };
+    } catch (e) {
+      workerFailed = true;
+      worker = null;
+    }
+  }
+  return worker;
+}
+
+function loadColumnsHere(d, buffers) {
+  const entries = columnEntries(d);
+  return Promise.all(entries.map(c => decodeColumnAsync(c, buffers)))
+    .then(values => {
+      const decoded = new Map(entries.map((c, i) => [c, values[i]]));
+      return assembleColumns(d, c => decoded.get(c));
+    });
+}
+
+function loadColumnsInWorker(w, d, buffers, indexColumns) {
+  return new Promise((resolve, reject) => {
+    const id = nextRequestId++;
+    workerRequests.set(id, {
+      resolve: columns => {
+        let parsed = {};
+        Object.keys(columns).forEach(k => {
+          const {values, extent, index} = columns[k];
+          parsed[k] = values;
+          if (extent[0] !== undefined) {
+            extents.set(values, extent);
+          }
+          if (index) {
+            shippedRowIndexes.set(values, index);
+          }
+        });
+        resolve(parsed);
+      },
+      reject,
+      fallback: () => loadColumnsHere(d, buffers).then(resolve, reject)
+    });
+    w.postMessage({id, d, buffers, indexColumns});
+  });
+}
+
+// Promises of the columns registered on the page by a ColumnRegistry, by
+// ref. Each is decoded once, from its <script id="r2p-column-REF"> tag,
+// and the typed array (with its extent and row index) is shared by every
+// table that references it, even after the tag's output is cleared. Each
+// entry counts the containers (options.container) whose tables hold it.
+// Once none do, because renderWhenVisible released them or they were
+// garbage collected, the entry is dropped, to be decoded again from its tag
+// if needed. Entries whose tag is gone can't be, so they stay.
+const sharedColumns = new Map(),
+      // The refs held by each container's tables.
+      heldColumns = new WeakMap(),
+      unreachableContainers = typeof FinalizationRegistry == "undefined"
+        ? null
+        : new FinalizationRegistry(held => releaseHeld(held));
+
+function sharedColumn(ref, options) {
+  let column = sharedColumns.get(ref);
+  if (column === undefined) {
+    const element = document.getElementById(`r2p-column-${ref}`);
+    if (!element) {
+      return Promise.reject(new Error(`Unknown column: ${ref}`));
+    }
+    column = {
+      promise: loadColumns({c: JSON.parse(element.textContent)}, undefined,
+                           {worker: options.worker})
+        .then(t => t.c),
+      holders: 0
+    };
+    sharedColumns.set(ref, column);
+  }
+
+  const container = options.container;
+  if (container) {
+    let held = heldColumns.get(container);
+    if (held === undefined) {
+      held = new Set();
+      heldColumns.set(container, held);
+      if (unreachableContainers) {
+        unreachableContainers.register(container, held, container);
+      }
+    }
+    if (!held.has(ref)) {
+      held.add(ref);
+      column.holders++;
+    }
+  }
+  return column.promise;
+}
+
+function releaseHeld(held) {
+  held.forEach(ref => {
+    const column = sharedColumns.get(ref);
+    if (column !== undefined && --column.holders == 0
+        && document.getElementById(`r2p-column-${ref}`)) {
+      sharedColumns.delete(ref);
+    }
+  });
+}
+
+// Releases the shared columns held by container's tables, e.g. once it has
+// been reset and its table dropped.
+function releaseColumns(container) {
+  const held = heldColumns.get(container);
+  if (held !== undefined) {
+    heldColumns.delete(container);
+    if (unreachableContainers) {
+      unreachableContainers.unregister(container);
+    }
+    releaseHeld(held);
+  }
+}
+
+// Like parseColumns, but returns a Promise of the table, and also decodes
+// compressed columns, asynchronously with DecompressionStream, and columns
+// that reference a shared column by "ref", held on behalf of
+// options.container until releaseColumns(container). With options.worker,
+// decoding happens in a Web Worker, which also builds the row indexes of
+// options.indexColumns and the extents of every column, so the main thread
+// only receives finished typed arrays.
+function loadColumns(d, buffers, options = {}) {
+  const keys = Object.keys(d),
+        refKeys = keys.filter(k => d[k].ref !== undefined);
+  if (refKeys.length) {
+    let own = {};
+    keys.forEach(k => {
+      if (d[k].ref === undefined) {
+        own[k] = d[k];
+      }
+    });
+    return Promise.all([loadColumns(own, buffers, options),
+                        ...refKeys.map(k => sharedColumn(d[k].ref, options))])
+      .then(([ownTable, ...shared]) => {
+        let table = {};
+        keys.forEach(k => {
+          const i = refKeys.indexOf(k);
+          table[k] = i == -1 ? ownTable[k] : shared[i];
+        });
+        return table;
+      });
+  }
+
+  const w = options.worker ? decodingWorker() : null;
+  return measured("parse", () => w
+    ? loadColumnsInWorker(w, d, buffers, options.indexColumns || [])
+    : loadColumnsHere(d, buffers));
+}
+
+// Returns a function that runs tasks one at a time, in call order, waiting
+// for any promise a task returns. Dynamic views use this to apply refreshes
+// and appends in order while their columns decode asynchronously.
+function serialize() {
+  let last = Promise.resolve();
+  return task => {
+    last = last.then(task).catch(e => console.error(e));
+    return last;
+  };
+}
+
+// Maps each column view returned by appendColumns to the larger array that
+// backs it, so that later appends can fill the spare capacity in place.
+const backingArrays = new WeakMap();
+
+// Appends the rows of tail, a table from parseColumns or loadColumns, to
+// table.
+function appendColumns(table, tail) {
+  if (!table) {
+    return tail;
+  }
+
+  Object.keys(tail).forEach(k => {
+    const current = table[k],
+          rows = tail[k];
+    if (current === undefined) {
+      table[k] = rows;
+      return;
+    }
+
+    // If the tail was sent with a different type, e.g. integers that no
+    // longer fit in a narrowed type, switch to a type that holds both.
+    const n = current.length,
+          arrayClass = (rows.constructor == current.constructor
+                        || current instanceof Float64Array)
+            ? current.constructor
+            : Float64Array;
+    let backing = backingArrays.get(current);
+    if (backing === undefined || n + rows.length > backing.length
+        || arrayClass != current.constructor) {
+      // Amortized doubling: each row is copied O(1) times on average.
+      backing = new arrayClass(Math.max(2 * n, n + rows.length));
+      backing.set(current);
+    }
+    backing.set(rows, n);
+
+    const view = backing.subarray(0, n + rows.length);
+    backingArrays.set(view, backing);
+    // Keep a known extent up to date by scanning only the new rows.
+    const before = extents.get(current);
+    if (before !== undefined) {
+      const added = extent(rows);
+      extents.set(view, [d3.min([before[0], added[0]]),
+                         d3.max([before[1], added[1]])]);
+    }
+    table[k] = view;
+  });
+
+  return table;
+}
+
+// Adds values to an already sorted array of unique values, in place. When
+// the values arrive in ascending order, as timesteps usually do, this is a
+// push per new value.
+function insertSortedUnique(sorted, values) {
+  let last = sorted.length ? sorted[sorted.length - 1] : -Infinity;
+  for (let i = 0; i < values.length; i++) {
+    const v = values[i];
+    if (v > last) {
+      sorted.push(v);
+      last = v;
+    } else if (v != last) {
+      const j = d3.bisectLeft(sorted, v);
+      if (sorted[j] != v) {
+        sorted.splice(j, 0, v);
+      }
+    }
+  }
+  return sorted;
+}
+
+const noRows = new Int32Array(0);
+
+// Groups the rows of a column by value. keys holds the sorted unique values
+// and rows(v) returns the increasing row numbers that hold v, as a view into
+// one shared order array (CSR layout), so a lookup is O(rows with v).
+function rowIndex(column) {
+  let {order, offsets} = shippedRowIndexes.get(column)
+      || buildRowIndex(column);
+  if (order === null) {
+    // The column was already sorted, so the order is the identity.
+    order = new Int32Array(column.length).map((_, i) => i);
+  }
+
+  let keys = [],
+      groups = new Map();
+  for (let j = 0; j + 1 < offsets.length; j++) {
+    const rows = order.subarray(offsets[j], offsets[j + 1]),
+          v = column[rows[0]];
+    keys.push(v);
+    groups.set(v, rows);
+  }
+
+  return {
+    keys,
+    rows: v => groups.get(v) || noRows,
+
+    // Indexes rows [start, column.length) of a column that has grown by
+    // appendColumns. keys is updated in place.
+    extend(column, start) {
+      let added = new Map();
+      for (let i = start; i < column.length; i++) {
+        const v = column[i];
+        if (!added.has(v)) {
+          added.set(v, []);
+        }
+        added.get(v).push(i);
+      }
+      added.forEach((newRows, v) => {
+        const rows = groups.get(v);
+        if (rows === undefined) {
+          groups.set(v, Int32Array.from(newRows));
+          insertSortedUnique(keys, [v]);
+        } else {
+          let merged = new Int32Array(rows.length + newRows.length);
+          merged.set(rows);
+          merged.set(newRows, rows.length);
+          groups.set(v, merged);
+        }
+      });
+      return this;
+    }
+  };
+}
+
+// Selects iRows (increasing row numbers) from arr. Contiguous rows are
+// returned as a view without copying.
+function extractRows(arr, iRows) {
+  const n = iRows.length;
+  if (n && iRows[n - 1] - iRows[0] == n - 1) {
+    return arr.subarray(iRows[0], iRows[0] + n);
+  }
+  let selected = arr.slice(0, n);
+  iRows.forEach((iRow, i) => {
+    selected[i] = arr[iRow];
+  });
+  return selected;
+}
+
+// The range spanned by the nonempty bins of counts, a flattened
+// (rows x bins) histogram with the given bin edges, as shipped by
+// rows2prose.binning.HistogramEncoder.
+function histogramExtent(counts, edges) {
+  const nBins = edges.length - 1;
+  let lo = nBins,
+      hi = -1;
+  for (let i = 0; i < counts.length; i++) {
+    if (counts[i]) {
+      const j = i % nBins;
+      lo = Math.min(lo, j);
+      hi = Math.max(hi, j);
+    }
+  }
+  return hi < 0
+    ? [edges[0], edges[nBins]]
+    : [edges[lo], edges[hi + 1]];
+}
+
+export {
+  appendColumns,
+  extent,
+  extractRows,
+  histogramExtent,
+  insertSortedUnique,
+  loadColumns,
+  parseColumns,
+  releaseColumns,
+  rowIndex,
+  serialize,
+};
@@ -0,0 +1,40 @@
+import { releaseAnimations } from "./animation";
+import { releaseColumns } from "./columns";
+
+// Calls render(container) once container comes within options.margin of the
+// viewport, so that pages with many blocks only decode and draw the ones
+// being looked at. With options.release, a rendered container that scrolls
+// beyond options.releaseMargin is reset to its original HTML, dropping the
+// table and elements that render created, their animations and the shared
+// columns it held, and is rendered again when it comes back.
+function renderWhenVisible(container, render, options = {}) {
+  if (typeof IntersectionObserver == "undefined") {
+    render(container);
+    return;
+  }
+
+  const template = container.innerHTML;
+  let rendered = false;
+
+  new IntersectionObserver(entries => {
+    if (entries[entries.length - 1].isIntersecting && !rendered) {
+      rendered = true;
+      render(container);
+    }
+  }, {rootMargin: options.margin || "200px"}).observe(container);
+
+  if (options.release) {
+    new IntersectionObserver(entries => {
+      if (!entries[entries.length - 1].isIntersecting && rendered) {
+        rendered = false;
+        // Keep the block's height so that the page doesn't jump.
+        container.style.minHeight = `${container.offsetHeight}px`;
+        releaseAnimations(container);
+        container.innerHTML = template;
+        releaseColumns(container);
+      }
+    }, {rootMargin: options.releaseMargin || "3000px"}).observe(container);
+  }
+}
+
+export { renderWhenVisible };
@@ -0,0 +1,33 @@
+// Connects container, set up by a ScriptBuilder's dynamic_initialize_js, to
+// a rows2prose.server.LiveServer, passing each frame the server pushes to
+// container._r2pState, e.g. to its refresh. A frame is one binary message:
+// a little-endian uint32 header length, the JSON header
+// {method, columns, buffers}, where buffers lists the [offset, length] of
+// each column's bytes within the message, then the bytes themselves. If the
+// connection drops, e.g. because the server restarted, it is retried every
+// options.retryMs.
+function liveConnection(container, url = null, options = {}) {
+  const retryMs = options.retryMs || 1000;
+  if (url === null) {
+    url = `${location.protocol == "https:" ? "wss:" : "ws:"}//${location.host}/ws`;
+  }
+
+  function connect() {
+    const socket = new WebSocket(url);
+    socket.binaryType = "arraybuffer";
+    socket.onmessage = e => {
+      const message = e.data,
+            headerLength = new DataView(message).getUint32(0, true),
+            header = JSON.parse(new TextDecoder().decode(
+              new Uint8Array(message, 4, headerLength))),
+            buffers = header.buffers.map(
+              ([offset, length]) => new DataView(message, offset, length));
+      container._r2pState[header.method](header.columns, buffers);
+    };
+    socket.onclose = () => setTimeout(connect, retryMs);
+  }
+
+  connect();
+}
+
+export { liveConnection };
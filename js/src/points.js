@@ -0,0 +1,129 @@
+// Fast drawing of many translucent dots onto a canvas. Rather than a
+// beginPath/arc/fill per point, a dot is rasterized once and blitted with
+// drawImage, and past a threshold the points are drawn as a density strip.
+
+const spriteCache = new Map();
+
+function dotSprite(radius, fillStyle, alpha) {
+  const key = `${radius} ${fillStyle} ${alpha}`;
+  let sprite = spriteCache.get(key);
+  if (sprite === undefined) {
+    const size = Math.ceil(2 * radius) + 2;
+    sprite = document.createElement("canvas");
+    sprite.width = size;
+    sprite.height = size;
+
+    const ctx = sprite.getContext("2d");
+    ctx.fillStyle = fillStyle;
+    ctx.globalAlpha = alpha;
+    ctx.beginPath();
+    ctx.arc(size / 2, size / 2, radius, 0, 2 * Math.PI);
+    ctx.fill();
+
+    spriteCache.set(key, sprite);
+  }
+  return sprite;
+}
+
+// Maps values through a d3 scale in one pass over a typed array, evaluating
+// linear and log scales inline rather than calling the scale per point.
+function pixelPositions(values, scale) {
+  const n = values.length,
+        domain = scale.domain(),
+        range = scale.range();
+  let xs = new Float32Array(n);
+
+  if (domain.length == 2 && typeof scale.base == "function"
+      && domain[0] > 0 && domain[1] > 0) {
+    const l0 = Math.log(domain[0]),
+          k = (range[1] - range[0]) / (Math.log(domain[1]) - l0);
+    for (let i = 0; i < n; i++) {
+      xs[i] = range[0] + (Math.log(values[i]) - l0) * k;
+    }
+  } else if (domain.length == 2 && typeof scale.base != "function"
+             && typeof scale.exponent != "function"
+             && typeof scale.constant != "function") {
+    const k = (range[1] - range[0]) / (domain[1] - domain[0]);
+    for (let i = 0; i < n; i++) {
+      xs[i] = range[0] + (values[i] - domain[0]) * k;
+    }
+  } else {
+    for (let i = 0; i < n; i++) {
+      xs[i] = scale(values[i]);
+    }
+  }
+
+  return xs;
+}
+
+// ys is either one y for every point or a per-point array.
+function drawDots(ctx, xs, ys, sprite) {
+  const half = sprite.width / 2,
+        yConstant = typeof ys == "number";
+  for (let i = 0; i < xs.length; i++) {
+    ctx.drawImage(sprite,
+                  xs[i] - half,
+                  (yConstant ? ys : ys[i]) - half);
+  }
+}
+
+// Counts points per canvas pixel column (per row, if rows is given) and
+// fills each column with the opacity that that many overlapping dots of
+// the given alpha would reach.
+function drawDensity(ctx, xs, rows, nRows, rowCenter, bandHeight, width,
+                     fillStyle, alpha) {
+  const w = Math.ceil(width);
+  let counts = new Uint32Array(w * nRows);
+  for (let i = 0; i < xs.length; i++) {
+    const x = Math.floor(xs[i]);
+    if (x >= 0 && x < w) {
+      counts[(rows ? rows[i] : 0) * w + x]++;
+    }
+  }
+
+  const logTransparency = Math.log(1 - alpha);
+  ctx.fillStyle = fillStyle;
+  for (let row = 0; row < nRows; row++) {
+    const y = rowCenter(row) - bandHeight / 2;
+    for (let x = 0; x < w; x++) {
+      const c = counts[row * w + x];
+      if (c) {
+        ctx.globalAlpha = 1 - Math.exp(c * logTransparency);
+        ctx.fillRect(x, y, 1, bandHeight);
+      }
+    }
+  }
+  ctx.globalAlpha = 1;
+}
+
+// Draws histograms, counts holding nRows rows of bins whose edges are at
+// pixels xs, shading each bin by its count relative to the largest count.
+function drawHistograms(ctx, counts, nRows, xs, rowCenter, bandHeight,
+                        fillStyle) {
+  const nBins = xs.length - 1;
+  let maxCount = 0;
+  for (let i = 0; i < counts.length; i++) {
+    maxCount = Math.max(maxCount, counts[i]);
+  }
+  if (!maxCount) {
+    return;
+  }
+
+  ctx.fillStyle = fillStyle;
+  for (let row = 0; row < nRows; row++) {
+    const y = rowCenter(row) - bandHeight / 2;
+    for (let j = 0; j < nBins; j++) {
+      const c = counts[row * nBins + j];
+      if (c) {
+        // Rounding the edges keeps adjacent bins from leaving seams.
+        const x0 = Math.round(xs[j]),
+              x1 = Math.round(xs[j + 1]);
+        ctx.globalAlpha = c / maxCount;
+        ctx.fillRect(x0, y, Math.max(1, x1 - x0), bandHeight);
+      }
+    }
+  }
+  ctx.globalAlpha = 1;
+}
+
+export { dotSprite, drawDensity, drawDots, drawHistograms, pixelPositions };
@@ -0,0 +1,68 @@
+// Opt-in performance measures. Once instrument() is called, as blocks
+// rendered under rows2prose.web.collect_stats do, each measured(name, f)
+// adds a performance.measure named "r2p:NAME", visible in the browser's
+// performance tools, and stats() summarizes the durations by name. Measured
+// names are "parse" (decoding a table, until its promise resolves),
+// "onTableLoaded", "renderRows" and "draw" (each canvas draw).
+let enabled = false;
+const durations = new Map();
+
+function instrument(on = true) {
+  enabled = on;
+}
+
+function record(name, start) {
+  const end = performance.now();
+  try {
+    performance.measure(`r2p:${name}`, {start, end});
+  } catch (e) {
+    // Browsers without the options argument still get stats().
+  }
+  let d = durations.get(name);
+  if (d === undefined) {
+    d = {count: 0, totalMs: 0, maxMs: 0};
+    durations.set(name, d);
+  }
+  d.count++;
+  d.totalMs += end - start;
+  d.maxMs = Math.max(d.maxMs, end - start);
+}
+
+// Calls f and returns its result, measuring it when instrumented. If f
+// returns a promise, the measure lasts until it settles.
+function measured(name, f) {
+  if (!enabled) {
+    return f();
+  }
+  const start = performance.now();
+  performance.mark(`r2p:${name}`);
+  const result = f();
+  if (result && typeof result.then == "function") {
+    return result.then(
+      value => {
+        record(name, start);
+        return value;
+      },
+      error => {
+        record(name, start);
+        throw error;
+      });
+  }
+  record(name, start);
+  return result;
+}
+
+// Returns {name: {count, totalMs, maxMs, meanMs}} for what has been
+// measured since the page loaded, or since stats(true) reset it.
+function stats(reset = false) {
+  let summary = {};
+  durations.forEach((d, name) => {
+    summary[name] = Object.assign({meanMs: d.totalMs / d.count}, d);
+  });
+  if (reset) {
+    durations.clear();
+  }
+  return summary;
+}
+
+export { instrument, measured, stats };
@@ -0,0 +1,20 @@
+// Compiled render functions, shared by the blocks of a page (see
+// rows2prose.web.TemplateCache). Each template is registered once, as
+// function(data) returning the render function of a block whose columns
+// are data, so the browser parses and compiles a block's control code once
+// however many blocks use it.
+const templates = new Map();
+
+function registerTemplate(key, template) {
+  templates.set(key, template);
+}
+
+function template(key) {
+  const t = templates.get(key);
+  if (t === undefined) {
+    throw new Error(`rows2prose template ${key} isn't registered on this page`);
+  }
+  return t;
+}
+
+export { registerTemplate, template };
@@ -0,0 +1,79 @@
+// Tables of single timesteps, fetched on demand from a timeline that stays
+// in the kernel (see rows2prose.notebook.display_on_demand). request(ts)
+// asks for the timesteps ts, whose tables arrive later through receive(),
+// and returns false if it couldn't send the request, e.g. before the comm
+// to the kernel is connected. Unsent timesteps are requested again by the
+// next fetch, or by retry() once the comm connects. The options.capacity
+// most recently used tables are kept, so scrubbing back and forth over the
+// same steps doesn't fetch them again.
+function timestepCache(request, options = {}) {
+  const capacity = options.capacity || 64,
+        // Maps preserve insertion order, so the least recently used table
+        // is always first.
+        tables = new Map(),
+        // The resolvers of get() calls waiting for each timestep.
+        waiting = new Map(),
+        requested = new Set();
+
+  function use(t, table) {
+    tables.delete(t);
+    tables.set(t, table);
+    while (tables.size > capacity) {
+      tables.delete(tables.keys().next().value);
+    }
+  }
+
+  function fetch(timesteps) {
+    const missing = timesteps.filter(t => !tables.has(t) && !requested.has(t));
+    if (missing.length && request(missing) !== false) {
+      missing.forEach(t => requested.add(t));
+    }
+  }
+
+  return {
+    has(t) {
+      return tables.has(t);
+    },
+
+    // Resolves to the table of timestep t, fetching it if needed.
+    get(t) {
+      if (tables.has(t)) {
+        const table = tables.get(t);
+        use(t, table);
+        return Promise.resolve(table);
+      }
+      const table = new Promise(resolve => {
+        if (!waiting.has(t)) {
+          waiting.set(t, []);
+        }
+        waiting.get(t).push(resolve);
+      });
+      fetch([t]);
+      return table;
+    },
+
+    // Fetches the timesteps that aren't cached or already requested,
+    // e.g. the ones after the current step during playback.
+    prefetch(timesteps) {
+      fetch(timesteps);
+    },
+
+    // Requests every timestep that get() is still waiting for, including
+    // ones already requested, whose requests are lost if the comm they were
+    // sent over closed, e.g. when the kernel restarted.
+    retry() {
+      requested.clear();
+      fetch(Array.from(waiting.keys()));
+    },
+
+    receive(t, table) {
+      use(t, table);
+      requested.delete(t);
+      const resolvers = waiting.get(t) || [];
+      waiting.delete(t);
+      resolvers.forEach(resolve => resolve(table));
+    },
+  };
+}
+
+export { timestepCache };
@@ -1,5 +1,9 @@
 import * as d3 from "d3";
 import { play_button_svg, pause_button_svg, restart_button_svg } from "./buttons";
+import { animationClock } from "./animation";
+import { histogramExtent } from "./columns";
+import { dotSprite, drawDensity, drawDots, drawHistograms, pixelPositions } from "./points";
+import { measured } from "./stats";
 
 
 const anim_t = 100;
@@ -194,6 +198,9 @@ function scalarDistributionView() {
       useDataMax = false,
       cnvMult = 4,
       pointRadius = 2.5,
+      densityThreshold = 20000,
+      binned = false,
+      clock = null,
       maxWidth = 300;
 
   let cnv_x, cnv_y, cnv_y05, cnv_y0, cnv_y1;
@@ -211,9 +218,17 @@ function scalarDistributionView() {
 
   onScaleUpdate();
 
+  // When binned, each datum is {counts, edges}, a histogram, rather than
+  // an array of points.
+  function dataExtent(points) {
+    return binned
+      ? histogramExtent(points.counts, points.edges)
+      : [d3.min(points), d3.max(points)];
+  }
+
   function fmin(points) {
     if (useDataMin) {
-      return d3.min(points);
+      return dataExtent(points)[0];
     } else {
       return scale.domain()[0];
     }
@@ -221,7 +236,7 @@ function scalarDistributionView() {
 
   function fmax(points) {
     if (useDataMax) {
-      return d3.max(points);
+      return dataExtent(points)[1];
     } else {
       return scale.domain()[1];
     }
@@ -235,12 +250,8 @@ function scalarDistributionView() {
         : toPrecisionThrifty(fmax(points), 2);
 
   function draw(canvasNode, div, points) {
-    const min = useDataMin
-      ? d3.min(points)
-      : scale.domain()[0],
-      max = useDataMax
-      ? d3.max(points)
-      : scale.domain()[1],
+    const min = fmin(points),
+      max = fmax(points),
       width = scale(max) - scale(min);
 
     if (!canvasNode._r2pInitialized || (useDataMin || useDataMax)) {
@@ -259,13 +270,21 @@ function scalarDistributionView() {
 
     let ctx = canvasNode.getContext("2d");
     ctx.clearRect(0, 0, canvasNode.width, canvasNode.height)
-    ctx.fillStyle = "blue";
-    ctx.globalAlpha = 0.4;
-    ctx.lineWidth = 0;
-    for (let i = 0; i < points.length; i++) {
-      ctx.beginPath();
-      ctx.arc(cnv_x(points[i]), cnv_y05, pointRadius*cnvMult, 0, 2 * Math.PI);
-      ctx.fill();
+
+    const r = pointRadius * cnvMult;
+    if (binned) {
+      drawHistograms(ctx, points.counts, 1,
+                     pixelPositions(points.edges, cnv_x),
+                     _ => cnv_y05, cnv_y1 - cnv_y0, "blue");
+      return;
+    }
+
+    const xs = pixelPositions(points, cnv_x);
+    if (points.length > densityThreshold) {
+      drawDensity(ctx, xs, null, 1, _ => cnv_y05, 2 * r, canvasNode.width,
+                  "blue", 0.4);
+    } else {
+      drawDots(ctx, xs, cnv_y05, dotSprite(r, "blue", 0.4));
     }
   }
 
@@ -316,26 +335,27 @@ function scalarDistributionView() {
                 .text(fmaxtext);
             }))
       .call(div => {
+        const animations = clock || animationClock(document);
         div.each(function(points) {
           const div = d3.select(this),
-                canvas = div.select(".canvasContainer").select("canvas");
-          if (this._r2pPrevPoints) {
-            const interpolator = d3.interpolateNumberArray(this._r2pPrevPoints, points);
-
-            let timer = d3.timer((elapsed) => {
-              const t = Math.min(1, d3.easeCubic(elapsed / anim_t));
-              draw(canvas.node(), div, interpolator(t));
-              if (t === 1) {
-                timer.stop();
-              }
-            });
-
+                canvasNode = div.select(".canvasContainer").select("canvas").node(),
+                drawShown = shown => {
+                  measured("draw", () => draw(canvasNode, div, shown));
+                  this._r2pShownPoints = shown;
+                };
+          // Animate from whatever is on screen, which is partway to the
+          // previous points if their animation was superseded.
+          const prev = this._r2pShownPoints;
+          if (prev) {
+            const interpolator = binned
+                  ? (counts => t => ({counts: counts(t), edges: points.edges}))(
+                    d3.interpolateNumberArray(prev.counts, points.counts))
+                  : d3.interpolateNumberArray(prev, points);
+            animations.animate(this, interpolator, drawShown, anim_t);
           } else {
-            draw(canvas.node(), div, points);
+            animations.cancel(this);
+            drawShown(points);
           }
-
-          this._r2pPrevPoints = points;
-
         });
       });
   }
@@ -378,6 +398,28 @@ function scalarDistributionView() {
     return render;
   };
 
+  // Above this many points, draw a density strip rather than one dot per
+  // point.
+  render.densityThreshold = function(value) {
+    if (!arguments.length) return densityThreshold;
+    densityThreshold = value;
+    return render;
+  };
+
+  render.binned = function(value) {
+    if (!arguments.length) return binned;
+    binned = value;
+    return render;
+  };
+
+  // The r2p.animationClock that schedules this view's animations, by
+  // default one shared by the whole document.
+  render.clock = function(value) {
+    if (!arguments.length) return clock;
+    clock = value;
+    return render;
+  };
+
   return render;
 }
 
@@ -408,6 +450,8 @@ function scalarDistributionListView() {
       pointRadius = 1,
       useDataMin = false,
       useDataMax = false,
+      densityThreshold = 20000,
+      binned = false,
       cnvMult = 4;
 
   function render(selection) {
@@ -481,7 +525,11 @@ function scalarDistributionListView() {
           .style("height", `${height}px`);
 
         canvas.each(function(d) {
-          let ctx = this.getContext("2d");
+          measured("draw", () => drawConfigs(this, d));
+        });
+
+        function drawConfigs(canvasNode, d) {
+          let ctx = canvasNode.getContext("2d");
 
           const cnv_x = d3.scaleLinear()
                 .domain(scale.domain())
@@ -507,16 +555,28 @@ function scalarDistributionListView() {
           ctx.lineTo(cnv_x(fmax(d)), cnv_y(d.nConfigs));
           ctx.stroke();
 
-          ctx.fillStyle = "blue";
-          ctx.globalAlpha = 0.4;
+          const r = pointRadius * cnvMult;
+          if (binned) {
+            // Row i of d.counts is the histogram of config d.iConfigs[i].
+            drawHistograms(ctx, d.counts, d.iConfigs.length,
+                           pixelPositions(d.edges, cnv_x),
+                           row => cnv_y(d.iConfigs[row] + 0.5),
+                           cnv_y(1) - cnv_y(0), "blue");
+            return;
+          }
 
-          for (let i = 0; i < d.values.length; i++) {
-            ctx.beginPath();
-            ctx.arc(cnv_x(d.values[i]), cnv_y(d.iConfigs[i] + 0.5),
-                    pointRadius*cnvMult, 0, 2 * Math.PI);
-            ctx.fill();
+          const xs = pixelPositions(d.values, cnv_x);
+          if (d.values.length > densityThreshold) {
+            drawDensity(ctx, xs, d.iConfigs, d.nConfigs,
+                        iConfig => cnv_y(iConfig + 0.5), 2 * r,
+                        canvasNode.width, "blue", 0.4);
+          } else {
+            // cnv_y(iConfig + 0.5) for each point
+            const ys = pixelPositions(d.iConfigs, cnv_y.copy()
+                                      .domain([-0.5, d.nConfigs - 0.5]));
+            drawDots(ctx, xs, ys, dotSprite(r, "blue", 0.4));
           }
-        });
+        }
       });
   }
 
@@ -562,6 +622,20 @@ function scalarDistributionListView() {
     return render;
   };
 
+  render.densityThreshold = function(value) {
+    if (!arguments.length) return densityThreshold;
+    densityThreshold = value;
+    return render;
+  };
+
+  // When binned, each datum has counts and edges, the histograms of each
+  // of its configs, rather than values.
+  render.binned = function(value) {
+    if (!arguments.length) return binned;
+    binned = value;
+    return render;
+  };
+
   return render;
 }
 
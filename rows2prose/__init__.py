@@ -6,4 +6,11 @@ from .web import (Snapshot,
                   static,
                   dynamic,
                   header_content,
-                  full_html)
+                  write_bundle,
+                  full_html,
+                  Control,
+                  ColumnRegistry,
+                  ReportWriter,
+                  TemplateCache,
+                  collect_stats)
+from .encoding import ColumnEncoder
@@ -0,0 +1,159 @@
+"""
+Server-side histograms for distribution views.
+
+Rather than shipping every sample of a column to the browser, a
+HistogramEncoder ships, for each column, its bin edges and a count per bin
+per group (e.g. per i_config or per i_timestep), so the payload scales with
+the number of bins rather than the number of rows.
+"""
+import numpy as np
+
+from rows2prose.encoding import ColumnEncoder, iter_columns
+
+
+def edges_column(name):
+    """
+    The name under which the bin edges of column name are encoded.
+    """
+    return f"{name}/edges"
+
+
+def bin_edges(values, bins, log_scale=False):
+    """
+    Returns bins + 1 edges spanning the finite values (the positive ones, if
+    log_scale), evenly spaced or, if log_scale, evenly spaced in log space.
+    """
+    valid = np.isfinite(values)
+    if log_scale:
+        valid &= values > 0
+    values = values[valid]
+    if len(values):
+        lo, hi = float(values.min()), float(values.max())
+    else:
+        lo = 1.0 if log_scale else 0.0
+        hi = lo
+    # Need a valid range, so these need to be different.
+    if hi == lo:
+        hi = lo * 10 if log_scale else lo + 1
+    return (np.geomspace(lo, hi, bins + 1) if log_scale
+            else np.linspace(lo, hi, bins + 1))
+
+
+def grouped_histograms(values, codes, n_groups, edges, log_scale=False):
+    """
+    Counts values per group and bin, where codes[i] is the group of
+    values[i]. Non-finite values (and non-positive ones, if log_scale) are
+    not counted.
+
+    Returns an int32 array of shape (n_groups, len(edges) - 1).
+    """
+    bins = len(edges) - 1
+    valid = np.isfinite(values)
+    if log_scale:
+        valid &= values > 0
+    if not valid.all():
+        values = values[valid]
+        codes = codes[valid]
+
+    if log_scale:
+        lo, hi = np.log(edges[0]), np.log(edges[-1])
+        values = np.log(values)
+    else:
+        lo, hi = edges[0], edges[-1]
+    i_bin = ((values - lo) * (bins / (hi - lo))).astype(np.int64)
+    np.clip(i_bin, 0, bins - 1, out=i_bin)
+
+    counts = np.bincount(codes * bins + i_bin, minlength=n_groups * bins)
+    return counts.astype(np.int32).reshape(n_groups, bins)
+
+
+def group_codes(values):
+    """
+    Returns (groups, codes): the sorted unique values and, for each value,
+    its position in groups. Small non-negative integers, such as configs
+    and timesteps, are counted rather than sorted.
+    """
+    if (values.dtype.kind in "iu" and len(values)
+            and values.min() >= 0 and values.max() < 4 * len(values)):
+        present = np.bincount(values) > 0
+        groups = np.flatnonzero(present).astype(values.dtype)
+        codes = (np.cumsum(present) - 1)[values]
+        return groups, codes
+    groups, codes = np.unique(values, return_inverse=True)
+    return groups, codes.reshape(-1)
+
+
+def histogram_table(df, bins, log_scale=False, group_column=None,
+                    columns=None):
+    """
+    Returns a dict of arrays holding, for each column of df other than
+    group_column (only those in columns, if given), the flattened
+    (groups x bins) counts under the column's name and its bin edges under
+    edges_column(name). Groups are the sorted unique values of
+    group_column, which is replaced by them, so row i of every histogram
+    belongs to group_column[i]. Without a group_column, there is one group.
+    """
+    table = {}
+    if group_column is None:
+        codes, n_groups = None, 1
+    else:
+        found = [values for _, values in iter_columns(df, (group_column,))]
+        if not found:
+            raise KeyError(f"group_column {group_column!r} is missing from "
+                           "the data")
+        groups, codes = group_codes(found[0])
+        n_groups = len(groups)
+        table[group_column] = groups
+
+    for name, values in iter_columns(df, columns):
+        if name == group_column:
+            continue
+        values = np.asarray(values, dtype=np.float64)
+        edges = bin_edges(values, bins, log_scale)
+        table[name] = grouped_histograms(
+            values,
+            np.zeros(len(values), dtype=np.int64) if codes is None else codes,
+            n_groups, edges, log_scale).reshape(-1)
+        table[edges_column(name)] = edges
+    return table
+
+
+class HistogramEncoder(ColumnEncoder):
+    """
+    A ColumnEncoder that encodes each column's per-group histograms (see
+    histogram_table) rather than its rows. Histograms computed from
+    different rows have different bin edges, so they can't be appended;
+    appendable is False.
+    """
+    appendable = False
+
+    def __init__(self, bins=64, log_scale=False, group_column=None,
+                 **kwargs):
+        super().__init__(**kwargs)
+        if bins < 1:
+            raise ValueError(f"bins must be positive, got {bins!r}")
+        self.bins = bins
+        self.log_scale = log_scale
+        self.group_column = group_column
+
+    @classmethod
+    def like(cls, encoder, **kwargs):
+        """
+        Returns a HistogramEncoder with the same precision, compression,
+        chunking and executor as encoder.
+        """
+        return cls(precision=encoder.precision,
+                   compression=encoder.compression,
+                   filters=encoder.filters,
+                   compression_level=encoder.compression_level,
+                   chunk_size=encoder.chunk_size,
+                   executor=encoder.executor,
+                   **kwargs)
+
+    def entries(self, df, index_columns=(), columns=None, exact_columns=()):
+        table = histogram_table(df, self.bins, self.log_scale,
+                                self.group_column, columns)
+        # Edges are few, and quantizing them would misplace bins.
+        edges = {edges_column(name) for name in table}
+        yield from super().entries(table, index_columns,
+                                   exact_columns=edges | set(exact_columns))
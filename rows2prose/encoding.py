@@ -0,0 +1,554 @@
+"""
+Column encoding for the payloads consumed by r2p.parseColumns.
+
+The encoder reads each column's buffer directly from the DataFrame, casts
+only the columns that need it (one at a time), and streams base64 chunks to
+a writer, so encoding a frame never holds a copy of the whole frame or a
+whole-frame base64 string in memory. Arrow tables and Polars frames are
+read through Arrow rather than converted to pandas first.
+"""
+import base64
+import collections
+import hashlib
+import io
+import json
+import os
+import time
+import zlib
+
+import numpy as np
+
+from rows2prose import instrument
+
+
+# Must be a multiple of 3 so that consecutive base64 chunks concatenate
+# without padding.
+CHUNK_SIZE = 3 << 18
+
+
+# javascript BigInts cause problems in code that expects javascript Numbers,
+# so 64-bit integers are narrowed to 32 bits.
+TRANSPORT_DTYPES = {
+    np.dtype(np.int64): np.dtype(np.int32),
+    np.dtype(np.uint64): np.dtype(np.uint32),
+}
+
+
+# Precision policies, from most to least precise. Any policy other than None
+# narrows non-negative integers to uint8/uint16 when they fit. "float32"
+# casts float64 to float32; "uint16" and "uint8" quantize floats linearly
+# onto that many levels, with a per-column scale and offset. Index columns
+# keep their exact float values under every policy.
+PRECISIONS = (None, "float32", "uint16", "uint8")
+
+
+def arrow_table(df):
+    """
+    Returns df, an Arrow Table or RecordBatch, a Polars DataFrame or
+    anything implementing the Arrow PyCapsule stream or DataFrame
+    interchange protocols, as a pyarrow.Table. Conversion shares the
+    frame's buffers wherever the source allows.
+    """
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise ImportError(
+            f"Reading a {type(df).__name__} requires pyarrow; install it or "
+            "pass a pandas DataFrame or a dict of arrays") from None
+    if isinstance(df, pa.Table):
+        return df
+    if isinstance(df, pa.RecordBatch):
+        return pa.Table.from_batches([df])
+    if hasattr(df, "to_arrow"):
+        return df.to_arrow()
+    if hasattr(df, "__arrow_c_stream__"):
+        return pa.table(df)
+    if hasattr(df, "__dataframe__"):
+        from pyarrow.interchange import from_dataframe
+        return from_dataframe(df)
+    raise TypeError(f"Can't read columns from a {type(df).__name__}; "
+                    "expected a DataFrame, an Arrow table or a dict of "
+                    "arrays")
+
+
+def arrow_values(column):
+    """
+    Returns an Arrow ChunkedArray as a NumPy array, without copying if it
+    has one chunk, no nulls and a NumPy-compatible type. Nulls in numeric
+    columns become NaN, so integer columns with nulls become float64.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    array = (column.chunk(0) if column.num_chunks == 1
+             else column.combine_chunks())
+    if array.null_count and (pa.types.is_integer(array.type)
+                             or pa.types.is_floating(array.type)):
+        if not pa.types.is_floating(array.type):
+            array = array.cast(pa.float64())
+        array = pc.fill_null(array, pa.scalar(np.nan, array.type))
+    try:
+        return array.to_numpy(zero_copy_only=True)
+    except pa.ArrowInvalid:
+        return array.to_numpy(zero_copy_only=False)
+
+
+def is_pandas(df):
+    return hasattr(df, "iloc") and hasattr(df, "columns")
+
+
+def column_names(df):
+    """
+    Returns the names of df's columns, for any frame iter_columns reads.
+    """
+    if isinstance(df, dict):
+        return list(df)
+    if is_pandas(df):
+        return list(df.columns)
+    if hasattr(df, "column_names"):
+        # An attribute of Arrow tables, a method of interchange frames.
+        names = df.column_names
+        return list(names() if callable(names) else names)
+    if hasattr(df, "columns"):
+        return list(df.columns)
+    if hasattr(df, "__dataframe__"):
+        return list(df.__dataframe__().column_names())
+    return arrow_table(df).column_names
+
+
+def row_count(df):
+    """
+    Returns the number of rows of df, for any frame iter_columns reads.
+    """
+    if isinstance(df, dict):
+        return len(next(iter(df.values()), ()))
+    if hasattr(df, "__len__"):
+        return len(df)
+    if hasattr(df, "__dataframe__"):
+        return df.__dataframe__().num_rows()
+    return arrow_table(df).num_rows
+
+
+def iter_columns(df, columns=None):
+    """
+    Yields (name, values) for each column of df, or only for those in
+    columns, without copying the frame. df is a dict of arrays, a pandas
+    DataFrame or anything arrow_table accepts, such as a Polars DataFrame;
+    those are read through Arrow, never through pandas.
+    """
+    if isinstance(df, dict):
+        for col, values in df.items():
+            if columns is None or col in columns:
+                yield col, np.asarray(values)
+        return
+    if is_pandas(df):
+        for col in df.columns:
+            if columns is None or col in columns:
+                yield col, df[col].to_numpy(copy=False)
+        return
+    if (columns is not None and hasattr(df, "__dataframe__")
+            and not hasattr(df, "to_arrow")):
+        # Only convert the columns that will be encoded.
+        df = df.__dataframe__().select_columns_by_name(
+            [col for col in column_names(df) if col in columns])
+    table = arrow_table(df)
+    for col, column in zip(table.column_names, table.columns):
+        if columns is None or col in columns:
+            yield col, arrow_values(column)
+
+
+def concat_frames(frames):
+    """
+    Returns the rows of frames, which share their columns, as one dict of
+    arrays.
+    """
+    parts = collections.defaultdict(list)
+    for df in frames:
+        for col, values in iter_columns(df):
+            parts[col].append(values)
+    return {col: np.concatenate(values) for col, values in parts.items()}
+
+
+def value_range(values):
+    """
+    Returns (min, max) of a numeric column, ignoring NaNs, or None if it is
+    empty, holds only NaNs or holds infinities.
+    """
+    if values.dtype.kind not in "iuf" or not len(values):
+        return None
+    if values.dtype.kind == "f":
+        lo, hi = np.fmin.reduce(values), np.fmax.reduce(values)
+        if not (np.isfinite(lo) and np.isfinite(hi)):
+            return None
+        return float(lo), float(hi)
+    return int(values.min()), int(values.max())
+
+
+def transport_values(values):
+    """
+    Returns values with a dtype the browser can consume, copying only if the
+    column needs a cast.
+    """
+    dtype = TRANSPORT_DTYPES.get(values.dtype)
+    if dtype is not None:
+        values = values.astype(dtype)
+    return np.ascontiguousarray(values)
+
+
+def narrow_ints(values):
+    """
+    Casts non-negative integers to uint8 or uint16 when they fit.
+    """
+    if not len(values) or values.min() < 0:
+        return values
+    hi = values.max()
+    for dtype in (np.uint8, np.uint16):
+        if hi <= np.iinfo(dtype).max:
+            return values.astype(dtype)
+    return values
+
+
+def quantize(values, dtype):
+    """
+    Maps floats linearly onto the codes of an unsigned integer dtype, so that
+    values ~= offset + codes * scale. If values holds NaNs, they take the
+    largest code, returned as nan_code.
+
+    Returns (codes, scale, offset, nan_code), or None if values holds
+    infinities.
+    """
+    nan = np.isnan(values)
+    has_nan = bool(nan.any())
+    finite = values[~nan] if has_nan else values
+    if not np.isfinite(finite).all():
+        return None
+
+    max_code = np.iinfo(dtype).max - has_nan
+    lo = float(finite.min()) if len(finite) else 0.0
+    hi = float(finite.max()) if len(finite) else 0.0
+    scale = (hi - lo) / max_code if hi > lo else 1.0
+    codes = np.rint((values - lo) / scale)
+    if has_nan:
+        codes[nan] = max_code + 1
+    return (codes.astype(dtype), scale, lo,
+            max_code + 1 if has_nan else None)
+
+
+# Prefilters applied before deflate. "delta" stores differences between
+# consecutive integers (monotone columns such as timesteps become runs of
+# small numbers); "shuffle" groups the i-th byte of every value together,
+# which makes the slowly-varying high bytes of numbers compressible.
+FILTERS = ("delta", "shuffle")
+
+
+def default_filters(values, quantized=False):
+    """
+    The filters used for a column unless the encoder overrides them. See
+    benchmarks/bench_compression.py for the measurements behind this choice:
+    delta only pays off for integer columns such as timesteps and configs,
+    not for quantized floats.
+    """
+    if values.dtype.kind in "iu" and not quantized:
+        return ("delta", "shuffle")
+    return ("shuffle",)
+
+
+def deflate(values, filters, level=6):
+    """
+    Returns the zlib-compressed bytes of values after applying filters, as a
+    uint8 array.
+    """
+    if "delta" in filters:
+        if values.dtype.kind not in "iu":
+            raise ValueError("delta filter requires an integer column")
+        values = np.diff(values, prepend=values.dtype.type(0))
+    raw = values.reshape(-1).view(np.uint8)
+    if "shuffle" in filters and values.dtype.itemsize > 1:
+        raw = np.ascontiguousarray(
+            raw.reshape(-1, values.dtype.itemsize).T).reshape(-1)
+    return np.frombuffer(zlib.compress(raw, level), dtype=np.uint8)
+
+
+def iter_base64(values, chunk_size=CHUNK_SIZE):
+    """
+    Yields the base64 encoding of a contiguous array's bytes in chunks.
+    """
+    raw = values.reshape(-1).view(np.uint8)
+    for start in range(0, len(raw), chunk_size):
+        yield base64.b64encode(raw[start:start + chunk_size]).decode("ascii")
+
+
+def row_index(values):
+    """
+    Groups row numbers by value, CSR style: rows holding the j-th smallest
+    unique value are order[offsets[j]:offsets[j + 1]], in increasing order.
+
+    Returns (order, offsets) as int32 arrays. order is None when values is
+    already sorted, in which case it is the identity.
+    """
+    if len(values) and (values[1:] >= values[:-1]).all():
+        order = None
+        sorted_values = values
+    else:
+        order = np.argsort(values, kind="stable").astype(np.int32)
+        sorted_values = values[order]
+    is_start = np.empty(len(values), dtype=bool)
+    is_start[:1] = True
+    np.not_equal(sorted_values[1:], sorted_values[:-1], out=is_start[1:])
+    offsets = np.append(np.flatnonzero(is_start),
+                        len(values)).astype(np.int32)
+    return order, offsets
+
+
+def entry_digest(entry):
+    """
+    Returns a hex digest of an entry from ColumnEncoder.entries, covering
+    its bytes and metadata, so that equal digests mean equal payloads.
+    """
+    h = hashlib.blake2b(digest_size=16)
+
+    def update(entry):
+        for k, v in entry.items():
+            h.update(json.dumps(k).encode("utf-8"))
+            if isinstance(v, np.ndarray):
+                h.update(str(v.dtype).encode("ascii"))
+                h.update(np.ascontiguousarray(v).reshape(-1).view(np.uint8))
+            elif isinstance(v, dict):
+                h.update(b"{")
+                update(v)
+                h.update(b"}")
+            else:
+                h.update(json.dumps(v).encode("utf-8"))
+
+    update(entry)
+    return h.hexdigest()
+
+
+class ColumnEncoder:
+    """
+    Encodes DataFrame columns into the {"column": {"type": ..., "data": ...}}
+    structure that r2p.parseColumns decodes.
+    """
+    # Whether payloads encoded from consecutive row ranges can be appended
+    # to each other in the browser.
+    appendable = True
+
+    def __init__(self, precision=None, compression=None, filters=None,
+                 compression_level=6, chunk_size=CHUNK_SIZE, executor=None):
+        if precision not in PRECISIONS:
+            raise ValueError(f"precision must be one of {PRECISIONS}, "
+                             f"got {precision!r}")
+        if compression not in (None, "deflate"):
+            raise ValueError("compression must be None or 'deflate', "
+                             f"got {compression!r}")
+        if filters is not None and not set(filters) <= set(FILTERS):
+            raise ValueError(f"filters must be drawn from {FILTERS}, "
+                             f"got {filters!r}")
+        self.precision = precision
+        self.compression = compression
+        self.filters = filters
+        self.compression_level = compression_level
+        self.chunk_size = chunk_size
+        # A concurrent.futures.Executor, typically a ThreadPoolExecutor,
+        # that encodes columns in parallel. Casting, quantizing, compressing
+        # and indexing release the GIL, but base64 encoding doesn't, so it
+        # stays on the calling thread. See benchmarks/bench_parallel.py.
+        self.executor = executor
+
+    def __getstate__(self):
+        # Executors can't be pickled, e.g. to encode in another process.
+        state = self.__dict__.copy()
+        state["executor"] = None
+        return state
+
+    def compress_entry(self, entry):
+        """
+        Replaces entry["data"] with its compressed bytes if this encoder
+        compresses. Decompressing requires r2p.loadColumns.
+        """
+        if self.compression is None:
+            return entry
+        values = entry["data"]
+        filters = (self.filters if self.filters is not None
+                   else default_filters(values, "scale" in entry))
+        if values.dtype.kind not in "iu":
+            filters = tuple(f for f in filters if f != "delta")
+        entry["data"] = deflate(values, filters, self.compression_level)
+        entry["compression"] = self.compression
+        entry["filters"] = list(filters)
+        return entry
+
+    def encode_values(self, values, exact=False):
+        """
+        Returns the entry for one column's values under this encoder's
+        precision policy. With exact, only the lossless narrowing of
+        integers applies, as for index columns, whose row index groups the
+        exact values: quantized or float32 keys could collide.
+        """
+        values = transport_values(values)
+        if self.precision is None:
+            return {"type": str(values.dtype), "data": values}
+
+        if values.dtype.kind in "iu":
+            values = narrow_ints(values)
+        elif values.dtype.kind == "f" and not exact:
+            q = (quantize(values, np.dtype(self.precision))
+                 if self.precision != "float32"
+                 else None)
+            if q is not None:
+                codes, scale, offset, nan_code = q
+                entry = {"type": self.precision, "data": codes,
+                         "scale": scale, "offset": offset}
+                if nan_code is not None:
+                    entry["nan"] = nan_code
+                return entry
+            if values.dtype == np.float64:
+                values = values.astype(np.float32)
+        return {"type": str(values.dtype), "data": values}
+
+    def encode_column(self, name, values, index_columns=(),
+                      exact_columns=()):
+        """
+        Returns the entry for one column, see entries.
+        """
+        exact = name in index_columns or name in exact_columns
+        entry = self.compress_entry(self.encode_values(values, exact=exact))
+        extent = value_range(values)
+        if extent is not None:
+            entry["min"], entry["max"] = extent
+        if name in index_columns:
+            order, offsets = row_index(values)
+            entry["index"] = {"offsets": self.compress_entry(
+                {"type": "int32", "data": offsets})}
+            if order is not None:
+                entry["index"]["order"] = self.compress_entry(
+                    {"type": "int32", "data": order})
+        return entry
+
+    def _encode_column(self, block, name, values, index_columns,
+                       exact_columns):
+        # Runs on the executor's threads, which don't see the calling
+        # thread's current block, so the block is passed in.
+        if block is None:
+            return self.encode_column(name, values, index_columns,
+                                      exact_columns)
+        start = time.perf_counter()
+        entry = self.encode_column(name, values, index_columns,
+                                   exact_columns)
+        block.add_column(name, values, entry, time.perf_counter() - start,
+                         name in index_columns)
+        return entry
+
+    def entries(self, df, index_columns=(), columns=None, exact_columns=()):
+        """
+        Yields (name, entry) for each column, where entry["data"] is the
+        transport-ready array rather than its base64 encoding. Columns named
+        in index_columns also get a row index (see row_index) so the browser
+        can look up rows by value without scanning. Like them, columns in
+        exact_columns skip the lossy part of the precision policy. Each entry also carries
+        the column's "min" and "max" when they are finite, so the browser
+        needn't scan for them. If columns is given, other columns are
+        skipped.
+        """
+        block = instrument.current_block()
+        if self.executor is None:
+            for name, values in iter_columns(df, columns):
+                yield name, self._encode_column(block, name, values,
+                                                index_columns, exact_columns)
+            return
+
+        # Keep a bounded number of columns in flight, so that memory stays
+        # proportional to a few columns rather than to the frame.
+        max_pending = 2 * (os.cpu_count() or 1)
+        pending = collections.deque()
+        for name, values in iter_columns(df, columns):
+            pending.append((name, self.executor.submit(
+                self._encode_column, block, name, values, index_columns,
+                exact_columns)))
+            if len(pending) >= max_pending:
+                name, future = pending.popleft()
+                yield name, future.result()
+        while pending:
+            name, future = pending.popleft()
+            yield name, future.result()
+
+    def write_entry(self, entry, write):
+        write("{")
+        for i, (k, v) in enumerate(entry.items()):
+            if i:
+                write(", ")
+            write(json.dumps(k))
+            write(": ")
+            if isinstance(v, np.ndarray):
+                write('"')
+                for chunk in iter_base64(v, self.chunk_size):
+                    write(chunk)
+                write('"')
+            elif isinstance(v, dict):
+                self.write_entry(v, write)
+            else:
+                write(json.dumps(v))
+        write("}")
+
+    def write_json(self, df, write, index_columns=(), columns=None):
+        """
+        Streams the JSON encoding of df's columns through write().
+        """
+        block = instrument.current_block()
+        if block is not None:
+            write = block.counting(write)
+        write("{")
+        for i, (name, entry) in enumerate(
+                self.entries(df, index_columns, columns)):
+            if i:
+                write(", ")
+            write(json.dumps(str(name)))
+            write(": ")
+            self.write_entry(entry, write)
+        write("}")
+
+    def to_json(self, df, index_columns=(), columns=None):
+        out = io.StringIO()
+        self.write_json(df, out.write, index_columns, columns)
+        return out.getvalue()
+
+    def to_message(self, df, index_columns=(), columns=None):
+        """
+        Returns (columns, buffers) for binary transports: columns has the
+        structure of to_dict, except that each "data" is replaced by
+        "buffer", an index into buffers, which holds the raw column bytes.
+        """
+        buffers = []
+
+        def split(entry):
+            out = {}
+            for k, v in entry.items():
+                if isinstance(v, np.ndarray):
+                    out["buffer"] = len(buffers)
+                    buffers.append(memoryview(v.reshape(-1).view(np.uint8)))
+                elif isinstance(v, dict):
+                    out[k] = split(v)
+                else:
+                    out[k] = v
+            return out
+
+        encoded = {str(name): split(entry)
+                   for name, entry in self.entries(df, index_columns,
+                                                   columns)}
+        return encoded, buffers
+
+    def materialize(self, entry):
+        return {
+            k: ("".join(iter_base64(v, self.chunk_size))
+                if isinstance(v, np.ndarray)
+                else self.materialize(v) if isinstance(v, dict)
+                else v)
+            for k, v in entry.items()
+        }
+
+    def to_dict(self, df, index_columns=(), columns=None):
+        return {name: self.materialize(entry)
+                for name, entry in self.entries(df, index_columns, columns)}
+
+
+DEFAULT_ENCODER = ColumnEncoder()
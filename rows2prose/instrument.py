@@ -0,0 +1,224 @@
+"""
+Opt-in instrumentation, for finding the blocks and columns that make a
+report slow or large:
+
+    with rows2prose.web.collect_stats() as stats:
+        report.static(df, html, script)
+        ...
+    print(stats.report())
+
+While stats are collected, each block rendered by static, static_many,
+ReportWriter, display or NotebookUpdater records a BlockStats, and the
+blocks call r2p.instrument() in the browser, which then records
+performance measures for parsing, onTableLoaded, renderRows and drawing,
+summarized by r2p.stats().
+"""
+import contextlib
+import threading
+import time
+
+import numpy as np
+
+
+class ColumnStats:
+    """
+    One encoded column. raw_bytes is its size before encoding and
+    encoded_bytes its size after the encoder's precision policy and
+    compression, as sent over a comm; pages send it base64 encoded. A
+    HistogramEncoder's columns are its histograms and their edges.
+    """
+    def __init__(self, name, raw_bytes, encoded_bytes, seconds):
+        self.name = name
+        self.raw_bytes = raw_bytes
+        self.encoded_bytes = encoded_bytes
+        self.seconds = seconds
+
+    def to_dict(self):
+        return dict(vars(self))
+
+
+class BlockStats:
+    """
+    One rendered block. kind names what rendered it, e.g. "static" or
+    "set_data". timesteps counts the distinct values of the block's index
+    column, or is None if it wasn't encoded, e.g. because a ColumnRegistry
+    already had it. payload_bytes is the size of the column data the block
+    sent, and script_bytes the size of everything else it generated, apart
+    from its html.
+    """
+    def __init__(self, kind, rows):
+        self.kind = kind
+        self.rows = rows
+        self.timesteps = None
+        self.columns = []
+        self.seconds = 0.0
+        self.payload_bytes = 0
+        self.script_bytes = 0
+
+    @property
+    def encode_seconds(self):
+        """
+        The time spent encoding columns, summed over columns, so with an
+        encoder's executor it can exceed seconds.
+        """
+        return sum(c.seconds for c in self.columns)
+
+    @property
+    def raw_bytes(self):
+        return sum(c.raw_bytes for c in self.columns)
+
+    @property
+    def encoded_bytes(self):
+        return sum(c.encoded_bytes for c in self.columns)
+
+    def add_column(self, name, values, entry, seconds, is_index=False):
+        self.columns.append(ColumnStats(str(name), values.nbytes,
+                                        entry_nbytes(entry), seconds))
+        if is_index:
+            self.timesteps = distinct_count(values)
+
+    def counting(self, write):
+        """
+        Wraps write so that the text written through it counts as payload.
+        """
+        def counted(text):
+            self.payload_bytes += len(text)
+            write(text)
+        return counted
+
+    def finish(self, output_bytes, html_bytes=0):
+        """
+        Records the size of the block's whole output, which includes
+        html_bytes of the caller's html and the payload counted so far.
+        """
+        self.script_bytes = output_bytes - html_bytes - self.payload_bytes
+
+    def to_dict(self):
+        d = {k: v for k, v in vars(self).items() if k != "columns"}
+        d.update(encode_seconds=self.encode_seconds,
+                 raw_bytes=self.raw_bytes,
+                 encoded_bytes=self.encoded_bytes,
+                 columns=[c.to_dict() for c in self.columns])
+        return d
+
+
+class RenderStats:
+    """
+    The BlockStats recorded by collect_stats, in the order blocks finished.
+    """
+    def __init__(self):
+        self.blocks = []
+
+    def to_dict(self):
+        return {"blocks": [b.to_dict() for b in self.blocks]}
+
+    def report(self, n_columns=3):
+        """
+        Returns a table of the blocks, each followed by its n_columns
+        largest columns.
+        """
+        lines = [f"{'block':<14} {'rows':>9} {'steps':>6} {'encode s':>9} "
+                 f"{'total s':>8} {'raw KB':>9} {'encoded KB':>11} "
+                 f"{'payload KB':>11} {'script KB':>10}"]
+        for i, b in enumerate(self.blocks):
+            steps = "" if b.timesteps is None else b.timesteps
+            lines.append(
+                f"{f'{i} {b.kind}':<14} {b.rows:>9} {steps:>6} "
+                f"{b.encode_seconds:>9.4f} {b.seconds:>8.4f} "
+                f"{b.raw_bytes / 1e3:>9.1f} {b.encoded_bytes / 1e3:>11.1f} "
+                f"{b.payload_bytes / 1e3:>11.1f} "
+                f"{b.script_bytes / 1e3:>10.1f}")
+            largest = sorted(b.columns, key=lambda c: c.encoded_bytes,
+                             reverse=True)[:n_columns]
+            for c in largest:
+                lines.append(
+                    f"  {c.name[:29]:<29} {c.seconds:>9.4f} {'':>8} "
+                    f"{c.raw_bytes / 1e3:>9.1f} "
+                    f"{c.encoded_bytes / 1e3:>11.1f}")
+        return "\n".join(lines)
+
+
+def entry_nbytes(entry):
+    """
+    The size of an entry's arrays, including its row index's.
+    """
+    return sum(entry_nbytes(v) if isinstance(v, dict)
+               else v.nbytes if isinstance(v, np.ndarray)
+               else 0
+               for v in entry.values())
+
+
+def distinct_count(values):
+    if len(values) and (values[1:] >= values[:-1]).all():
+        return int(np.count_nonzero(values[1:] != values[:-1])) + 1
+    return len(np.unique(values))
+
+
+# Collectors are shared by all threads, so that blocks rendered by e.g. a
+# NotebookUpdater's background thread are collected, but each thread has
+# its own current block.
+_lock = threading.Lock()
+_collectors = []
+_local = threading.local()
+
+
+@contextlib.contextmanager
+def collect_stats():
+    """
+    Records a BlockStats for each block rendered until the context exits,
+    into the RenderStats it yields.
+    """
+    stats = RenderStats()
+    with _lock:
+        _collectors.append(stats)
+    try:
+        yield stats
+    finally:
+        with _lock:
+            _collectors.remove(stats)
+
+
+def collecting():
+    return bool(_collectors)
+
+
+def current_block():
+    """
+    The BlockStats being recorded on this thread, or None.
+    """
+    return getattr(_local, "block", None)
+
+
+@contextlib.contextmanager
+def block(kind, rows):
+    """
+    Records a BlockStats for the block rendered inside the context, which
+    it yields, or yields None when no stats are being collected.
+    """
+    with _lock:
+        stats = _collectors[-1] if _collectors else None
+    if stats is None:
+        yield None
+        return
+
+    b = BlockStats(kind, rows)
+    outer = current_block()
+    _local.block = b
+    start = time.perf_counter()
+    try:
+        yield b
+    finally:
+        b.seconds = time.perf_counter() - start
+        _local.block = outer
+        with _lock:
+            stats.blocks.append(b)
+
+
+def add_blocks(blocks):
+    """
+    Adds blocks recorded elsewhere, e.g. in a worker process, to the
+    stats being collected.
+    """
+    with _lock:
+        if _collectors:
+            _collectors[-1].blocks.extend(blocks)
@@ -1,18 +1,27 @@
+import json
+import threading
+import time
 import uuid
 
 import rows2prose.web
+from rows2prose import instrument
+from rows2prose.encoding import DEFAULT_ENCODER, concat_frames, row_count
+from rows2prose.instrument import collect_stats
+from rows2prose.slicing import TimestepSlicer
 from rows2prose.web import (Snapshot,
                             Timeline,
                             DistributionSnapshot,
                             DistributionTimeline,
                             DistributionListSnapshot)
-import IPython.display as ipd
 
 
 
 def init_notebook_mode():
+    # IPython.display is imported on first use throughout this module, since
+    # importing it takes hundreds of milliseconds.
+    import IPython.display as ipd
     ipd.display(ipd.HTML(
-        rows2prose.web.header_content() + """
+        rows2prose.web.header_content(guard=True) + """
     <script>
       if (window.r2pQueue) {{
         window.r2pQueue.forEach(([k, f]) => f());
@@ -22,14 +31,68 @@ def init_notebook_mode():
     """))
 
 
-def display(df, html, script):
+def display(df, html, script, lazy=False, release=False, registry=None,
+            data_id=None, templates=None):
+    """
+    Displays html rendered with df's columns. With lazy (and release), the
+    output is only rendered once scrolled into view, and with a
+    ColumnRegistry or TemplateCache shared across cells, columns or
+    template code that an earlier output already sent are referenced rather
+    than sent again, as with rows2prose.web.static.
+    """
+    import IPython.display as ipd
+    compiled, definition_js = None, ""
+    if templates is not None:
+        compiled, definition_js = templates.compile(html, script)
+        columns = compiled.columns
+    else:
+        columns = script.referenced_columns(html)
+    rows2prose.web.warn_missing_columns(df, columns)
+    with instrument.block("display", row_count(df)) as stats:
+        out = _static_output(df, html, script, columns, lazy, release,
+                             registry, data_id, compiled, definition_js,
+                             stats)
+        if stats is not None:
+            stats.finish(len(out), len(html))
+    ipd.display(ipd.HTML(out))
+
+
+def _static_output(df, html, script, columns, lazy=False, release=False,
+                   registry=None, data_id=None, compiled=None,
+                   definition_js="", stats=None):
     element_id = str(uuid.uuid1())
-    ipd.display(ipd.HTML(f"""
+    data_js, tags = None, ""
+    if registry is not None:
+        data_js, tags = registry.encode(df, script.encoder,
+                                        script.index_columns, columns,
+                                        data_id)
+        if stats is not None:
+            stats.payload_bytes += len(tags) + len(data_js)
+    payload = ""
+    if lazy:
+        if data_js is None:
+            payload = rows2prose.web.payload_script(element_id, df, script,
+                                                    columns)
+        render_js = rows2prose.web.lazy_render_js(element_id, script,
+                                                  columns, release, data_js,
+                                                  compiled)
+    elif compiled is not None:
+        render_js = f"""
+  let render = {compiled.render_js(script.table_js(df, columns, data_js))};
+  render(document.getElementById("{element_id}"));
+"""
+    else:
+        render_js = f"""
+  let render = {script.static_js(df, columns, data_js)};
+  render(document.getElementById("{element_id}"));
+"""
+    return f"""{tags}
 <div id="{element_id}">{html}</div>
+{payload}
 <script>
 function renderStatic() {{
-  let render = {script.static_js(df)};
-  render(document.getElementById("{element_id}"));
+{rows2prose.web.instrument_js(stats)}{definition_js}
+{render_js}
 }}
 
 if (window.r2p) {{
@@ -42,46 +105,362 @@ if (window.r2p) {{
     window.r2pQueue.push(["", renderStatic]);
 }}
 </script>
-"""))
+"""
+
+
+def _when_loaded_js(fn, queue_key, stale_keys_js):
+    """
+    JS that calls fn now if the bundle has loaded, otherwise queues it for
+    init_notebook_mode, first dropping queued calls whose keys are in the
+    array stale_keys_js.
+    """
+    return f"""
+  if (window.r2p) {{
+    {fn}();
+  }} else {{
+      if (!window.r2pQueue) {{
+        window.r2pQueue = [];
+      }}
+
+      // Remove stale refreshes. (Avoid queueing a huge unnecessary work task)
+      const staleKeys = {stale_keys_js};
+      window.r2pQueue = window.r2pQueue.filter(([k2, f]) => !staleKeys.includes(k2));
+      window.r2pQueue.push([{queue_key}, {fn}]);
+  }}
+"""
+
+
+def _in_kernel():
+    """
+    Whether this is running in an IPython kernel, which supports comms.
+    """
+    try:
+        from IPython import get_ipython
+    except ImportError:
+        return False
+    return getattr(get_ipython(), "kernel", None) is not None
+
+
+def _open_comm(target_name):
+    """
+    Opens a comm to the frontend, or returns None when not running in a
+    kernel that supports comms.
+    """
+    if not _in_kernel():
+        return None
+
+    try:
+        from comm import create_comm
+    except ImportError:
+        # ipykernel < 6.22
+        from ipykernel.comm import Comm as create_comm
+    return create_comm(target_name=target_name)
 
 
 class NotebookUpdater:
-    def __init__(self, container_element_id, get_setdata_js):
+    """
+    Pushes data to a container created by display_dynamic.
+
+    If a comm is given, updates are sent over it as raw column buffers, with
+    no base64, JSON-embedded data, or script re-evaluation, once the
+    frontend's comm target says it is ready. Until then, without a comm, or
+    once the frontend closes the comm, each update is displayed as a
+    <script>.
+
+    With max_fps, updates are coalesced: set_data only records the latest
+    DataFrame, and a background thread encodes and sends at most max_fps
+    frames per second, so intermediate frames are dropped before they are
+    encoded. Call close() (or use the updater as a context manager) to
+    flush the final frame. If the background thread fails to send a frame,
+    it keeps going, and the next set_data, append_rows or close raises the
+    error. frames_submitted, frames_encoded and frames_dropped count what
+    happened to each update.
+    """
+    def __init__(self, container_element_id, get_setdata_js,
+                 get_appenddata_js=None, comm=None, index_columns=(),
+                 max_fps=None, encoder=DEFAULT_ENCODER, columns=None):
         self.container_element_id = container_element_id
         self.notebook_display_id = str(uuid.uuid1())
         self.get_setdata_js = get_setdata_js
-        self.is_set = False
+        self.get_appenddata_js = get_appenddata_js
+        self.index_columns = index_columns
+        self.encoder = encoder
+        self.columns = columns
+        # Frontends without the comm's target (JupyterLab, VS Code) close
+        # the comm, but the kernel only handles that once the running cell
+        # finishes, often after a whole training loop. So comm holds the
+        # comm only once the target has said it is ready, and until then
+        # updates are displayed as <script>s.
+        self.comm = None
+        self._comm = comm
+        # The last refresh sent over the comm and the tails appended since,
+        # to display again if the comm closes.
+        self._sent_df = None
+        self._sent_tails = []
 
-    def set_data(self, df):
-        dsp = (ipd.update_display if self.is_set else ipd.display)
-        dsp(ipd.HTML(f"""
+        self.max_fps = max_fps
+        self.frames_submitted = 0
+        self.frames_encoded = 0
+        self.frames_dropped = 0
+        self._pending_df = None
+        self._pending_tails = []
+        # _lock guards the pending frames and counters. _send_lock keeps
+        # flushes from the background thread and close() in order.
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        self._thread = None
+        # The error of the background thread's last failed flush, raised
+        # on the caller's thread.
+        self._error = None
+        if comm is not None:
+            comm.on_msg(self._on_comm_msg)
+            comm.on_close(self._on_comm_close)
+
+        # Output displayed from another thread goes to whichever cell is
+        # running at the time, so the output that updates replace is
+        # created here, on the caller's thread, and the background thread
+        # only ever updates it.
+        import IPython.display as ipd
+        ipd.display(ipd.HTML(""), display_id=self.notebook_display_id)
+
+    def _on_comm_msg(self, msg):
+        if msg["content"]["data"].get("method") == "ready":
+            with self._send_lock:
+                self.comm = self._comm
+
+    def _on_comm_close(self, msg):
+        # e.g. the frontend has no handler for the comm's target, or the
+        # page was closed. Updates sent over the comm may not have arrived,
+        # so the latest data is displayed again.
+        with self._send_lock:
+            was_open = self.comm is not None
+            self.comm = self._comm = None
+            frames = ([] if self._sent_df is None else [self._sent_df]
+                      ) + self._sent_tails
+            self._sent_df, self._sent_tails = None, []
+            if was_open and frames:
+                df = frames[0] if len(frames) == 1 else concat_frames(frames)
+                key = f"{self.container_element_id} update"
+                self._display(self.get_setdata_js(df, self.columns), key,
+                              [key, f"{self.container_element_id} append"])
+
+    def _send(self, method, df, index_columns=(), stats=None):
+        if method == "refresh":
+            self._sent_df, self._sent_tails = df, []
+        else:
+            self._sent_tails.append(df)
+        columns, buffers = self.encoder.to_message(df, index_columns,
+                                                   self.columns)
+        if stats is not None:
+            # Everything sent over a comm is column data.
+            stats.payload_bytes = (len(json.dumps(columns))
+                                   + sum(b.nbytes for b in buffers))
+            stats.finish(stats.payload_bytes)
+        self.comm.send({"method": method, "columns": columns},
+                       buffers=buffers)
+
+    def _display(self, js, queue_key, stale_keys, stats=None):
+        import IPython.display as ipd
+        html = f"""
 <script>
 (function() {{
   function update() {{
-    let render = {self.get_setdata_js(df)};
+    let render = {js};
     render(document.getElementById("{self.container_element_id}"));
   }}
+{_when_loaded_js("update", json.dumps(queue_key), json.dumps(stale_keys))}
+}})();
+</script>
+"""
+        if stats is not None:
+            stats.finish(len(html))
+        ipd.update_display(ipd.HTML(html),
+                           display_id=self.notebook_display_id)
 
-  if (window.r2p) {{
-    update();
-  }} else {{
-      if (!window.r2pQueue) {{
-        window.r2pQueue = [];
-      }}
+    def _set_data_now(self, df):
+        with self._lock:
+            self.frames_encoded += 1
 
-      // Remove stale refreshes. (Avoid queueing a huge unnecessary work task)
-      const k = "{self.container_element_id} update";
-      window.r2pQueue = window.r2pQueue.filter(([k2, f]) => k2 != k);
-      window.r2pQueue.push([k, update]);
+        with instrument.block("set_data", row_count(df)) as stats:
+            if self.comm is not None:
+                self._send("refresh", df, self.index_columns, stats)
+                return
+
+            update_key = f"{self.container_element_id} update"
+            append_key = f"{self.container_element_id} append"
+            # A refresh replaces everything queued before it, including
+            # appends.
+            self._display(self.get_setdata_js(df, self.columns), update_key,
+                          [update_key, append_key], stats)
+
+    def _append_rows_now(self, df_tail, n_frames=1):
+        with self._lock:
+            self.frames_encoded += n_frames
+
+        with instrument.block("append_rows", row_count(df_tail)) as stats:
+            if self.comm is not None:
+                self._send("append", df_tail, stats=stats)
+                return
+
+            self._display(self.get_appenddata_js(df_tail, self.columns),
+                          f"{self.container_element_id} append", [], stats)
+
+    def _submit(self, df=None, df_tail=None):
+        with self._lock:
+            if self._closed:
+                raise ValueError("NotebookUpdater is closed")
+            self._raise_error()
+            self.frames_submitted += 1
+            if df is not None:
+                # A refresh supersedes everything still pending.
+                self.frames_dropped += ((self._pending_df is not None)
+                                        + len(self._pending_tails))
+                self._pending_df = df
+                self._pending_tails = []
+            else:
+                self._pending_tails.append(df_tail)
+
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run,
+                                                daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def _run(self):
+        try:
+            while not self._closed:
+                self._wake.wait()
+                self._wake.clear()
+                try:
+                    self.flush()
+                except Exception as e:
+                    with self._lock:
+                        self._error = e
+                time.sleep(1 / self.max_fps)
+        finally:
+            with self._lock:
+                self._thread = None
+
+    def _raise_error(self):
+        # Called with _lock held.
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def flush(self):
+        """
+        Encodes and sends any pending frames now.
+        """
+        with self._send_lock:
+            with self._lock:
+                df, tails = self._pending_df, self._pending_tails
+                self._pending_df, self._pending_tails = None, []
+
+            if df is not None:
+                self._set_data_now(df)
+            if len(tails) == 1:
+                self._append_rows_now(tails[0])
+            elif tails:
+                self._append_rows_now(concat_frames(tails),
+                                      n_frames=len(tails))
+
+    def close(self):
+        """
+        Stops the background thread, if any, and sends the final frame.
+        """
+        with self._lock:
+            self._closed = True
+            thread = self._thread
+        self._wake.set()
+        if thread is not None:
+            thread.join()
+        self.flush()
+        with self._lock:
+            self._raise_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def set_data(self, df):
+        rows2prose.web.warn_missing_columns(df, self.columns)
+        if self.max_fps is None:
+            with self._lock:
+                self.frames_submitted += 1
+            self._set_data_now(df)
+        else:
+            self._submit(df=df)
+
+    __call__ = set_data
+
+    def append_rows(self, df_tail):
+        """
+        Appends df_tail's rows to the displayed table, sending only the new
+        rows. Queued appends are never dropped, since each one carries
+        different rows; with max_fps, pending tails are sent as one.
+        """
+        if not self.encoder.appendable:
+            raise ValueError("Rows can't be appended to binned data, "
+                             "use set_data instead")
+        rows2prose.web.warn_missing_columns(df_tail, self.columns)
+        if self.max_fps is None:
+            with self._lock:
+                self.frames_submitted += 1
+            self._append_rows_now(df_tail)
+        else:
+            self._submit(df_tail=df_tail)
+
+
+def _comm_target_js(element_id, target_name):
+    """
+    JS that registers a comm target whose messages call the container's
+    _r2pState.refresh / append with the message's binary buffers, and tells
+    the kernel it is ready for them. Comm targets can only be registered
+    from output in the classic notebook, so elsewhere this does nothing and
+    the kernel's comm gets closed.
+    """
+    update_key = json.dumps(f"{element_id} update")
+    append_key = json.dumps(f"{element_id} append")
+    return f"""
+(function() {{
+  const kernel = window.Jupyter && Jupyter.notebook && Jupyter.notebook.kernel;
+  if (!kernel) {{
+    return;
   }}
+
+  kernel.comm_manager.register_target("{target_name}", comm => {{
+    comm.on_msg(msg => {{
+      const {{method, columns}} = msg.content.data,
+            buffers = msg.buffers;
+      function update() {{
+        document.getElementById("{element_id}")._r2pState[method](
+          columns, buffers);
+      }}
+{_when_loaded_js("update",
+                 f'(method == "refresh" ? {update_key} : {append_key})',
+                 f'(method == "refresh" ? [{update_key}, {append_key}] : [])')}
+    }});
+    // Until this arrives, the kernel displays updates as <script>s.
+    comm.send({{method: "ready"}});
+  }});
 }})();
-</script>
-"""), display_id=self.notebook_display_id)
-        self.is_set = True
+"""
 
 
-def display_dynamic(html, script):
+def display_dynamic(html, script, comm=False, max_fps=None):
+    """
+    Displays html and returns a NotebookUpdater for pushing data into it.
+    With comm=True, updates are sent as binary comm messages when the
+    frontend supports it, falling back to <script> outputs otherwise. With
+    max_fps, updates are coalesced to at most that many frames per second.
+    """
+    import IPython.display as ipd
     element_id = str(uuid.uuid1())
+    target_name = f"rows2prose-{element_id}"
     ipd.display(ipd.HTML(f"""
 <div id="{element_id}">{html}</div>
 <script>
@@ -99,6 +478,147 @@ if (window.r2p) {{
 
     window.r2pQueue.push(["", initialize]);
 }}
+{_comm_target_js(element_id, target_name) if comm else ""}
 </script>
 """))
-    return NotebookUpdater(element_id, script.dynamic_set_data_js).set_data
+    return NotebookUpdater(element_id, script.dynamic_set_data_js,
+                           script.dynamic_append_data_js,
+                           comm=_open_comm(target_name) if comm else None,
+                           index_columns=script.index_columns,
+                           max_fps=max_fps,
+                           encoder=script.encoder,
+                           columns=script.referenced_columns(html))
+
+
+class NotebookTimesteps:
+    """
+    Serves the timesteps of a timeline displayed by display_on_demand,
+    sending each one over the comm when the frontend asks for it.
+    steps_sent counts the timesteps sent so far.
+    """
+    def __init__(self, slicer, comm, fallback=None):
+        self.slicer = slicer
+        self.comm = comm
+        self.fallback = fallback
+        self.steps_sent = 0
+        comm.on_msg(self._on_msg)
+        comm.on_close(self._on_comm_close)
+
+    def _on_msg(self, msg):
+        data = msg["content"]["data"]
+        if data.get("method") != "fetch":
+            return
+        for timestep in data["timesteps"]:
+            try:
+                columns, buffers = self.slicer.to_message(timestep)
+            except KeyError:
+                continue
+            self.comm.send({"method": "step", "timestep": timestep,
+                            "columns": columns},
+                           buffers=buffers)
+            self.steps_sent += 1
+
+    def _on_comm_close(self, msg):
+        # e.g. the frontend has no handler for the comm's target, so it
+        # can't ask for timesteps; display every timestep instead.
+        self.comm = None
+        if self.fallback is not None:
+            self.fallback()
+
+    def close(self):
+        if self.comm is not None:
+            self.fallback = None
+            self.comm.close()
+            self.comm = None
+
+
+def _timestep_target_js(element_id, target_name):
+    """
+    JS that registers a comm target which hands the comm to the container,
+    for requesting timesteps, and passes each timestep it receives to the
+    container's _r2pState.step. Timesteps requested before the comm opened,
+    or over a comm that has since closed, are requested again through
+    _r2pState.connected. As with _comm_target_js, this only works in the
+    classic notebook.
+    """
+    return f"""
+(function() {{
+  const kernel = window.Jupyter && Jupyter.notebook && Jupyter.notebook.kernel;
+  if (!kernel) {{
+    return;
+  }}
+
+  kernel.comm_manager.register_target("{target_name}", comm => {{
+    const container = document.getElementById("{element_id}");
+    container._r2pComm = comm;
+    comm.on_msg(msg => {{
+      const {{timestep, columns}} = msg.content.data;
+      container._r2pState.step(timestep, columns, msg.buffers);
+    }});
+    comm.on_close(() => {{
+      if (container._r2pComm === comm) {{
+        container._r2pComm = null;
+      }}
+    }});
+    // Before r2p loads there is no state yet, and it requests its
+    // timesteps once it initializes.
+    if (container._r2pState) {{
+      container._r2pState.connected();
+    }}
+  }});
+}})();
+"""
+
+
+def display_on_demand(df, html, script, cache_size=64, prefetch=8):
+    """
+    Displays a Timeline or DistributionTimeline whose rows stay in the
+    kernel. Only the sorted unique timesteps and the last timestep's rows
+    are sent up front; the time control requests other timesteps over a
+    comm as it reaches them, keeping the cache_size most recently shown ones
+    and prefetching the prefetch timesteps after the current one. The
+    kernel must be idle to answer, so this suits exploring finished traces
+    rather than ones still being written.
+
+    Returns a NotebookTimesteps, which must stay alive for as long as the
+    output is explored. Without a frontend that supports comms, every
+    timestep is displayed up front, as with display.
+    """
+    import IPython.display as ipd
+    if not hasattr(script, "on_demand_js"):
+        raise TypeError("display_on_demand requires a Timeline or a "
+                        f"DistributionTimeline, got {type(script).__name__}")
+    columns = script.referenced_columns(html)
+    rows2prose.web.warn_missing_columns(df, columns)
+    slicer = TimestepSlicer(df, script.i_timestep_column, script.encoder,
+                            columns)
+    if not len(slicer.timesteps):
+        raise ValueError("display_on_demand requires at least one timestep")
+
+    if not _in_kernel():
+        display(df, html, script)
+        return None
+
+    element_id = str(uuid.uuid1())
+
+    def fallback():
+        ipd.update_display(ipd.HTML(_static_output(df, html, script,
+                                                   columns)),
+                           display_id=element_id)
+
+    target_name = f"rows2prose-{element_id}"
+    render_js = script.on_demand_js(slicer.timesteps_json(),
+                                    slicer.to_json(slicer.timesteps[-1]),
+                                    cache_size, prefetch)
+    ipd.display(ipd.HTML(f"""
+<div id="{element_id}">{html}</div>
+<script>
+function initialize() {{
+  let render = {render_js};
+  render(document.getElementById("{element_id}"));
+}}
+{_when_loaded_js("initialize", '""', "[]")}
+{_timestep_target_js(element_id, target_name)}
+</script>
+"""), display_id=element_id)
+    return NotebookTimesteps(slicer, _open_comm(target_name), fallback)
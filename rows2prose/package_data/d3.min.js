@@ -0,0 +1 @@
+!function(){window.d3={}}();
@@ -0,0 +1 @@
+var r2p = (function(){return {};})();
@@ -0,0 +1,368 @@
+"""
+A live view server for watching long-running processes, such as training
+jobs, from a browser without Jupyter:
+
+    server = LiveServer(html, Timeline(...)).start()
+    print(server.url)
+    for step in range(n_steps):
+        ...
+        server.set_data(df)
+
+The server serves the page once over HTTP, then pushes each frame to every
+connected browser over a WebSocket as binary column buffers, which
+r2p.liveConnection passes to the view's _r2pState.refresh. Each client only
+ever has one frame waiting: a client that can't keep up skips to the newest
+frame rather than falling further behind. Only the standard library is
+used.
+"""
+import asyncio
+import base64
+import hashlib
+import json
+import struct
+import threading
+import uuid
+
+import rows2prose.web
+
+
+WEBSOCKET_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC11B85"
+
+
+def encode_frame(method, columns, buffers):
+    """
+    Packs the output of ColumnEncoder.to_message into one binary message,
+    laid out as described in r2p.liveConnection. Buffers are 8-byte aligned
+    so the browser can view them as typed arrays without copying.
+    """
+    def align(n):
+        return (n + 7) & ~7
+
+    # The header's length depends on the offsets, which depend on the
+    # header's length, so lay out the buffers until they stop moving.
+    start = 0
+    while True:
+        offset, placed = start, []
+        for b in buffers:
+            placed.append([offset, b.nbytes])
+            offset = align(offset + b.nbytes)
+        header = json.dumps({"method": method, "columns": columns,
+                             "buffers": placed}).encode()
+        if align(4 + len(header)) == start:
+            break
+        start = align(4 + len(header))
+
+    message = bytearray(offset)
+    message[:4] = struct.pack("<I", len(header))
+    message[4:4 + len(header)] = header
+    for (offset, length), b in zip(placed, buffers):
+        message[offset:offset + length] = b
+    return bytes(message)
+
+
+def websocket_header(opcode, length):
+    """
+    The header of an unmasked, unfragmented server-to-client frame.
+    """
+    if length < 126:
+        return struct.pack("!BB", 0x80 | opcode, length)
+    if length < 1 << 16:
+        return struct.pack("!BBH", 0x80 | opcode, 126, length)
+    return struct.pack("!BBQ", 0x80 | opcode, 127, length)
+
+
+class _Client:
+    """
+    One browser's WebSocket. frame holds the newest frame it hasn't been
+    sent yet, so a new frame replaces one still waiting.
+    """
+    def __init__(self, writer):
+        self.writer = writer
+        self.frame = None
+        self.ready = asyncio.Event()
+        self.frames_dropped = 0
+        # The task serving this client's connection.
+        self.handler = asyncio.current_task()
+
+    def offer(self, frame):
+        if self.frame is not None:
+            self.frames_dropped += 1
+        self.frame = frame
+        self.ready.set()
+
+    async def send_frames(self):
+        while True:
+            await self.ready.wait()
+            self.ready.clear()
+            frame, self.frame = self.frame, None
+            self.writer.write(websocket_header(0x2, len(frame)))
+            self.writer.write(frame)
+            try:
+                # Waits while this client's socket is backed up, without
+                # holding up other clients.
+                await self.writer.drain()
+            except ConnectionError:
+                return
+
+    def close(self, code=1000):
+        """
+        Sends a close frame with status code, e.g. 1001 when the server is
+        going away, and closes the connection, which ends the handler's
+        read loop.
+        """
+        if not self.writer.is_closing():
+            self.writer.write(websocket_header(0x8, 2)
+                              + struct.pack("!H", code))
+            self.writer.close()
+
+
+class LiveServer:
+    """
+    Serves html rendered with script's dynamic view at http://host:port/
+    and pushes the frames given to set_data to every connected browser.
+
+    Run it on a background thread with start() and stop it with close() (or
+    use it as a context manager), or await serve() on an existing event
+    loop. set_data may be called from any thread; frames are encoded on a
+    worker thread of the server's loop, and a frame submitted while the
+    previous one is still being encoded replaces it. frames_submitted,
+    frames_encoded and frames_dropped count what happened to each frame.
+    """
+    def __init__(self, html, script, host="127.0.0.1", port=8000,
+                 bundle_src=None, title="rows2prose"):
+        self.script = script
+        self.host = host
+        self.port = port
+        self.columns = script.referenced_columns(html)
+        element_id = str(uuid.uuid1())
+        self.page = rows2prose.web.full_html(f"""
+<title>{title}</title>
+<div id="{element_id}">{html}</div>
+<script>
+(function() {{
+  const container = document.getElementById("{element_id}");
+  let render = {script.dynamic_initialize_js()};
+  render(container);
+  r2p.liveConnection(container);
+}})();
+</script>
+""", bundle_src).encode()
+
+        self.frames_submitted = 0
+        self.frames_encoded = 0
+        self._frames_dropped = 0
+        self._lock = threading.Lock()
+        self._pending_df = None
+        self._frame = None
+        self._clients = set()
+        self._loop = None
+        self._wake = None
+        self._stop = None
+        self._ready = threading.Event()
+        self._thread = None
+        self._error = None
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}/"
+
+    @property
+    def frames_dropped(self):
+        """
+        Frames replaced before they were encoded, plus, summed over
+        clients, frames replaced before they were sent.
+        """
+        return (self._frames_dropped
+                + sum(c.frames_dropped for c in list(self._clients)))
+
+    def set_data(self, df):
+        """
+        Pushes df's columns to every connected browser, and to browsers
+        that connect later. Thread-safe.
+        """
+        rows2prose.web.warn_missing_columns(df, self.columns)
+        with self._lock:
+            self.frames_submitted += 1
+            if self._pending_df is not None:
+                self._frames_dropped += 1
+            self._pending_df = df
+            loop = self._loop
+        if loop is not None:
+            loop.call_soon_threadsafe(self._wake.set)
+
+    __call__ = set_data
+
+    def _encode(self, df):
+        columns, buffers = self.script.encoder.to_message(
+            df, self.script.index_columns, self.columns)
+        return encode_frame("refresh", columns, buffers)
+
+    async def _encode_frames(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+            with self._lock:
+                df, self._pending_df = self._pending_df, None
+            if df is None:
+                continue
+            self._frame = await loop.run_in_executor(None, self._encode, df)
+            with self._lock:
+                self.frames_encoded += 1
+            for client in self._clients:
+                client.offer(self._frame)
+
+    async def _handle(self, reader, writer):
+        try:
+            request = await reader.readuntil(b"\r\n\r\n")
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            writer.close()
+            return
+        lines = request.decode("latin-1").split("\r\n")
+        method, path, _ = (lines[0].split(" ") + ["", ""])[:3]
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        if method != "GET":
+            await self._respond(writer, "405 Method Not Allowed", b"")
+        elif path == "/ws" and "sec-websocket-key" in headers:
+            await self._websocket(reader, writer,
+                                  headers["sec-websocket-key"])
+        elif path == "/":
+            await self._respond(writer, "200 OK", self.page,
+                                "text/html; charset=utf-8")
+        else:
+            await self._respond(writer, "404 Not Found", b"")
+
+    async def _respond(self, writer, status, body,
+                       content_type="text/plain"):
+        writer.write(f"HTTP/1.1 {status}\r\n"
+                     f"Content-Type: {content_type}\r\n"
+                     f"Content-Length: {len(body)}\r\n"
+                     "Connection: close\r\n\r\n".encode() + body)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def _websocket(self, reader, writer, key):
+        accept = base64.b64encode(
+            hashlib.sha1(key.encode() + WEBSOCKET_GUID).digest()).decode()
+        writer.write("HTTP/1.1 101 Switching Protocols\r\n"
+                     "Upgrade: websocket\r\n"
+                     "Connection: Upgrade\r\n"
+                     f"Sec-WebSocket-Accept: {accept}\r\n\r\n".encode())
+        client = _Client(writer)
+        if self._frame is not None:
+            client.offer(self._frame)
+        self._clients.add(client)
+        sender = asyncio.ensure_future(client.send_frames())
+        try:
+            await self._read_until_closed(reader, client)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except asyncio.CancelledError:
+            # Cancelled by _close_clients; the connection is closed below.
+            pass
+        finally:
+            self._clients.discard(client)
+            with self._lock:
+                self._frames_dropped += client.frames_dropped
+            sender.cancel()
+            writer.close()
+
+    async def _read_until_closed(self, reader, client):
+        """
+        Reads and discards the browser's frames until it closes the
+        connection, answering its close frame with one of our own.
+        Browsers only send control frames here.
+        """
+        while True:
+            b0, b1 = await reader.readexactly(2)
+            length = b1 & 0x7F
+            if length == 126:
+                length, = struct.unpack("!H", await reader.readexactly(2))
+            elif length == 127:
+                length, = struct.unpack("!Q", await reader.readexactly(8))
+            await reader.readexactly(length + (4 if b1 & 0x80 else 0))
+            if b0 & 0x0F == 0x8:
+                client.close()
+                return
+
+    async def _close_clients(self, timeout=1.0):
+        """
+        Closes every browser's connection and waits for its handler to
+        finish, cancelling handlers that outlast timeout. Server.wait_closed,
+        called when serve leaves the server's context, waits for them.
+        """
+        clients = list(self._clients)
+        for client in clients:
+            client.close(1001)
+        handlers = [c.handler for c in clients if c.handler is not None]
+        if handlers:
+            _, pending = await asyncio.wait(handlers, timeout=timeout)
+            for handler in pending:
+                handler.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    async def serve(self):
+        """
+        Serves until close() is called.
+        """
+        self._wake = asyncio.Event()
+        self._stop = asyncio.Event()
+        self._loop = asyncio.get_running_loop()
+        server = await asyncio.start_server(self._handle, self.host,
+                                            self.port)
+        if not self.port:
+            self.port = server.sockets[0].getsockname()[1]
+        encoder = asyncio.ensure_future(self._encode_frames())
+        if self._pending_df is not None:
+            self._wake.set()
+        self._ready.set()
+        try:
+            async with server:
+                try:
+                    await self._stop.wait()
+                finally:
+                    await self._close_clients()
+        finally:
+            encoder.cancel()
+            self._loop = None
+
+    def start(self):
+        """
+        Starts serving on a daemon thread and returns self once the server
+        is listening.
+        """
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        if self._error is not None:
+            self._thread = None
+            raise self._error
+        return self
+
+    def _run(self):
+        try:
+            asyncio.run(self.serve())
+        except Exception as e:
+            # e.g. the port is taken.
+            self._error = e
+            self._ready.set()
+
+    def close(self):
+        loop = self._loop
+        if loop is not None:
+            loop.call_soon_threadsafe(self._stop.set)
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.close()
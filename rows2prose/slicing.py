@@ -0,0 +1,99 @@
+"""
+On-demand timestep slicing for long timelines.
+
+Rather than shipping every row of every timestep up front, a TimestepSlicer
+keeps a frame's columns on the Python side, grouped by timestep, and
+encodes one timestep's rows at a time as the browser asks for them. Every
+slice carries its columns' min and max over the whole frame, so scales that
+controls compute from any one slice match the ones they would compute from
+the full table.
+"""
+import json
+
+import numpy as np
+
+from rows2prose.encoding import (DEFAULT_ENCODER, iter_columns, row_index,
+                                 value_range)
+
+
+class TimestepSlicer:
+    """
+    Holds df's columns (only those in columns, if given) without copying
+    them, indexed by i_timestep_column, and encodes single timesteps with
+    encoder. Binned encoders aren't supported: their histograms are already
+    small, and each slice would get its own bin edges.
+    """
+    def __init__(self, df, i_timestep_column="i_timestep",
+                 encoder=DEFAULT_ENCODER, columns=None):
+        if not encoder.appendable:
+            raise ValueError("Binned timelines can't be sliced, display "
+                             "them in full instead")
+        self.i_timestep_column = i_timestep_column
+        self.encoder = encoder
+        if columns is not None:
+            columns = set(columns) | {i_timestep_column}
+        self.table = dict(iter_columns(df, columns))
+        if i_timestep_column not in self.table:
+            raise KeyError(i_timestep_column)
+
+        values = self.table[i_timestep_column]
+        self.order, self.offsets = row_index(values)
+        starts = self.offsets[:-1]
+        self.timesteps = values[starts if self.order is None
+                                else self.order[starts]]
+        self.extents = {str(name): value_range(values)
+                        for name, values in self.table.items()}
+
+    def rows(self, timestep):
+        """
+        The rows holding timestep, as a slice when df is sorted by it.
+        Raises KeyError for a timestep df doesn't have.
+        """
+        j = np.searchsorted(self.timesteps, timestep)
+        if j == len(self.timesteps) or self.timesteps[j] != timestep:
+            raise KeyError(timestep)
+        start, stop = self.offsets[j], self.offsets[j + 1]
+        if self.order is None:
+            return slice(start, stop)
+        return self.order[start:stop]
+
+    def step(self, timestep):
+        """
+        Returns the rows of timestep as a dict of arrays.
+        """
+        rows = self.rows(timestep)
+        return {name: values[rows] for name, values in self.table.items()}
+
+    def with_extents(self, encoded):
+        for name, entry in encoded.items():
+            entry.pop("min", None)
+            entry.pop("max", None)
+            extent = self.extents.get(name)
+            if extent is not None:
+                entry["min"], entry["max"] = extent
+        return encoded
+
+    def to_message(self, timestep):
+        """
+        Returns (columns, buffers) for timestep, see
+        ColumnEncoder.to_message.
+        """
+        encoded, buffers = self.encoder.to_message(
+            self.step(timestep), (self.i_timestep_column,))
+        return self.with_extents(encoded), buffers
+
+    def to_json(self, timestep):
+        """
+        JS for timestep's encoded columns, as passed to r2p.loadColumns.
+        """
+        return json.dumps(self.with_extents(self.encoder.to_dict(
+            self.step(timestep), (self.i_timestep_column,))))
+
+    def timesteps_json(self):
+        """
+        JS for the sorted unique timesteps, encoded as a table whose only
+        column is i_timestep_column. As an index column, it is encoded
+        exactly, so that the browser requests timesteps the slicer has.
+        """
+        return self.encoder.to_json({self.i_timestep_column: self.timesteps},
+                                    (self.i_timestep_column,))
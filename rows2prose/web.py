@@ -1,66 +1,59 @@
 import abc
-import base64
+import functools
+import hashlib
+import io
 import json
 import os
 import uuid
-from pkg_resources import resource_string
+import warnings
+from html.parser import HTMLParser
+from importlib import resources
 
-import numpy as np
+from rows2prose import instrument
+from rows2prose.binning import HistogramEncoder
+from rows2prose.encoding import (DEFAULT_ENCODER, column_names, entry_digest,
+                                 row_count)
+from rows2prose.instrument import collect_stats
 
 
-def df_to_dict(df):
+def df_to_dict(df, index_columns=()):
     """
-    Returns {"columnName1": {"type": "float32", "data": "BASE64ENCODED_DATA1"},
-             "columnName2": {"type": "float32", "data": "BASE64ENCODED_DATA2"},
+    Returns {"columnName1": {"type": "float32", "data": "BASE64ENCODED_DATA1",
+                             "min": 0.0, "max": 1.0},
+             "columnName2": {"type": "float32", "data": "BASE64ENCODED_DATA2",
+                             "min": 0.0, "max": 1.0},
              ...}
-    using the column's type to determine "type".
+    using the column's type to determine "type". "min" and "max" are the
+    column's extent, ignoring NaNs, and are left out when it has no finite
+    values. Columns in index_columns also carry an "index" entry grouping
+    their rows by value: {"offsets": {"type", "data"}, "order": {"type",
+    "data"}}, where the rows of the i-th smallest value are
+    order[offsets[i]:offsets[i + 1]]. When the column is already sorted,
+    "order" is left out and those rows are offsets[i]:offsets[i + 1].
     """
-    df2 = df.copy()
-    # convert any int64 to int32, since javascript BigInts cause problems in
-    # code that expects javascript Numbers
-    for col in df2.columns:
-        if df2[col].dtype == np.int64:
-            df2[col] = df2[col].astype(np.int32)
-        elif df2[col].dtype == np.uint64:
-            df2[col] = df2[col].astype(np.uint32)
+    return DEFAULT_ENCODER.to_dict(df, index_columns)
 
-    return {
-        col: {
-            "type": str(df2[col].dtype),
-            "data": base64.b64encode(
-                np.ascontiguousarray(df2[col].values)).decode("utf-8")
-        }
-        for col in df2.columns
-    }
 
 
-
-def df_to_custom_json(df):
+def df_to_custom_json(df, index_columns=()):
     """
-    Returns {"columnName1": {"type": "float32", "data": "BASE64ENCODED_DATA1"},
-             "columnName2": {"type": "float32", "data": "BASE64ENCODED_DATA2"},
-             ...}
-    using the column's type to determine "type".
+    Returns df_to_dict(df, index_columns) as JSON text, with the same
+    "type", "data", "min", "max" and "index" keys.
     """
-    return json.dumps(df_to_dict(df))
+    return DEFAULT_ENCODER.to_json(df, index_columns)
 
 
 
-def header_content():
-    r2p_js = resource_string(
-        'rows2prose', os.path.join('package_data', 'rows2prose.browser.js')
-    ).decode('utf-8')
-    d3_js = resource_string(
-        'rows2prose', os.path.join('package_data', 'd3.min.js')
-    ).decode('utf-8')
+@functools.lru_cache(maxsize=None)
+def _bundle():
+    """
+    Reads the d3 + rows2prose bundle once per process. Returns (js, hash).
+    """
+    package_data = resources.files('rows2prose').joinpath('package_data')
+    r2p_js = package_data.joinpath('rows2prose.browser.js').read_text('utf-8')
+    d3_js = package_data.joinpath('d3.min.js').read_text('utf-8')
 
-    return f"""
-<style>
-div.r2p-output svg {{
-  max-width: initial;
-}}
-</style>
-<script>
+    js = f"""
   var r2p_undef_define = ("function"==typeof define),
       r2p_prev_define = undefined;
   if (r2p_undef_define) {{
@@ -72,12 +65,95 @@ div.r2p-output svg {{
   if (r2p_undef_define) {{
     define = r2p_prev_define;
   }}
-</script>"""
+"""
+    return js, hashlib.sha256(js.encode('utf-8')).hexdigest()[:16]
+
+
+def bundle_hash():
+    return _bundle()[1]
+
+
+def write_bundle(directory):
+    """
+    Writes the JS bundle to directory as rows2prose-<hash>.js, unless it is
+    already there, and returns the file name. Pass it (or a URL to it) as
+    header_content's bundle_src to reference it rather than inline it.
+    """
+    js, digest = _bundle()
+    filename = f"rows2prose-{digest}.js"
+    path = os.path.join(directory, filename)
+    if not os.path.exists(path):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(js)
+    return filename
+
+
+def header_content(guard=False, bundle_src=None):
+    """
+    Returns the <style> and <script> tags that load rows2prose.
+
+    With guard=True, the bundle is only evaluated if the page hasn't already
+    evaluated a bundle with the same hash, e.g. when a notebook initializes
+    rows2prose more than once. With bundle_src, the bundle is loaded from
+    that URL (see write_bundle) rather than inlined.
+    """
+    style = """
+<style>
+div.r2p-output svg {
+  max-width: initial;
+}
+</style>"""
+
+    if bundle_src is not None:
+        return style + f"""
+<script src="{bundle_src}"></script>"""
+
+    js, digest = _bundle()
+    if guard:
+        js = f"""
+if (window.r2pBundleHash !== "{digest}") {{
+{js}
+  window.r2pBundleHash = "{digest}";
+}}
+"""
+    return style + f"""
+<script>{js}</script>"""
+
+
 
+class Control(str):
+    """
+    The JS for one control, as passed to a ScriptBuilder. columns lists the
+    DataFrame columns it reads other than those named by the data-key
+    attributes of its elements.
+    """
+    def __new__(cls, js, columns=()):
+        control = super().__new__(cls, js)
+        control.columns = tuple(columns)
+        return control
+
+
+class _DataKeyParser(HTMLParser):
+    def __init__(self):
+        super().__init__()
+        self.keys = []
+
+    def handle_starttag(self, tag, attrs):
+        self.keys += [v for k, v in attrs if k == "data-key"]
+
+
+def data_keys(html_text):
+    """
+    Returns the values of every data-key attribute in html_text.
+    """
+    parser = _DataKeyParser()
+    parser.feed(html_text)
+    parser.close()
+    return parser.keys
 
 
 def _time_control(class_name, prefix="Step"):
-    return f"""
+    return Control(f"""
 (function() {{
   const element = container.querySelectorAll(".{class_name}")[0],
         component = r2p.timeControl()
@@ -92,27 +168,182 @@ def _time_control(class_name, prefix="Step"):
     d3.select(element).datum({{sortedUniqueTimesteps, index}}).call(component);
   }});
 }})();
+""")
+
+def _on_demand_js(script, timesteps_js, step_js, cache_size=64,
+                  prefetch=8):
+    """
+    JS for a timeline whose browser side holds only the sorted unique
+    timesteps and a cache of single-timestep tables, fetched from the
+    kernel as the time control reaches them. step_js is the encoded table of
+    the initially shown (last) timestep. See
+    rows2prose.notebook.display_on_demand.
+    """
+    controls_js = "\n".join(script.controls)
+    column = json.dumps(script.i_timestep_column)
+    return f"""
+function(container) {{
+  let renderRowsFunctions = [],
+      renderTimeFunctions = [],
+      onTableLoadedFunctions = [],
+      table,
+      rowIndex,
+      sortedUniqueTimesteps,
+      wantedTimestep;
+
+  // Other timesteps are requested over the comm that the kernel opens, which
+  // the page stores as container._r2pComm, calling connected() once it does.
+  const cache = r2p.timestepCache(timesteps => {{
+    if (!container._r2pComm) {{
+      return false;
+    }}
+    container._r2pComm.send({{method: "fetch", timesteps}});
+    return true;
+  }}, {{capacity: {int(cache_size)}}});
+
+  function show(t, stepTable) {{
+    table = stepTable;
+    rowIndex = r2p.rowIndex(table[{column}]);
+    const iRows = rowIndex.rows(t);
+    r2p.measured("renderRows", () => renderRowsFunctions.forEach(render => render(iRows)));
+  }}
+
+  const timeStateComponent = r2p.hiddenTimeState()
+        .renderTimestep(t => {{
+          wantedTimestep = t;
+          cache.get(t).then(stepTable => {{
+            // Skip steps that arrive after the time control has moved on.
+            if (t == wantedTimestep) {{
+              show(t, stepTable);
+            }}
+          }});
+          const i = d3.bisectLeft(sortedUniqueTimesteps, t);
+          cache.prefetch(sortedUniqueTimesteps.slice(i + 1, i + 1 + {int(prefetch)}));
+        }})
+        .renderTime((sortedUniqueTimesteps, index) => {{
+          renderTimeFunctions.forEach(render => render(sortedUniqueTimesteps, index));
+        }});
+
+  container._r2pState = {{
+    step: function(t, encodedData, buffers) {{
+      r2p.loadColumns(encodedData, buffers, {script.load_options_js()}).then(
+        stepTable => cache.receive(t, stepTable));
+    }},
+    connected: function() {{
+      cache.retry();
+    }}
+  }};
+
+  {controls_js}
+
+  Promise.all([
+    r2p.loadColumns({timesteps_js}, null, {script.load_options_js()}),
+    r2p.loadColumns({step_js}, null, {script.load_options_js()})
+  ]).then(([timesteps, t]) => {{
+    sortedUniqueTimesteps = Array.from(timesteps[{column}]);
+    table = t;
+    rowIndex = r2p.rowIndex(table[{column}]);
+    cache.receive(rowIndex.keys[0], table);
+    // Each step's columns carry the extents of the whole timeline.
+    r2p.measured("onTableLoaded", () => onTableLoadedFunctions.forEach(onloaded => onloaded()));
+
+    d3.select(container).datum(sortedUniqueTimesteps).call(timeStateComponent);
+  }});
+}}
 """
 
+
 class ScriptBuilder(abc.ABC):
+    # Columns whose rows the generated JS looks up by value, see
+    # rows2prose.encoding.row_index.
+    index_columns = ()
+
+    # Subclasses accept an encoder=ColumnEncoder(...) argument to choose how
+    # columns are encoded, e.g. ColumnEncoder(precision="float32"). The
+    # Distribution* builders also accept bins=N (and log_bins=True) to send
+    # histograms instead of samples, for use with their density_view.
+    encoder = DEFAULT_ENCODER
+
+    # Subclasses accept worker=True to decode columns, and build row indexes
+    # and extents, in a Web Worker rather than on the page's main thread.
+    worker = False
+
+    @property
+    def required_columns(self):
+        """
+        Columns the generated JS reads regardless of the controls.
+        """
+        return self.index_columns
+
+    def load_options_js(self):
+        """
+        The options the generated JS passes to r2p.loadColumns, from inside
+        a function of the container, which holds the table's shared columns.
+        """
+        if not self.worker:
+            return "{container}"
+        return ("{container, worker: true, indexColumns: "
+                f"{json.dumps(list(self.index_columns))}}}")
+
+    def referenced_columns(self, html):
+        """
+        Returns the set of columns that html and this script's controls
+        read, or None if some control is plain JS that doesn't declare its
+        columns (see Control), in which case every column must be sent.
+        """
+        if not all(isinstance(c, Control) for c in self.controls):
+            return None
+        columns = set(data_keys(html)) | set(self.required_columns)
+        for control in self.controls:
+            columns.update(control.columns)
+        return columns
+
+    def table_js(self, df, columns=None, data_js=None):
+        """
+        JS for df's encoded columns, as passed to r2p.loadColumns, or
+        data_js, an expression that evaluates to them, if given.
+        """
+        if data_js is not None:
+            return data_js
+        return self.encoder.to_json(df, self.index_columns, columns)
+
     @abc.abstractmethod
-    def static_js(self, df):
+    def static_js(self, df, columns=None, data_js=None):
         pass
 
+    def compile(self, html):
+        """
+        Returns a CompiledScript: this script's render function for html,
+        generated once, for blocks that share html and controls.
+        """
+        return CompiledScript(self, html)
+
     @abc.abstractmethod
-    def dynamic_initialize_js(self, df):
+    def dynamic_initialize_js(self):
         pass
 
     @abc.abstractmethod
-    def dynamic_set_data_js(self, df):
+    def dynamic_set_data_js(self, df, columns=None):
         pass
 
+    def dynamic_append_data_js(self, df, columns=None):
+        if not self.encoder.appendable:
+            raise ValueError("Rows can't be appended to binned data, "
+                             "use set_data instead")
+        return f"""
+function(container) {{
+  container._r2pState.append({self.encoder.to_json(df, columns=columns)});
+}}
+"""
+
 
 class Snapshot(ScriptBuilder):
-    def __init__(self, *controls):
+    def __init__(self, *controls, encoder=None, worker=False):
         self.controls = controls
+        self.encoder = encoder if encoder is not None else DEFAULT_ENCODER
+        self.worker = worker
 
-    def static_js(self, df):
+    def static_js(self, df, columns=None, data_js=None):
         controls_js = "\n".join(self.controls)
         return f"""
 function(container) {{
@@ -121,8 +352,10 @@ function(container) {{
 
   {controls_js}
 
-  table = r2p.parseColumns({df_to_custom_json(df)});
-  onTableLoadedFunctions.forEach(onloaded => onloaded());
+  r2p.loadColumns({self.table_js(df, columns, data_js)}, null, {self.load_options_js()}).then(t => {{
+    table = t;
+    r2p.measured("onTableLoaded", () => onTableLoadedFunctions.forEach(onloaded => onloaded()));
+  }});
 }}
 """
 
@@ -132,10 +365,19 @@ function(container) {{
 function(container) {{
   let onTableLoadedFunctions = [],
       table;
+  const enqueue = r2p.serialize();
   container._r2pState = {{
-    refresh: function(encodedData) {{
-      table = r2p.parseColumns(encodedData);
-      onTableLoadedFunctions.forEach(onloaded => onloaded(table));
+    refresh: function(encodedData, buffers) {{
+      enqueue(() => r2p.loadColumns(encodedData, buffers, {self.load_options_js()}).then(t => {{
+        table = t;
+        r2p.measured("onTableLoaded", () => onTableLoadedFunctions.forEach(onloaded => onloaded(table)));
+      }}));
+    }},
+    append: function(encodedData, buffers) {{
+      enqueue(() => r2p.loadColumns(encodedData, buffers, {self.load_options_js()}).then(tail => {{
+        table = r2p.appendColumns(table, tail);
+        r2p.measured("onTableLoaded", () => onTableLoadedFunctions.forEach(onloaded => onloaded(table)));
+      }}));
     }}
   }};
 
@@ -143,16 +385,16 @@ function(container) {{
 }}
 """
 
-    def dynamic_set_data_js(self, df):
+    def dynamic_set_data_js(self, df, columns=None):
         return f"""
 function(container) {{
-  container._r2pState.refresh({df_to_custom_json(df)});
+  container._r2pState.refresh({self.encoder.to_json(df, self.index_columns, columns)});
 }}
 """
 
     @classmethod
     def position_view(cls, class_name):
-        return f"""
+        return Control(f"""
 (function() {{
   const element = d3.select(container).selectAll(".{class_name}"),
         keys = element.nodes().map(e => e.getAttribute("data-key"));
@@ -164,17 +406,17 @@ function(container) {{
         .scale(d3.scaleLinear().domain([-1, 1]).range([0, 232])));
   }});
 }})();
-"""
+""")
 
     @classmethod
     def positive_scalar_view(cls, class_name, log_scale=False):
-        return f"""
+        return Control(f"""
 (function() {{
   const element = d3.select(container).selectAll(".{class_name}"),
         keys = element.nodes().map(e => e.getAttribute("data-key"));
   onTableLoadedFunctions.push(() => {{
-    const globalMin = d3.min(keys, k => d3.min(table[k])),
-          globalMax = d3.max(keys, k => d3.max(table[k])),
+    const globalMin = d3.min(keys, k => r2p.extent(table[k])[0]),
+          globalMax = d3.max(keys, k => r2p.extent(table[k])[1]),
           min = globalMin,
           // Need a valid scale, so these need to be different.
           max = (globalMin != globalMax)
@@ -194,15 +436,22 @@ function(container) {{
         .tfrac(2.7/3));
   }});
 }})();
-"""
+""")
 
 
 class Timeline(ScriptBuilder):
-    def __init__(self, *controls, i_timestep_column="i_timestep"):
+    def __init__(self, *controls, i_timestep_column="i_timestep",
+                 encoder=None, worker=False):
         self.controls = controls
+        self.encoder = encoder if encoder is not None else DEFAULT_ENCODER
+        self.worker = worker
         self.i_timestep_column = i_timestep_column
 
-    def static_js(self, df):
+    @property
+    def index_columns(self):
+        return (self.i_timestep_column,)
+
+    def static_js(self, df, columns=None, data_js=None):
         controls_js = "\n".join(self.controls)
         return f"""
 function(container) {{
@@ -210,20 +459,13 @@ function(container) {{
       renderTimeFunctions = [],
       onTableLoadedFunctions = [],
       table,
+      rowIndex,
       sortedUniqueTimesteps;
 
   const timeStateComponent = r2p.hiddenTimeState()
         .renderTimestep(t => {{
-          const iTimestep = table["{self.i_timestep_column}"];
-
-          let iRows = [];
-          for (let i = 0; i < iTimestep.length; i++) {{
-            if (iTimestep[i] == t) {{
-              iRows.push(i);
-            }}
-          }}
-
-          renderRowsFunctions.forEach(render => render(iRows));
+          const iRows = rowIndex.rows(t);
+          r2p.measured("renderRows", () => renderRowsFunctions.forEach(render => render(iRows)));
         }})
         .renderTime((sortedUniqueTimesteps, index) => {{
           renderTimeFunctions.forEach(render => render(sortedUniqueTimesteps, index));
@@ -231,12 +473,14 @@ function(container) {{
 
   {controls_js}
 
-  table = r2p.parseColumns({df_to_custom_json(df)});
-  sortedUniqueTimesteps = table["{self.i_timestep_column}"]
-    .sort(d3.ascending).filter((d, i, a) => !i || d != a[i - 1]);
-  onTableLoadedFunctions.forEach(onloaded => onloaded());
+  r2p.loadColumns({self.table_js(df, columns, data_js)}, null, {self.load_options_js()}).then(t => {{
+    table = t;
+    rowIndex = r2p.rowIndex(table["{self.i_timestep_column}"]);
+    sortedUniqueTimesteps = rowIndex.keys;
+    r2p.measured("onTableLoaded", () => onTableLoadedFunctions.forEach(onloaded => onloaded()));
 
-  d3.select(container).datum(sortedUniqueTimesteps).call(timeStateComponent);
+    d3.select(container).datum(sortedUniqueTimesteps).call(timeStateComponent);
+  }});
 }}
 """
 
@@ -248,33 +492,43 @@ function(container) {{
       renderTimeFunctions = [],
       onTableLoadedFunctions = [],
       table,
+      rowIndex,
       sortedUniqueTimesteps;
 
-  container._r2pState = {{
-    refresh: function(encodedData) {{
-      table = r2p.parseColumns(encodedData);
-      sortedUniqueTimesteps = table["{self.i_timestep_column}"]
-        .sort(d3.ascending).filter((d, i, a) => !i || d != a[i - 1]);
-
-      onTableLoadedFunctions.forEach(onloaded => onloaded(table));
-
-      d3.select(container).datum(sortedUniqueTimesteps).call(
-        r2p.hiddenTimeState()
+  const timeStateComponent = r2p.hiddenTimeState()
         .renderTimestep(t => {{
-          const iTimestep = table["{self.i_timestep_column}"];
-
-          let iRows = [];
-          for (let i = 0; i < iTimestep.length; i++) {{
-            if (iTimestep[i] == t) {{
-              iRows.push(i);
-            }}
-          }}
-
-          renderRowsFunctions.forEach(render => render(iRows));
+          const iRows = rowIndex.rows(t);
+          r2p.measured("renderRows", () => renderRowsFunctions.forEach(render => render(iRows)));
         }})
-       .renderTime((sortedUniqueTimesteps, index) => {{
+        .renderTime((sortedUniqueTimesteps, index) => {{
           renderTimeFunctions.forEach(render => render(sortedUniqueTimesteps, index));
-       }}));
+        }});
+
+  function onTableChanged() {{
+    r2p.measured("onTableLoaded", () => onTableLoadedFunctions.forEach(onloaded => onloaded(table)));
+    d3.select(container).datum(sortedUniqueTimesteps).call(timeStateComponent);
+  }}
+
+  const enqueue = r2p.serialize();
+  container._r2pState = {{
+    refresh: function(encodedData, buffers) {{
+      enqueue(() => r2p.loadColumns(encodedData, buffers, {self.load_options_js()}).then(t => {{
+        table = t;
+        rowIndex = r2p.rowIndex(table["{self.i_timestep_column}"]);
+        sortedUniqueTimesteps = rowIndex.keys;
+        onTableChanged();
+      }}));
+    }},
+    append: function(encodedData, buffers) {{
+      enqueue(() => r2p.loadColumns(encodedData, buffers, {self.load_options_js()}).then(tail => {{
+        const nPrev = table ? table["{self.i_timestep_column}"].length : 0;
+        table = r2p.appendColumns(table, tail);
+        rowIndex = rowIndex
+          ? rowIndex.extend(table["{self.i_timestep_column}"], nPrev)
+          : r2p.rowIndex(table["{self.i_timestep_column}"]);
+        sortedUniqueTimesteps = rowIndex.keys;
+        onTableChanged();
+      }}));
     }}
   }};
 
@@ -283,28 +537,33 @@ function(container) {{
 }}
 """
 
-    def dynamic_set_data_js(self, df):
+    def dynamic_set_data_js(self, df, columns=None):
         return f"""
 function(container) {{
-  container._r2pState.refresh({df_to_custom_json(df)});
+  container._r2pState.refresh({self.encoder.to_json(df, self.index_columns, columns)});
 }}
 """
 
+    def on_demand_js(self, timesteps_js, step_js, cache_size=64,
+                     prefetch=8):
+        return _on_demand_js(self, timesteps_js, step_js, cache_size,
+                             prefetch)
+
     @classmethod
     def time_control(cls, class_name, prefix="Step"):
         return _time_control(class_name, prefix)
 
     @classmethod
     def position_view(cls, class_name):
-        return f"""
+        return Control(f"""
 (function() {{
   const element = d3.select(container).selectAll(".{class_name}"),
         keys = element.nodes().map(e => e.getAttribute("data-key"));
 
   let component;
   onTableLoadedFunctions.push(() => {{
-    const globalMin = d3.min(keys, k => d3.min(table[k])),
-          globalMax = d3.max(keys, k => d3.max(table[k])),
+    const globalMin = d3.min(keys, k => r2p.extent(table[k])[0]),
+          globalMax = d3.max(keys, k => r2p.extent(table[k])[1]),
            min = globalMin;
            // Need a valid scale, so these need to be different.
            max = (globalMin != globalMax)
@@ -320,11 +579,11 @@ function(container) {{
       .call(component);
   }});
 }})();
-"""
+""")
 
     @classmethod
     def expression_view(cls, class_name, keys, text):
-        return f"""
+        return Control(f"""
 (function() {{
   const kernelExpr = `{text}`,
         kernelKeys = {repr(keys)},
@@ -339,19 +598,19 @@ function(container) {{
     d3.select(element).datum(model).call(component);
   }});
 }})();
-"""
+""", columns=keys)
 
     @classmethod
     def positive_scalar_view(cls, class_name, log_scale=False):
-        return f"""
+        return Control(f"""
 (function() {{
   const element = d3.select(container).selectAll(".{class_name}"),
         keys = element.nodes().map(e => e.getAttribute("data-key"));
 
   let component;
   onTableLoadedFunctions.push(() => {{
-    const globalMin = d3.min(keys, k => d3.min(table[k])),
-          globalMax = d3.max(keys, k => d3.max(table[k])),
+    const globalMin = d3.min(keys, k => r2p.extent(table[k])[0]),
+          globalMax = d3.max(keys, k => r2p.extent(table[k])[1]),
           min = globalMin,
           // Need a valid scale, so these need to be different.
           max = (globalMin != globalMax)
@@ -373,14 +632,20 @@ function(container) {{
       .call(component);
   }});
 }})();
-"""
+""")
 
 
 class DistributionSnapshot(ScriptBuilder):
-    def __init__(self, *controls):
+    def __init__(self, *controls, encoder=None, bins=None, log_bins=False,
+                 worker=False):
         self.controls = controls
+        self.encoder = encoder if encoder is not None else DEFAULT_ENCODER
+        self.worker = worker
+        if bins is not None:
+            self.encoder = HistogramEncoder.like(self.encoder, bins=bins,
+                                                 log_scale=log_bins)
 
-    def static_js(self, df):
+    def static_js(self, df, columns=None, data_js=None):
         controls_js = "\n".join(self.controls)
         return f"""
 function(container) {{
@@ -389,8 +654,10 @@ function(container) {{
 
   {controls_js}
 
-  table = r2p.parseColumns({df_to_custom_json(df)});
-  onTableLoadedFunctions.forEach(onloaded => onloaded());
+  r2p.loadColumns({self.table_js(df, columns, data_js)}, null, {self.load_options_js()}).then(t => {{
+    table = t;
+    r2p.measured("onTableLoaded", () => onTableLoadedFunctions.forEach(onloaded => onloaded()));
+  }});
 }}
 """
 
@@ -400,10 +667,19 @@ function(container) {{
 function(container) {{
   let onTableLoadedFunctions = [],
       table;
+  const enqueue = r2p.serialize();
   container._r2pState = {{
-    refresh: function(encodedData) {{
-      table = r2p.parseColumns(encodedData);
-      onTableLoadedFunctions.forEach(onloaded => onloaded(table));
+    refresh: function(encodedData, buffers) {{
+      enqueue(() => r2p.loadColumns(encodedData, buffers, {self.load_options_js()}).then(t => {{
+        table = t;
+        r2p.measured("onTableLoaded", () => onTableLoadedFunctions.forEach(onloaded => onloaded(table)));
+      }}));
+    }},
+    append: function(encodedData, buffers) {{
+      enqueue(() => r2p.loadColumns(encodedData, buffers, {self.load_options_js()}).then(tail => {{
+        table = r2p.appendColumns(table, tail);
+        r2p.measured("onTableLoaded", () => onTableLoadedFunctions.forEach(onloaded => onloaded(table)));
+      }}));
     }}
   }};
 
@@ -411,10 +687,10 @@ function(container) {{
 }}
 """
 
-    def dynamic_set_data_js(self, df):
+    def dynamic_set_data_js(self, df, columns=None):
         return f"""
 function(container) {{
-  container._r2pState.refresh({df_to_custom_json(df)});
+  container._r2pState.refresh({self.encoder.to_json(df, self.index_columns, columns)});
 }}
 """
 
@@ -422,13 +698,13 @@ function(container) {{
     def scalar_view(cls, class_name, log_scale=False,
                     min_override=None, max_override=None,
                     use_data_min=False, use_data_max=False):
-        return f"""
+        return Control(f"""
 (function() {{
   const element = d3.select(container).selectAll(".{class_name}"),
         keys = element.nodes().map(e => e.getAttribute("data-key"));
   onTableLoadedFunctions.push(() => {{
-    const globalMin = {min_override if min_override is not None else "d3.min(keys, k => d3.min(table[k]))"},
-          globalMax = {max_override if max_override is not None else "d3.max(keys, k => d3.max(table[k]))"},
+    const globalMin = {min_override if min_override is not None else "d3.min(keys, k => r2p.extent(table[k])[0])"},
+          globalMax = {max_override if max_override is not None else "d3.max(keys, k => r2p.extent(table[k])[1])"},
           min = globalMin,
           // Need a valid scale, so these need to be different.
           max = (globalMin != globalMax)
@@ -438,6 +714,7 @@ function(container) {{
     element
       .data(keys.map(k => table[k]))
       .call(r2p.scalarDistributionView()
+        .clock(r2p.animationClock(container))
         .scale(d3.{"scaleLog()" if log_scale else "scaleLinear()"}.domain([min, max]).range([0, 215]))
         {".exponentFormat(true)" if log_scale else ""}
         {".useDataMin(true)" if use_data_min else ""}
@@ -446,15 +723,60 @@ function(container) {{
         .fontSize(13));
   }});
 }})();
-"""
+""")
+
+
+    @classmethod
+    def density_view(cls, class_name, log_scale=False,
+                     min_override=None, max_override=None,
+                     use_data_min=False, use_data_max=False):
+        """
+        Like scalar_view, but draws the histograms sent when the builder is
+        given bins=N.
+        """
+        return Control(f"""
+(function() {{
+  const element = d3.select(container).selectAll(".{class_name}"),
+        keys = element.nodes().map(e => e.getAttribute("data-key"));
+  onTableLoadedFunctions.push(() => {{
+    const globalMin = {min_override if min_override is not None else 'd3.min(keys, k => table[k + "/edges"][0])'},
+          globalMax = {max_override if max_override is not None else 'd3.max(keys, k => table[k + "/edges"].at(-1))'},
+          min = globalMin,
+          max = globalMax;
+
+    element
+      .data(keys.map(k => ({{counts: table[k], edges: table[k + "/edges"]}})))
+      .call(r2p.scalarDistributionView()
+        .clock(r2p.animationClock(container))
+        .binned(true)
+        .scale(d3.{"scaleLog()" if log_scale else "scaleLinear()"}.domain([min, max]).range([0, 215]))
+        {".exponentFormat(true)" if log_scale else ""}
+        {".useDataMin(true)" if use_data_min else ""}
+        {".useDataMax(true)" if use_data_max else ""}
+        .height(12)
+        .fontSize(13));
+  }});
+}})();
+""")
 
 
 class DistributionListSnapshot(ScriptBuilder):
-    def __init__(self, *controls, i_config_column="i_config"):
+    def __init__(self, *controls, i_config_column="i_config",
+                 encoder=None, bins=None, log_bins=False, worker=False):
         self.controls = controls
+        self.encoder = encoder if encoder is not None else DEFAULT_ENCODER
+        self.worker = worker
+        if bins is not None:
+            self.encoder = HistogramEncoder.like(
+                self.encoder, bins=bins, log_scale=log_bins,
+                group_column=i_config_column)
         self.i_config_column = i_config_column
 
-    def static_js(self, df):
+    @property
+    def required_columns(self):
+        return (self.i_config_column,)
+
+    def static_js(self, df, columns=None, data_js=None):
         controls_js = "\n".join(self.controls)
         return f"""
 function(container) {{
@@ -465,34 +787,36 @@ function(container) {{
 
   {controls_js}
 
-  table = r2p.parseColumns({df_to_custom_json(df)});
-  iConfig = table["{self.i_config_column}"],
-  nConfigs = d3.max(iConfig) + 1,
-  onTableLoadedFunctions.forEach(onloaded => onloaded());
+  r2p.loadColumns({self.table_js(df, columns, data_js)}, null, {self.load_options_js()}).then(t => {{
+    table = t;
+    iConfig = table["{self.i_config_column}"];
+    nConfigs = r2p.extent(iConfig)[1] + 1;
+    r2p.measured("onTableLoaded", () => onTableLoadedFunctions.forEach(onloaded => onloaded()));
+  }});
 }}
 """
 
     def dynamic_initialize_js(self):
         raise NotImplementedError()
 
-    def dynamic_set_data_js(self, df):
+    def dynamic_set_data_js(self, df, columns=None):
         return f"""
 function(container) {{
-  container._r2pState.refresh({rows2prose.web.df_to_custom_json(df)});
+  container._r2pState.refresh({self.encoder.to_json(df, self.index_columns, columns)});
 }}
 """
 
     @classmethod
     def scalar_view(cls, class_name, width=215, height=35, point_radius=2, log_scale=False,
                     min_override=None, max_override=None, use_data_min=False, use_data_max=False):
-        return f"""
+        return Control(f"""
 (function() {{
   const element = d3.select(container).selectAll(".{class_name}"),
         keys = element.nodes().map(e => e.getAttribute("data-key"));
 
   onTableLoadedFunctions.push(() => {{
-    const globalMin = {min_override if min_override is not None else "d3.min(keys, k => d3.min(table[k]))"},
-          globalMax = {max_override if max_override is not None else "d3.max(keys, k => d3.max(table[k]))"},
+    const globalMin = {min_override if min_override is not None else "d3.min(keys, k => r2p.extent(table[k])[0])"},
+          globalMax = {max_override if max_override is not None else "d3.max(keys, k => r2p.extent(table[k])[1])"},
           min = globalMin,
           // Need a valid scale, so these need to be different.
           max = (globalMin != globalMax)
@@ -502,7 +826,7 @@ function(container) {{
     element
       .data(keys.map(k => {{
         const values = table[k],
-              [min, max] = d3.extent(values);
+              [min, max] = r2p.extent(values);
         return {{ values: values, iConfigs: iConfig, nConfigs, min, max }};
       }}))
       .call(r2p.scalarDistributionListView()
@@ -515,44 +839,79 @@ function(container) {{
         .fontSize("13px"));
   }});
 }})();
-"""
+""")
+
+
+    @classmethod
+    def density_view(cls, class_name, width=215, height=35, log_scale=False,
+                     min_override=None, max_override=None,
+                     use_data_min=False, use_data_max=False):
+        """
+        Like scalar_view, but draws the per-config histograms sent when the
+        builder is given bins=N.
+        """
+        return Control(f"""
+(function() {{
+  const element = d3.select(container).selectAll(".{class_name}"),
+        keys = element.nodes().map(e => e.getAttribute("data-key"));
+
+  onTableLoadedFunctions.push(() => {{
+    const globalMin = {min_override if min_override is not None else 'd3.min(keys, k => table[k + "/edges"][0])'},
+          globalMax = {max_override if max_override is not None else 'd3.max(keys, k => table[k + "/edges"].at(-1))'},
+          min = globalMin,
+          max = globalMax;
+
+    element
+      .data(keys.map(k => {{
+        const counts = table[k],
+              edges = table[k + "/edges"],
+              [min, max] = r2p.histogramExtent(counts, edges);
+        return {{ counts, edges, iConfigs: iConfig, nConfigs, min, max }};
+      }}))
+      .call(r2p.scalarDistributionListView()
+        .binned(true)
+        .scale(d3.{"scaleLog()" if log_scale else "scaleLinear()"}.domain([min, max]).range([0, {width}]))
+        {".exponentFormat(true)" if log_scale else ""}
+        {".useDataMin(true)" if use_data_min else ""}
+        {".useDataMax(true)" if use_data_max else ""}
+        .height({height})
+        .fontSize("13px"));
+  }});
+}})();
+""")
 
 
 class DistributionTimeline(ScriptBuilder):
-    def __init__(self, *controls, i_timestep_column="i_timestep"):
+    def __init__(self, *controls, i_timestep_column="i_timestep",
+                 encoder=None, bins=None, log_bins=False, worker=False):
         self.controls = controls
+        self.encoder = encoder if encoder is not None else DEFAULT_ENCODER
+        self.worker = worker
+        if bins is not None:
+            self.encoder = HistogramEncoder.like(
+                self.encoder, bins=bins, log_scale=log_bins,
+                group_column=i_timestep_column)
         self.i_timestep_column = i_timestep_column
 
-    def static_js(self, df):
+    @property
+    def index_columns(self):
+        return (self.i_timestep_column,)
+
+    def static_js(self, df, columns=None, data_js=None):
         controls_js = "\n".join(self.controls)
         return f"""
 function(container) {{
-  function extractRows(arr, iRows) {{
-    let selected = arr.slice(0, iRows.length);
-    iRows.forEach((iRow, i) => {{
-      selected[i] = arr[iRow];
-    }});
-    return selected;
-  }}
-
   let renderRowsFunctions = [],
       renderTimeFunctions = [],
       onTableLoadedFunctions = [],
       table,
+      rowIndex,
       sortedUniqueTimesteps;
 
   const timeStateComponent = r2p.hiddenTimeState()
         .renderTimestep(t => {{
-          const iTimestep = table["{self.i_timestep_column}"];
-
-          let iRows = [];
-          for (let i = 0; i < iTimestep.length; i++) {{
-            if (iTimestep[i] == t) {{
-              iRows.push(i);
-            }}
-          }}
-
-          renderRowsFunctions.forEach(render => render(iRows));
+          const iRows = rowIndex.rows(t);
+          r2p.measured("renderRows", () => renderRowsFunctions.forEach(render => render(iRows)));
         }})
         .renderTime((sortedUniqueTimesteps, index) => {{
           renderTimeFunctions.forEach(render => render(sortedUniqueTimesteps, index));
@@ -560,12 +919,14 @@ function(container) {{
 
   {controls_js}
 
-  table = r2p.parseColumns({df_to_custom_json(df)});
-  sortedUniqueTimesteps = table["{self.i_timestep_column}"]
-    .sort(d3.ascending).filter((d, i, a) => !i || d != a[i - 1]);
-  onTableLoadedFunctions.forEach(onloaded => onloaded());
+  r2p.loadColumns({self.table_js(df, columns, data_js)}, null, {self.load_options_js()}).then(t => {{
+    table = t;
+    rowIndex = r2p.rowIndex(table["{self.i_timestep_column}"]);
+    sortedUniqueTimesteps = rowIndex.keys;
+    r2p.measured("onTableLoaded", () => onTableLoadedFunctions.forEach(onloaded => onloaded()));
 
-  d3.select(container).datum(sortedUniqueTimesteps).call(timeStateComponent);
+    d3.select(container).datum(sortedUniqueTimesteps).call(timeStateComponent);
+  }});
 }}
 """
 
@@ -573,45 +934,47 @@ function(container) {{
         controls_js = "\n".join(self.controls)
         return f"""
 function(container) {{
-  function extractRows(arr, iRows) {{
-    let selected = arr.slice(0, iRows.length);
-    iRows.forEach((iRow, i) => {{
-      selected[i] = arr[iRow];
-    }});
-    return selected;
-  }}
-
   let renderRowsFunctions = [],
       renderTimeFunctions = [],
       onTableLoadedFunctions = [],
       table,
+      rowIndex,
       sortedUniqueTimesteps;
 
-  container._r2pState = {{
-    refresh: function(encodedData) {{
-      table = r2p.parseColumns(encodedData);
-      sortedUniqueTimesteps = table["{self.i_timestep_column}"]
-        .sort(d3.ascending).filter((d, i, a) => !i || d != a[i - 1]);
-
-      onTableLoadedFunctions.forEach(onloaded => onloaded(table));
-
-      d3.select(container).datum(sortedUniqueTimesteps).call(
-        r2p.hiddenTimeState()
+  const timeStateComponent = r2p.hiddenTimeState()
         .renderTimestep(t => {{
-          const iTimestep = table["{self.i_timestep_column}"];
-
-          let iRows = [];
-          for (let i = 0; i < iTimestep.length; i++) {{
-            if (iTimestep[i] == t) {{
-              iRows.push(i);
-            }}
-          }}
-
-          renderRowsFunctions.forEach(render => render(iRows));
+          const iRows = rowIndex.rows(t);
+          r2p.measured("renderRows", () => renderRowsFunctions.forEach(render => render(iRows)));
         }})
-       .renderTime((sortedUniqueTimesteps, index) => {{
+        .renderTime((sortedUniqueTimesteps, index) => {{
           renderTimeFunctions.forEach(render => render(sortedUniqueTimesteps, index));
-       }}));
+        }});
+
+  function onTableChanged() {{
+    r2p.measured("onTableLoaded", () => onTableLoadedFunctions.forEach(onloaded => onloaded(table)));
+    d3.select(container).datum(sortedUniqueTimesteps).call(timeStateComponent);
+  }}
+
+  const enqueue = r2p.serialize();
+  container._r2pState = {{
+    refresh: function(encodedData, buffers) {{
+      enqueue(() => r2p.loadColumns(encodedData, buffers, {self.load_options_js()}).then(t => {{
+        table = t;
+        rowIndex = r2p.rowIndex(table["{self.i_timestep_column}"]);
+        sortedUniqueTimesteps = rowIndex.keys;
+        onTableChanged();
+      }}));
+    }},
+    append: function(encodedData, buffers) {{
+      enqueue(() => r2p.loadColumns(encodedData, buffers, {self.load_options_js()}).then(tail => {{
+        const nPrev = table ? table["{self.i_timestep_column}"].length : 0;
+        table = r2p.appendColumns(table, tail);
+        rowIndex = rowIndex
+          ? rowIndex.extend(table["{self.i_timestep_column}"], nPrev)
+          : r2p.rowIndex(table["{self.i_timestep_column}"]);
+        sortedUniqueTimesteps = rowIndex.keys;
+        onTableChanged();
+      }}));
     }}
   }};
 
@@ -620,13 +983,18 @@ function(container) {{
 }}
 """
 
-    def dynamic_set_data_js(self, df):
+    def dynamic_set_data_js(self, df, columns=None):
         return f"""
 function(container) {{
-  container._r2pState.refresh({rows2prose.web.df_to_custom_json(df)});
+  container._r2pState.refresh({self.encoder.to_json(df, self.index_columns, columns)});
 }}
 """
 
+    def on_demand_js(self, timesteps_js, step_js, cache_size=64,
+                     prefetch=8):
+        return _on_demand_js(self, timesteps_js, step_js, cache_size,
+                             prefetch)
+
     @classmethod
     def time_control(cls, class_name, prefix="Step"):
         return _time_control(class_name, prefix)
@@ -635,21 +1003,22 @@ function(container) {{
     def scalar_view(cls, class_name, width=215, log_scale=False,
                     min_override=None, max_override=None,
                     use_data_min=False, use_data_max=False):
-        return f"""
+        return Control(f"""
 (function() {{
   const element = d3.select(container).selectAll(".{class_name}"),
         keys = element.nodes().map(e => e.getAttribute("data-key"));
 
   let component;
   onTableLoadedFunctions.push(() => {{
-    const globalMin = {min_override if min_override is not None else "d3.min(keys, k => d3.min(table[k]))"},
-          globalMax = {max_override if max_override is not None else "d3.max(keys, k => d3.max(table[k]))"},
+    const globalMin = {min_override if min_override is not None else "d3.min(keys, k => r2p.extent(table[k])[0])"},
+          globalMax = {max_override if max_override is not None else "d3.max(keys, k => r2p.extent(table[k])[1])"},
           min = globalMin,
           // Need a valid scale, so these need to be different.
           max = (globalMin != globalMax)
           ? globalMax
           : {"globalMax * 10" if log_scale else "globalMax + 1"};  // Visualize each point as a low value.
     component = r2p.scalarDistributionView()
+      .clock(r2p.animationClock(container))
       .scale(d3.{"scaleLog()" if log_scale else "scaleLinear()"}.domain([min, max]).range([0, {width}]))
       {".exponentFormat(true)" if log_scale else ""}
       {".useDataMin(true)" if use_data_min else ""}
@@ -660,63 +1029,533 @@ function(container) {{
 
   renderRowsFunctions.push(function (iRows) {{
     element
-      .data(keys.map(k => extractRows(table[k], iRows)))
+      .data(keys.map(k => r2p.extractRows(table[k], iRows)))
       .call(component);
   }});
 }})();
-"""
+""")
+
+
+    @classmethod
+    def density_view(cls, class_name, width=215, log_scale=False,
+                     min_override=None, max_override=None,
+                     use_data_min=False, use_data_max=False):
+        """
+        Like scalar_view, but draws the per-timestep histograms sent when
+        the builder is given bins=N.
+        """
+        return Control(f"""
+(function() {{
+  const element = d3.select(container).selectAll(".{class_name}"),
+        keys = element.nodes().map(e => e.getAttribute("data-key"));
+
+  let component;
+  onTableLoadedFunctions.push(() => {{
+    const globalMin = {min_override if min_override is not None else 'd3.min(keys, k => table[k + "/edges"][0])'},
+          globalMax = {max_override if max_override is not None else 'd3.max(keys, k => table[k + "/edges"].at(-1))'},
+          min = globalMin,
+          max = globalMax;
+    component = r2p.scalarDistributionView()
+      .clock(r2p.animationClock(container))
+      .binned(true)
+      .scale(d3.{"scaleLog()" if log_scale else "scaleLinear()"}.domain([min, max]).range([0, {width}]))
+      {".exponentFormat(true)" if log_scale else ""}
+      {".useDataMin(true)" if use_data_min else ""}
+      {".useDataMax(true)" if use_data_max else ""}
+      .height(12)
+      .fontSize(13);
+  }});
+
+  renderRowsFunctions.push(function (iRows) {{
+    // One row per timestep, holding each key's histogram for it.
+    element
+      .data(keys.map(k => {{
+        const edges = table[k + "/edges"],
+              nBins = edges.length - 1;
+        return {{
+          counts: table[k].subarray(iRows[0] * nBins, (iRows[0] + 1) * nBins),
+          edges
+        }};
+      }}))
+      .call(component);
+  }});
+}})();
+""")
 
 
-def full_html(body):
+def page_head(bundle_src=None):
     return f"""<!doctype html>
 <html>
 <head>
-{header_content()}
+{header_content(bundle_src=bundle_src)}
 </head>
 <body>
-{body}
+"""
+
+
+PAGE_TAIL = """
 </body>
 </html>"""
 
 
-def static(df, html, script):
-    element_id = str(uuid.uuid1())
+def full_html(body, bundle_src=None):
+    return page_head(bundle_src) + body + PAGE_TAIL
+
+
+def warn_missing_columns(df, columns):
+    """
+    Warns about columns, as returned by ScriptBuilder.referenced_columns,
+    that df lacks.
+    """
+    if columns is None:
+        return
+    missing = sorted(str(c) for c in set(columns) - set(column_names(df)))
+    if missing:
+        warnings.warn("Columns referenced by the HTML or controls are "
+                      f"missing from the data: {', '.join(missing)}",
+                      stacklevel=3)
+
+
+def script_safe(text):
+    """
+    Escapes JSON for a <script> element, where "</script>" inside a column
+    name would end the element early.
+    """
+    return text.replace("</", "<\\/")
+
+
+def write_payload_script(write, element_id, df, script, columns=None):
+    """
+    Streams a <script type="application/json"> holding df's encoded
+    columns through write(), which the browser stores without parsing or
+    running it.
+    """
+    write(f'<script type="application/json" id="{element_id}-data">')
+    script.encoder.write_json(df, lambda text: write(script_safe(text)),
+                              script.index_columns, columns)
+    write('</script>')
+
+
+def payload_script(element_id, df, script, columns=None):
+    out = io.StringIO()
+    write_payload_script(out.write, element_id, df, script, columns)
+    return out.getvalue()
+
+
+def payload_js(element_id):
+    """
+    JS for the columns held by element_id's payload_script.
+    """
+    return ("JSON.parse(document.getElementById("
+            f'"{element_id}-data").textContent)')
+
+
+def instrument_js(stats):
+    """
+    JS that turns on r2p's performance measures (see r2p.stats) for a block
+    rendered while stats are collected, given its BlockStats or None.
+    """
+    return "  r2p.instrument();\n" if stats is not None else ""
+
+
+class ColumnRegistry:
+    """
+    Shares columns between the blocks of a page, or the outputs of a
+    notebook. Pass the same registry to several static or display calls,
+    and each distinct encoded column is emitted once, in a
+    <script type="application/json" id="r2p-column-..."> tag, which blocks
+    reference by id. The browser decodes each column once, on first use,
+    and shares the typed array between the blocks, until no rendered block
+    holds it.
+
+    Columns are identified by a digest of their encoded bytes. Pass
+    data_id to name the data yourself, so that later blocks skip encoding
+    it again; the data under one data_id must not change.
+    """
+    def __init__(self):
+        self.emitted = set()
+        self._refs = {}
+
+    def column_tag(self, ref, entry, encoder):
+        out = io.StringIO()
+        encoder.write_entry(entry, out.write)
+        return (f'<script type="application/json" id="r2p-column-{ref}">'
+                f'{script_safe(out.getvalue())}'
+                '</script>')
+
+    def encode(self, df, encoder, index_columns=(), columns=None,
+               data_id=None):
+        """
+        Returns (data_js, tags): the JS for df's columns as references, to
+        pass to static_js, and the HTML for the columns not yet emitted.
+        """
+        key = None
+        if data_id is not None:
+            key = (data_id, encoder, tuple(index_columns),
+                   None if columns is None else frozenset(columns))
+        refs = self._refs.get(key) if key is not None else None
+
+        tags = []
+        if refs is None:
+            refs = {}
+            for name, entry in encoder.entries(df, index_columns, columns):
+                ref = entry_digest(entry)
+                refs[str(name)] = ref
+                if ref not in self.emitted:
+                    self.emitted.add(ref)
+                    tags.append(self.column_tag(ref, entry, encoder))
+            if key is not None:
+                self._refs[key] = refs
+
+        data_js = script_safe(json.dumps({name: {"ref": ref}
+                                          for name, ref in refs.items()}))
+        return data_js, "\n".join(tags)
+
+
+class CompiledScript:
+    """
+    A script's render function for one html, generated once and registered
+    on the page under key as a template that takes a block's columns, so
+    that a block only needs to emit its data and the key.
+    """
+    def __init__(self, script, html):
+        self.script = script
+        self.html = html
+        self.columns = script.referenced_columns(html)
+        self.js = script.static_js(None, self.columns, "data").strip()
+        self.key = hashlib.sha256(self.js.encode('utf-8')).hexdigest()[:16]
+
+    def definition_js(self):
+        """
+        JS that registers the template, which must run before any block
+        that uses it.
+        """
+        return f"""
+  r2p.registerTemplate("{self.key}", function(data) {{
+    return {self.js};
+  }});
+"""
+
+    def render_js(self, data_js):
+        """
+        JS for the render function of a block whose columns are data_js,
+        as passed to static_js.
+        """
+        return f'r2p.template("{self.key}")({data_js})'
+
+
+class TemplateCache:
+    """
+    Compiles each (html, script) pair once and registers its template once
+    per page, or notebook. Pass the same cache to several static or display
+    calls, and blocks that share html and controls reuse both the Python
+    string generation and the browser's parsed code; each block emits only
+    its data and the template's key.
+    """
+    def __init__(self):
+        self.emitted = set()
+        self._compiled = {}
+
+    def compile(self, html, script):
+        """
+        Returns (compiled, definition_js), where definition_js registers
+        the template if this page doesn't have it yet, or is empty.
+        """
+        compiled = self._compiled.get((html, script))
+        if compiled is None:
+            compiled = script.compile(html)
+            self._compiled[(html, script)] = compiled
+        if compiled.key in self.emitted:
+            return compiled, ""
+        self.emitted.add(compiled.key)
+        return compiled, compiled.definition_js()
+
+
+def lazy_render_js(element_id, script, columns=None, release=False,
+                   data_js=None, compiled=None):
+    """
+    JS that renders the container element_id once it nears the viewport,
+    reading its columns from data_js or else from its payload_script. With
+    release, the block is reset, freeing its decoded table, whenever it
+    scrolls far away, and is rendered again on return. With a
+    CompiledScript, its registered template renders the block.
+    """
+    if data_js is None:
+        data_js = payload_js(element_id)
+    if compiled is not None:
+        render_js = f"container => {compiled.render_js(data_js)}(container)"
+    else:
+        render_js = script.static_js(None, columns, data_js)
     return f"""
+  r2p.renderWhenVisible(
+    document.getElementById("{element_id}"),
+    {render_js},
+    {{release: {"true" if release else "false"}}});
+"""
+
+
+def static(df, html, script, lazy=False, release=False, registry=None,
+           data_id=None, templates=None):
+    """
+    Returns the HTML for html rendered with df's columns. With lazy, the
+    data stays unparsed and the block unrendered until it scrolls into view
+    (see lazy_render_js), which keeps pages with many blocks responsive.
+    With a ColumnRegistry, columns already on the page aren't sent again,
+    and with a TemplateCache, neither is the code of blocks that share
+    html and controls.
+    """
+    compiled, definition_js = None, ""
+    if templates is not None:
+        compiled, definition_js = templates.compile(html, script)
+    return _static(df, html, script, lazy, release, registry, data_id,
+                   compiled, definition_js)
+
+
+def _static(df, html, script, lazy=False, release=False, registry=None,
+            data_id=None, compiled=None, definition_js=""):
+    element_id = str(uuid.uuid1())
+    columns = (compiled.columns if compiled is not None
+               else script.referenced_columns(html))
+    warn_missing_columns(df, columns)
+    with instrument.block("static", row_count(df)) as stats:
+        data_js, tags = None, ""
+        if registry is not None:
+            data_js, tags = registry.encode(df, script.encoder,
+                                            script.index_columns, columns,
+                                            data_id)
+            if stats is not None:
+                stats.payload_bytes += len(tags) + len(data_js)
+        if lazy:
+            payload = (payload_script(element_id, df, script, columns)
+                       if data_js is None else "")
+            out = f"""{tags}
 <div id="{element_id}">{html}</div>
+{payload}
 <script>
 (function() {{
-  let render = {script.static_js(df)};
+{instrument_js(stats)}{definition_js}
+{lazy_render_js(element_id, script, columns, release, data_js, compiled)}
+}})();
+</script>
+"""
+        else:
+            if compiled is not None:
+                render_js = compiled.render_js(
+                    script.table_js(df, columns, data_js))
+            else:
+                render_js = script.static_js(df, columns, data_js)
+            out = f"""{tags}
+<div id="{element_id}">{html}</div>
+<script>
+(function() {{
+{instrument_js(stats)}{definition_js}
+  let render = {render_js};
   render(document.getElementById("{element_id}"));
 }})();
 </script>
 """
+        if stats is not None:
+            stats.finish(len(out), len(html))
+    return out
+
+
+def _static_block(args):
+    return _static(*args)
+
+
+def _static_block_with_stats(args):
+    with collect_stats() as stats:
+        return _static(*args), stats.blocks
+
+
+def iter_static_many(blocks, max_workers=None, lazy=False, release=False,
+                     templates=None):
+    """
+    Yields static(df, html, script, lazy, release, templates=templates)
+    for each (df, html, script) in blocks, in order, encoding blocks in
+    parallel across max_workers processes. Templates are compiled in this
+    process. Each block's DataFrame and script are pickled to a worker
+    process, and its HTML is held in memory until it is yielded. While
+    stats are collected, the workers' are collected with them.
+    """
+    def block_args():
+        for df, html, script in blocks:
+            compiled, definition_js = None, ""
+            if templates is not None:
+                compiled, definition_js = templates.compile(html, script)
+            yield (df, html, script, lazy, release, None, None, compiled,
+                   definition_js)
+
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers) as executor:
+        if not instrument.collecting():
+            yield from executor.map(_static_block, block_args())
+            return
+        for html, blocks in executor.map(_static_block_with_stats,
+                                         block_args()):
+            instrument.add_blocks(blocks)
+            yield html
+
+
+def static_many(blocks, max_workers=None, lazy=False, release=False,
+                templates=None):
+    """
+    Returns the list of iter_static_many's blocks.
+    """
+    return list(iter_static_many(blocks, max_workers, lazy, release,
+                                 templates))
 
 
 class Updater:
-    def __init__(self, container_element_id, get_setdata_js):
+    def __init__(self, container_element_id, get_setdata_js,
+                 get_appenddata_js=None, columns=None):
         self.container_element_id = container_element_id
         self.get_setdata_js = get_setdata_js
+        self.get_appenddata_js = get_appenddata_js
+        self.columns = columns
 
-    def set_data(self, df):
+    def _script(self, js):
         return f"""
 <script>
 (function() {{
-  let render = {self.get_setdata_js(df)};
+  let render = {js};
   render(document.getElementById("{self.container_element_id}"));
 }})();
 </script>
 """
 
+    def _recorded_script(self, kind, get_js, df):
+        with instrument.block(kind, row_count(df)) as stats:
+            out = self._script(get_js(df, self.columns))
+            if stats is not None:
+                stats.finish(len(out))
+        return out
+
+    def set_data(self, df):
+        warn_missing_columns(df, self.columns)
+        return self._recorded_script("set_data", self.get_setdata_js, df)
+
+    def append_rows(self, df_tail):
+        """
+        Returns a script that appends df_tail's rows to the displayed table,
+        sending only the new rows.
+        """
+        warn_missing_columns(df_tail, self.columns)
+        return self._recorded_script("append_rows", self.get_appenddata_js,
+                                     df_tail)
+
 
 def dynamic(html, script):
+    """
+    Returns (html, updater) for a page that is updated by appending the
+    updater's <script>s to it. To push updates from a long-running process
+    to a browser, use rows2prose.server.LiveServer instead.
+    """
     element_id = str(uuid.uuid1())
     s = f"""
 <div id="{element_id}">{html}</div>
 <script>
 (function() {{
-  let render = {script.dynamic_initialize_js(df)};
+  let render = {script.dynamic_initialize_js()};
   render(document.getElementById("{element_id}"));
 }})();
 </script>
 """
-    return s, Updater(element_id, script.dynamic_set_data_js)
+    return s, Updater(element_id, script.dynamic_set_data_js,
+                      script.dynamic_append_data_js,
+                      script.referenced_columns(html))
+
+
+class ReportWriter:
+    """
+    Writes a page of rows2prose blocks to a file as they are produced, so
+    that exporting a large report never holds the page, or more than one
+    column's encoding, in memory:
+
+        with ReportWriter("report.html") as report:
+            report.write("<h1>Results</h1>")
+            report.static(df, html, script)
+
+    file is a path or a text file object. Each block's columns are streamed
+    into a <script type="application/json"> tag in base64 chunks, straight
+    from the DataFrame's arrays. Blocks share compiled templates (see
+    TemplateCache), so each distinct html and script's code is written
+    once.
+    """
+    def __init__(self, file, bundle_src=None):
+        self.file = file
+        self.bundle_src = bundle_src
+        self.templates = TemplateCache()
+        self._f = None
+
+    def __enter__(self):
+        if isinstance(self.file, (str, os.PathLike)):
+            self._f = open(self.file, "w", encoding="utf-8")
+        else:
+            self._f = self.file
+        self._f.write(page_head(self.bundle_src))
+        return self
+
+    def __exit__(self, *exc_info):
+        self._f.write(PAGE_TAIL)
+        if self._f is not self.file:
+            self._f.close()
+        self._f = None
+
+    def write(self, html):
+        """
+        Writes html, e.g. headings or prose between blocks, to the page.
+        """
+        self._f.write(html)
+
+    def static(self, df, html, script, lazy=False, release=False):
+        """
+        Writes a block like rows2prose.web.static(df, html, script, lazy,
+        release) would return.
+        """
+        element_id = str(uuid.uuid1())
+        compiled, definition_js = self.templates.compile(html, script)
+        columns = compiled.columns
+        warn_missing_columns(df, columns)
+        with instrument.block("static", row_count(df)) as stats:
+            write = self._f.write
+            if stats is not None:
+                written = [0]
+
+                def write(text):
+                    written[0] += len(text)
+                    self._f.write(text)
+
+            write(f"""
+<div id="{element_id}">{html}</div>
+""")
+            write_payload_script(write, element_id, df, script, columns)
+            if lazy:
+                render_js = lazy_render_js(element_id, script, columns,
+                                           release, compiled=compiled)
+            else:
+                render_js = f"""
+  let render = {compiled.render_js(payload_js(element_id))};
+  render(document.getElementById("{element_id}"));
+"""
+            write(f"""
+<script>
+(function() {{
+{instrument_js(stats)}{definition_js}
+{render_js}
+}})();
+</script>
+""")
+            if stats is not None:
+                stats.finish(written[0], len(html))
+
+    def static_many(self, blocks, max_workers=None, lazy=False,
+                    release=False):
+        """
+        Writes a block for each (df, html, script) in blocks, encoding them
+        in parallel across processes with iter_static_many. Unlike static,
+        each block's HTML is built in memory before it is written.
+        """
+        for block in iter_static_many(blocks, max_workers, lazy, release,
+                                      self.templates):
+            self._f.write(block)
@@ -6,6 +6,7 @@ setup(name="rows2prose",
       author="Marcus Lewis",
       url="https://rows2prose.org/",
       packages=find_packages(),
+      python_requires=">=3.9",
       package_data={'rows2prose': ['rows2prose/package_data/*',]},
       include_package_data=True,
       zip_safe=False,
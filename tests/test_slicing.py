@@ -0,0 +1,25 @@
+import base64
+import json
+
+import numpy as np
+import pytest
+
+from rows2prose.encoding import ColumnEncoder
+from rows2prose.slicing import TimestepSlicer
+
+
+@pytest.mark.parametrize("precision", ["float32", "uint16", "uint8"])
+def test_timesteps_json_is_exact_under_lossy_precision(precision):
+    # Wall-clock timestamps, which neither float32 nor 256 codes can tell
+    # apart.
+    timesteps = 1.7e9 + np.arange(100) * 0.25
+    df = {"i_timestep": np.repeat(timesteps, 3),
+          "x": np.arange(300, dtype=np.float64)}
+    slicer = TimestepSlicer(df, encoder=ColumnEncoder(precision=precision))
+
+    entry = json.loads(slicer.timesteps_json())["i_timestep"]
+    decoded = np.frombuffer(base64.b64decode(entry["data"]),
+                            dtype=entry["type"])
+    np.testing.assert_array_equal(decoded, timesteps)
+    for t in decoded:
+        assert len(slicer.step(t)["x"]) == 3